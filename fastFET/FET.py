@@ -1,13 +1,15 @@
 import ctypes
-from operator import itemgetter
 import os
 import re, glob
 import sys
 import time
 import inspect
+import hashlib
+import contextlib
 import datetime as dt
 
 import jsonpath, csv, json
+import numpy as np
 import pandas as pd
 import polars as pl
 from tqdm import tqdm
@@ -18,6 +20,12 @@ from fastFET import utils
 from fastFET.MultiProcess import ProcessingQueue
 from fastFET.featTradition import *
 from fastFET.featGraph import GraphBase
+from fastFET.featPlan import FeatPlan
+from fastFET import featRollup
+from fastFET import featSketch
+from fastFET import featStore
+from fastFET import featPeer
+from fastFET.pfxTrie import PfxTrie
 from fastFET.collectData import GetRawData
 from fastFET.bgpToolKit import DownloadParseFiles
 from fastFET.drawing import simple_plot
@@ -27,10 +35,10 @@ logger= utils.logger
 
 class FET():
     
-    __slot__= [ 'slot', 'raw_dir', 'increment', 'duration', 'need_rib', 'need_tri', 'cut_peer', 'peer'
-                'raw_fields', 'featNms', 'feats_dict', 'midnode_res', 'pd_shared_topo', 
-                'first_ts', 'df_AS', 'df_peer_pfx', 'path_df_MOAS',
-                'preDF', 'pd_shared_preDF', 'df_res_graph']
+    __slot__= [ 'slot', 'raw_dir', 'increment', 'duration', 'need_rib', 'need_tri', 'cut_peer', 'peer', 'mirror', 'pre_cache', 'mem_budget', 'udf_check', 'partials', 'profile', 'store', 'by_peer', 'top_peers', 'ed_processes',
+                'raw_fields', 'featNms', 'sketch', 'feats_dict', 'midnode_res', 'pd_shared_topo', 
+                'first_ts', 'df_AS', 'as_state', 'pp_state', 'ed_engine', 'ed_pool', 'pfx_enc', 'path_enc', 'moas_sink', 'partial_store', 'peer_sink', 'grain',
+                'preDF', 'pd_shared_preDF', 'topo_index', 'df_res_graph', 'plan']
     
     def __init__(self, 
         slot= 60, 
@@ -38,6 +46,16 @@ class FET():
         increment= 4,
         duration= 2,
         cut_peer= True,
+        mirror= None,
+        pre_cache= True,
+        mem_budget= None,
+        udf_check= False,
+        partials= False,
+        profile= False,
+        store= False,
+        by_peer= False,
+        top_peers= None,
+        ed_processes= None,
     ) -> None:
         '''args 
             - slot: 统计特征数量的时间间隔(s)
@@ -45,6 +63,16 @@ class FET():
             - increment: 定义事件起止时间的增量(h)
             - duration: 当事件缺省结束时间时，将其指定为 start_time+ duration (h)
             - cut_peer: 在有图特征的情况，引入的rib表(>200万时)要裁剪为只有一个peer，以缓解内存压力以及提高计算效率。
+            - mirror: MRT数据源。默认从官网下载；离线运行时指定本地镜像，如`{'ris_root': '/data/ris', 'rv_root': '/data/routeviews'}`，详见`mrtSource.getSource()`
+            - pre_cache: 是否把各upds文件的预处理结果缓存于`raw_dir/cache/preprocessed/`，重复运行同一事件时跳过解析
+            - mem_budget: 每个chunk的内存预算(Gb)，默认为物理内存的1/4。chunk按time_bin切分，详见`utils.splitChunk()`
+            - udf_check: 基准测试模式。预处理与传统特征的计算中出现Python UDF时报错，见`utils.forbidUDFs()`。该检查不是线程安全的，只能经`monitorHandler()`处理本地文件，不能与`run()`或`ed_processes> 1`同时使用
+            - partials: 是否同时保存传统特征的可合并部分聚合(`raw_dir/partials/`)，之后可用`FET.rollup()`得到更粗时间粒度的特征而无需重算，见`featRollup`
+            - profile: 剖析模式。记录各流水线阶段、特征树节点、图特征的墙钟/CPU时间、行数、估计大小与RSS增量，`run()`结束时写出`raw_dir/profile/trace.json`(Chrome trace/Perfetto)与`summary.csv`并打印汇总表，见`utils.Profiler`
+            - store: 是否使用特征结果库(`raw_dir/results/`)。只计算库中缺失或代码版本已变更的特征(及其所需的中间节点), 与库中其余特征按列合并后写出csv，见`featStore`
+            - by_peer: 是否同时输出按peer的传统特征(每个(time_bin, peer_AS)一行)，写入`raw_dir/features/{date}__{evtNm}__{monitor}__peer.parquet`。与按time_bin的特征在同一次分组计算中得到，见`featPeer`
+            - top_peers: 按peer输出时只保留全程报文数最多的K个peer，默认全部
+            - ed_processes: 编辑距离的进程数。默认在本进程中计算；>1时`run()`期间共用一个spawn进程池(`featTradition.edPool`)，此时调用`run()`的脚本须置于`if __name__=="__main__":`之下
         '''
         
         self.slot= slot
@@ -52,23 +80,49 @@ class FET():
         self.increment= increment
         self.duration= duration
         self.cut_peer= cut_peer
+        self.mirror= mirror
+        self.pre_cache= pre_cache
+        self.mem_budget= mem_budget
+        self.udf_check= udf_check
+        self.partials= partials
+        self.profile= profile
+        self.store= store
+        self.by_peer= by_peer
+        self.top_peers= top_peers
+        self.ed_processes= ed_processes
+        if udf_check and (ed_processes or 1)> 1:
+            raise ValueError('`udf_check` hooks polars globally and is not thread-safe, it cannot be combined with `ed_processes> 1`')
 
         self.raw_fields= ['protocol','timestamp','msg_type','peer_IP','peer_AS','dest_pref','path','origin','next_hop','local_pref','MED','community','atomicAGG','aggregator']
         self.featNms= []        
+        self.sketch= {}         # 类别 -> `featSketch.Sketcher`, 见`setCustomFeats`
         self.feats_dict= {}     
         self.midnode_res= {}    
+        self.plan= None         # `featPlan.FeatPlan`, 随featNms编译一次
+        self.grain= None        # 叶子节点的分组键, 按peer输出时由`FeatPlan.run`临时设置
+        self.ed_pool= None      # 编辑距离的进程池(`featTradition.edPool`), 只在`ed_processes> 1`时于`run()`期间存在
         self.pd_shared_topo = multiprocessing.Value(ctypes.py_object)   
         self.pd_shared_preDF= multiprocessing.Value(ctypes.py_object)
 
     def getAllFeats(self):
         return featTree.getAllFeats()
 
-    def setCustomFeats(self, FEAT ):
+    def pfxTrie(self):
+        '''- 当前monitor已出现的全部前缀(`self.pfx_enc`)的前缀树, 用于查询子前缀/父前缀, 结果为`pfx_id`。详见`pfxTrie.PfxTrie`'''
+        return PfxTrie.fromEncoder(self.pfx_enc)
+
+    def setCustomFeats(self, FEAT, sketch= None ):
         '''3种方法自定义特征：
         - 全特征选取：FEAT= 'ALL'
         - 按类别选取：FEAT= [ 'volume', 'path', 'dynamic',  'editdistance', 'ratio', 'nodegraph', 'ASgraph' ]
         - 单特征选取：FEAT= [......] ,特征列表详见`self.getAllFeats()`
+
+        sketch: 按类别开启近似计数(默认为精确计数), 去重计数用HyperLogLog, 按键计数的最大值用Count-Min, 误差界见`featSketch`
+        - 默认参数：sketch= [ 'volume', 'path' ]
+        - 指定参数：sketch= { 'volume': {'p': 14, 'eps': 1e-3, 'delta': 1e-2} }
         '''
+        self.sketch= featSketch.sketchers(sketch)
+        self.plan= None
         all_catas= [ 'volume', 'path', 'dynamic',  'editdistance', 'ratio', 'nodegraph', 'ASgraph' ]
         all_feats= featTree.getAllFeats()
         if FEAT== "ALL":
@@ -89,70 +143,27 @@ class FET():
      
     @utils.timer
     def chunkForTradi(self, space):   #space8
-        '''采集传统特征'''
-         
-        ldf_list= []     
-        for path, subFeats in self.feats_dict.items():
-            if 'graph' not in path and 'ratio' not in path:      
-                cur_expr_chain=self.recurFunc(path )                      
-                path_end_little_dict= jsonpath.jsonpath(featTree.featTree, '$.'+ '.'.join( list(path) ))[0]
-                exprs= itemgetter(*subFeats)( path_end_little_dict )  
-                     
-                if isinstance(exprs, tuple):     
-                    exprs= list(exprs)           
-                else: exprs= [ exprs ]                
-
-                ldf_list.append( cur_expr_chain.agg( exprs ) )
-        if not len( ldf_list ):
-            logger.info(' '*space+'No tradition feats!!!')
-            return None        
-        else:
-            df_list= pl.collect_all( ldf_list )      
-            
-        #  串行
-        '''df_list= []     
-        for path, subFeats in self.feats_dict.items():
-            for feat in subFeats:
-                if 'graph' not in path and 'ratio' not in path:      
-                    t1= time.time()
-                    cur_expr_chain=self.recurFunc(path )     
-                    #t2= time.time()
-                    #logger.info(f' '*(space+2)+ f'func= `{path}_prepare`; cost={(t2-t1):.3f} sec')
-                                         
-                    path_end_little_dict= jsonpath.jsonpath(featTree.featTree, '$.'+ '.'.join( list(path) ))[0]
-                    #exprs= itemgetter(*subFeats)( path_end_little_dict )  
-                         
-                    #if isinstance(exprs, tuple):    
-                    #    exprs= list(exprs)          
-                    #else: exprs= [ exprs ]      
-
-                    cur_res= cur_expr_chain.agg( path_end_little_dict[feat] ).collect()
-                    logger.info(f' '*(space+2)+ f'func= `{feat}`; cost={(time.time()-t1):.3f} sec')
-                    df_list.append( cur_res )
-        '''
-                
+        '''采集传统特征: 执行编译好的特征DAG(`self.plan`), 各组结果按time_bin对齐后一次性横向拼接'''
+        if self.plan is None or self.plan.featNms!= list(self.featNms):
+            self.plan= FeatPlan(self.featNms, sketched= featSketch.sketchedFeats(self.featNms, self.sketch))
+        df_list= self.plan.run(self, self.preDF.lazy())
         if not len( df_list ):
             logger.info(' '*space+'No tradition feats!!!')
-            return None        
-        else:            
-            df_res_tradi= df_list[0]
-            for df_ in df_list[1:]:      
-                df_res_tradi= df_res_tradi.join(df_, on='time_bin')      
-            df_res_tradi.sort('time_bin', in_place= True)
-            
-            if ('ratio',) in self.feats_dict.keys():
-                ratio_feats= self.feats_dict[('ratio',)]
-                df_res_tradi= ratio(ratio_feats, featTree.featTree, df_res_tradi )
-            logger.info(' '*(space+2)+ 'result DF in tradition: %s' % str(df_res_tradi.shape))
-            
-            self.midnode_res.clear()
-            return  df_res_tradi        
+            return None
+
+        df_res_tradi= utils.alignHstack(df_list)
+        if ('ratio',) in self.feats_dict.keys():
+            ratio_feats= self.feats_dict[('ratio',)]
+            df_res_tradi= ratio(ratio_feats, featTree.featTree, df_res_tradi )
+        logger.info(' '*(space+2)+ 'result DF in tradition: %s' % str(df_res_tradi.shape))
+        
+        self.midnode_res.clear()
+        return  df_res_tradi        
 
     @utils.timer
     def chunkForGraph(self, space ):   #space8()
         '''图特征'''
-        nbJobs= self.pd_shared_preDF.value['time_bin'].unique()    
-        nbJobs.sort()
+        nbJobs= self.topo_index['bins']
 
         cores= utils.paralNum()
         logger.info(f' '*(space+2)+ f'`chunkForGraph`: processes: {cores}; cpus: {multiprocessing.cpu_count()}')
@@ -163,18 +174,18 @@ class FET():
         lock= multiprocessing.Lock()     
 
         if self.cut_peer:   
-            logger.info(' '*(space+2)+ 'sharing vars below processes: chunk_upds:%sMb,%s; pd_shared_topo:%sMb,%s' 
-                        % (utils.computMem(self.pd_shared_preDF.value), str(self.pd_shared_preDF.value.shape),
-                        utils.computMem(self.pd_shared_topo.value), str(self.pd_shared_topo.value.shape) ))
+            logger.info(' '*(space+2)+ 'sharing vars below processes: topo_index: %.3fMb, rows: %d, edges: %d' 
+                        % (sum([ v.nbytes for v in self.topo_index.values() if isinstance(v, np.ndarray) ])/1024**2,
+                        len(self.topo_index['key']), len(self.topo_index['e_row']) ))
             
             for j in nbJobs: 
-                pq1.addProcess( target= GraphBase.perSlotComput, args=(self.pd_shared_topo,self.pd_shared_preDF, shared_res, self.feats_dict, self.raw_dir, j, lock, space+4))
+                pq1.addProcess( target= GraphBase.perSlotComput, args=(self.topo_index, shared_res, self.feats_dict, self.raw_dir, j, lock, space+4))
             pq1.run()
         
         else:      
             logger.info(' '*(space+2)+ 'without parallel in build graph of each slot.')
             for j in nbJobs:
-                GraphBase.perSlotComput(self.pd_shared_topo,self.pd_shared_preDF, shared_res, self.feats_dict, self.raw_dir, j, None, space+4)
+                GraphBase.perSlotComput(self.topo_index, shared_res, self.feats_dict, self.raw_dir, j, None, space+4)
 
         for item in shared_res:
             self.df_res_graph.append(item)
@@ -182,46 +193,42 @@ class FET():
         del shared_res
     
     def filterInPreprocess(self):
-        ''''''
+        '''- 把`self.featNms`编译为预处理所需的最小列集合, 见`featTree.getRequiredCols`
+        - return {(list, set)}: `(读取的原始列, 预处理中计算的派生列)`'''
         self.feats_dict= utils.featsGrouping(featTree.featTree, self.featNms)
-        tag_path_unq, tag_oriAS= False, False
-        tag_path_len= bool( set(["path_len_max", "path_len_avg", "is_longer_path", "is_shorter_path"]) & set(self.featNms) )       
-        for k, v in self.feats_dict.items():
-            if 'path_AStotal' in k:
-                tag_path_unq= True
-            if 'vol_oriAS' in k:
-                tag_oriAS= True
-        tag_path_unq= tag_path_unq | bool( set(["path_unq_len_max", "path_unq_len_avg", "is_longer_unq_path","is_shorter_unq_path"]) & set(self.featNms) )
-        tag_oriAS= tag_oriAS | bool(set(["type_0", "type_1", "type_2", "type_3",] ) & set(self.featNms))
-
-        return tag_path_len, tag_path_unq, tag_oriAS
+        return featTree.getRequiredCols(self.featNms, graph= self.need_rib)
 
     @utils.timer
     def postInChunkHandler(self, space=6):   # space8
         ''''''
-        ldf_all_upd= ( pl.DataFrame(self.pd_shared_preDF.value).lazy()
+        ldf_all_upd= ( self.pd_shared_preDF.value.lazy()
             .groupby([ 'peer_AS', 'dest_pref' ])
             .tail(1)
             .select([
                 pl.col('peer_AS').cast(pl.Int64),
                 'dest_pref',
-                'path_raw'
+                'path_list'
             ] )   # 4 ->3列
         )
-        ldf_topo =  pl.DataFrame(self.pd_shared_topo.value).lazy()
+        ldf_topo =  self.pd_shared_topo.value.lazy()
             
         self.pd_shared_topo.value= ( pl.concat( [ ldf_topo , ldf_all_upd ])   
             .groupby( [ 'peer_AS', 'dest_pref' ] )
             .tail(1)
-        ).collect().to_pandas()
+        ).collect()
 
     @utils.timer
-    def chunkHandler(self, chunk ,modify_df_topo, space ): # space6
+    def chunkHandler(self, chunk ,modify_df_topo, space, bins= None ): # space6
         '''
         - arg:  chunk: upds文件名列表
-        - arg:  modify_df_topo: 是否需要更新pd_shared_topo'''
-        tag_path_len, tag_path_unq, tag_oriAS= self.filterInPreprocess()
-        self.preDF= preProcess(self.raw_fields, chunk, self.slot, self.first_ts, tag_path_len, tag_path_unq, tag_oriAS, 6)   
+        - arg:  modify_df_topo: 是否需要更新pd_shared_topo
+        - arg:  bins: 该chunk负责的time_bin区间`(lo, hi)`, 见`utils.splitChunk`'''
+        read_cols, need= self.filterInPreprocess()
+        cache_dir= self.raw_dir+ 'cache/preprocessed/' if self.pre_cache else None
+        guard= utils.forbidUDFs if self.udf_check else (lambda where: contextlib.nullcontext())
+        with guard('preProcess'):
+            self.preDF= preProcess(self.raw_fields, chunk, self.slot, self.first_ts, need, 6, cache_dir= cache_dir,
+                                    pfx_enc= self.pfx_enc, path_enc= self.path_enc, bins= bins, cols= read_cols)   
         
         self.df_res_graph= None  
         df_res_graph= None
@@ -233,14 +240,15 @@ class FET():
             else:
                 flt_expr= pl.col('peer_AS')!= -1
                 
-            self.pd_shared_preDF.value= ( self.preDF.lazy()
-                .filter( flt_expr )
+            # preDF中只有`pfx_id`, 图特征所需的prefix字符串在此解码
+            self.pd_shared_preDF.value= ( self.pfx_enc.decode( self.preDF.lazy().filter( flt_expr ), 'pfx_id', 'dest_pref')
                 .select([ 
                     pl.col('time_bin'),     
                     'peer_AS', 
                     'dest_pref', 
-                    'path_raw'])
-            ).collect().to_pandas()
+                    'path_list'])
+            ).collect()
+            self.topo_index= GraphBase.topoIndex(self.pd_shared_topo.value, self.pd_shared_preDF.value)
             
             manager0= multiprocessing.Manager()
             self.df_res_graph= manager0.list()
@@ -250,19 +258,21 @@ class FET():
         else:
             logger.info(' '*(space+2)+ 'No graph features!!!')
         
-        df_res_tradi= self.chunkForTradi(6)          
+        with guard('chunkForTradi'):
+            df_res_tradi= self.chunkForTradi(6)          
         if self.need_rib:
             _ = self.pd_shared_topo.value.shape
             graph_process.join()
+            self.topo_index= None
             
         if self.df_res_graph != None:   
             df_res_graph= []
             for item in self.df_res_graph:
                 df_res_graph.append( item.copy() )
-            df_res_graph= pl.DataFrame(df_res_graph).with_column(pl.col('time_bin').cast(pl.Int16))                  
+            df_res_graph= pl.DataFrame(df_res_graph).with_column(pl.col('time_bin').cast(utils.bin_dtype))                  
 
         df_res= self.preDF.groupby('time_bin').agg(
-            pl.col('timestamp').first().apply( lambda x: dt.datetime.fromtimestamp(x, tz= dt.timezone.utc).strftime('%Y/%m/%d %H:%M')).alias('date')
+            utils.tsFormat( pl.col('timestamp').first()).alias('date')
         )        
         for df_ in [df_res_tradi, df_res_graph]:
             if df_:
@@ -295,8 +305,8 @@ class FET():
             paths= paths_upd
             
         cols_AS_table = [('AS_number', pl.UInt32),('counts', pl.UInt32)]
-        cols_pp_table = [('index',pl.UInt32), ('timestamp', pl.Int32), ('time_bin',pl.Int16), ('msg_type',pl.Int8), ('peer_AS',pl.Int32), 
-                        ('dest_pref',pl.Utf8), ('path_raw',pl.Utf8), ('hash_attr',pl.UInt64), ('path_len',pl.Int64), ('path_unq_len',pl.Int64),
+        cols_pp_table = [('index',pl.UInt32), ('timestamp', pl.Int32), ('time_bin',utils.bin_dtype), ('msg_type',pl.Int8), ('peer_AS',pl.Int32), 
+                        ('pfx_id',pl.UInt32), ('path_id',pl.UInt32), ('hash_attr',pl.UInt64), ('path_len',pl.Int64), ('path_unq_len',pl.Int64),
                         ('origin_AS',pl.UInt32), ('tag_hist_cur', pl.Boolean)]
         try:
             self.first_ts= pl.scan_csv(paths[0], has_header=False, sep='|').fetch(1)[0,1]
@@ -304,18 +314,22 @@ class FET():
             self.first_ts= pl.scan_csv(paths[0]).fetch(1)[0,1]
             
         self.df_AS= pl.DataFrame( columns= cols_AS_table )   
+        self.as_state= utils.RareASState()
         
-        self.df_peer_pfx= pl.DataFrame( columns=cols_pp_table )
+        self.pp_state= utils.PeerPfxState( cols_pp_table )
+        self.ed_engine= featTradition.EditDistEngine(pool= self.ed_pool)
+        self.pfx_enc= utils.IdEncoder()
+        self.path_enc= utils.IdEncoder()
         
-        self.path_df_MOAS= ''
+        self.moas_sink= None
+        self.partial_store= None
+        self.peer_sink= None
         
         return paths   
 
+    @utils.timer
     def postHandler(self, save_path:str,  space= 6 , dont_label= None):    #space6
         '''标签'''
-        df= pl.read_csv( save_path )
-        df= ( df.groupby('date').sum().sort('time_bin').drop_nulls() )
-        
         if not dont_label:
             event_name= save_path.split('__')[1]
             sat_end= ''
@@ -330,6 +344,74 @@ class FET():
             sat_end= [ sat_end ]
             utils.labelMaker(save_path, sat_end)
 
+    def _chunksHandler(self, paths_actual, date, evtNm, monitor):
+        '''- 逐chunk计算`self.featNms`(`initHandler`之后), 依次产出各chunk的结果(`chunkHandler`)'''
+        # MOAS/type-N候选行: `./Dataset/MOAS/event={evtNm}/collector={monitor}/day={YYYYMMDD}/*.parquet`; 不计算相关特征时保留已有的
+        if any([ 'peerPfx_relateHijack' in path for path in utils.featsGrouping(featTree.featTree, self.featNms) ]):
+            self.moas_sink= utils.PartitionedSink(self.raw_dir+ 'MOAS/', by= ['day'], event= evtNm, collector= monitor)
+        if self.partials:
+            if featSketch.sketchedFeats(self.featNms, self.sketch):
+                raise ValueError('partials cannot be stored for sketched features, disable `sketch` or `partials`')
+            self.partial_store= featRollup.PartialStore(self.raw_dir+ 'partials/%s__%s__%s/' % (date ,evtNm, monitor),
+                                                        self.slot, self.first_ts, self.featNms)
+        if self.by_peer:
+            if featSketch.sketchedFeats(self.featNms, self.sketch):
+                raise ValueError('per-peer features cannot be computed for sketched features, disable `sketch` or `by_peer`')
+            self.peer_sink= featPeer.PeerSink(self.raw_dir+ 'features/%s__%s__%s__peer.parquet' % (date ,evtNm, monitor),
+                                              self.featNms, self.top_peers)
+
+        llist= utils.splitChunk(paths_actual, self.first_ts, self.slot, self.mem_budget)
+        chunk_num= len(llist)
+        for serialNum, (chunk, bins) in enumerate(llist) :
+            modify_df_topo= True if serialNum+1 < chunk_num else False  
+            logger.info(f' '*4+ f'chunk-{serialNum+1}/{len(llist)} ---------- `chunkHandler` started:')
+            yield self.chunkHandler(chunk, modify_df_topo, 4, bins )
+        if self.peer_sink is not None:
+            logger.info(' '*4+ f'per-peer feats: {self.peer_sink.close()}')
+
+    def featVersions(self, paths_upd) -> dict:
+        '''- 结果库中`self.featNms`各特征的当前版本(`featStore.featVersion`)。salt: 输入文件(文件名、大小、mtime)、预处理源码、cut_peer, 及该特征所在类别的sketch参数。
+        同名文件重新下载或解析后, 大小或mtime随之改变, 库中的旧结果即失效'''
+        files= sorted([ (os.path.basename(p), st.st_size, st.st_mtime_ns) for p, st in zip(paths_upd, map(os.stat, paths_upd)) ])
+        salt= '|'.join([ str(files), str(self.cut_peer),
+                         inspect.getsource(_preProcessLazy), inspect.getsource(utils.pathStr), inspect.getsource(utils.pathList) ])
+        res= {}
+        for f in self.featNms:
+            sk= [ (c, self.sketch[c]) for c in self.sketch if f in featSketch.cateFeats[c] ]
+            res[f]= featStore.featVersion(f, salt+ ''.join([ f'|sketch:{c},{k.p},{k.w},{k.d}' for c, k in sk ]))
+        return res
+
+    def _storeHandler(self, paths_upd, real_sat_time, path_rib, evtNm, monitor, dont_label):
+        '''- `store=True`时的`monitorHandler`: 只计算结果库中缺失的特征(及ratio等依赖), 存入结果库, 再由库中的全部目标特征写出csv'''
+        rs= featStore.ResultStore(self.raw_dir+ 'results/', evtNm, monitor, self.slot)
+        vers= self.featVersions(paths_upd)
+        todo= rs.missing(vers)
+        logger.info(' '*4+ f'result store: {len(vers)- len(todo)} feats found, {len(todo)} to compute: {todo}')
+        date= rs.meta().get('date', '__')
+        if len(todo):
+            need= featTree.getDepend(todo)
+            featNms, need_rib= self.featNms, self.need_rib
+            self.featNms= [ f for f in featNms if f in need ]+ [ f for f in need if f not in featNms ]
+            self.need_rib= need_rib and bool( set(self.featNms) & set(featTree.getAllFeats(featTree.featTree['graph'])) )
+            self.plan= None
+            try:
+                paths_actual= self.initHandler(paths_upd, real_sat_time, path_rib, 4)
+                try:
+                    date= re.search('.(\d{8}).', paths_actual[0]).group(1)
+                except:
+                    date= '__'
+                df_new= pl.concat([ res.select(['time_bin', 'date']+ self.featNms)
+                                    for res in self._chunksHandler(paths_actual, date, evtNm, monitor) ])
+            finally:
+                self.featNms, self.need_rib, self.plan= featNms, need_rib, None
+            rs.write(df_new, { f: vers[f] for f in need if f in vers }, meta= { 'date': date })
+
+        save_path= self.raw_dir+ 'features/%s__%s__%s.csv' % (date ,evtNm, monitor)
+        utils.makePath(save_path)
+        with open(save_path, 'w') as f:
+            f.write( rs.load(vers).to_csv() )
+        self.postHandler(save_path, 6, dont_label= dont_label)
+
     def monitorHandler(self, paths_upd: list, real_sat_time, path_rib, evtNm= '_', monitor= '_', dont_label= False ):    # sapce4
         '''
         - args-> paths_upd {list | None}: updates文件名列表(List)。在有图特征情况下，包含了用于更新初始拓扑的那部分文件。
@@ -340,24 +422,22 @@ class FET():
         - args-> dont_label {*}: 无需打标签操作。默认为False, 即需要打标签
         - return {*}: 默认将提取的特征存入`./Dataset/features/{data}__{evtNm}__{monitor}.csv`
         '''
-        if paths_upd != None and paths_upd != []:
+        if self.store and self.by_peer:
+            raise ValueError('per-peer features are not kept in the result store, disable `store` or `by_peer`')
+        if self.udf_check and self.ed_pool is not None:
+            raise ValueError('`udf_check` hooks polars globally and is not thread-safe, it cannot be combined with an edit-distance pool')
+        if paths_upd != None and paths_upd != [] and self.store:
+            self._storeHandler(paths_upd, real_sat_time, path_rib, evtNm, monitor, dont_label)
+
+        elif paths_upd != None and paths_upd != []:
             paths_actual= self.initHandler(paths_upd, real_sat_time, path_rib, 4)
             try:
                 date= re.search('.(\d{8}).', paths_actual[0]).group(1)
             except:
                 date= '__'
             save_path= self.raw_dir+ 'features/%s__%s__%s.csv' % (date ,evtNm, monitor)
-            self.path_df_MOAS= self.raw_dir+ 'MOAS/%s__%s__%s.csv' % (date ,evtNm, monitor)
-            
             utils.makePath(save_path)
-            utils.makePath(self.path_df_MOAS)
-            
-            llist= utils.splitChunk(paths_actual, self.need_rib)
-            chunk_num= len(llist)
-            for serialNum, chunk in enumerate(llist) :
-                modify_df_topo= True if serialNum+1 < chunk_num else False  
-                logger.info(f' '*4+ f'chunk-{serialNum+1}/{len(llist)} ---------- `chunkHandler` started:')
-                res= self.chunkHandler(chunk, modify_df_topo, 4 )
+            for serialNum, res in enumerate( self._chunksHandler(paths_actual, date, evtNm, monitor) ):
                 with open(save_path, 'a') as f:
                     has_head= True if serialNum==0 else False
                     #res.sort('time_bin', in_place=True)
@@ -373,7 +453,7 @@ class FET():
                 t1= time.time()
                 df_one_rib_a_peer, peer_cur= GraphBase.latestPrimingTopo(self.raw_fields, path, '')
 
-                G= GraphBase.perSlotTopo(df_one_rib_a_peer)
+                G= GraphBase.perSlotTopo( GraphBase.topoIndex(df_one_rib_a_peer) )
                 feats_nx, feats_nk= GraphBase.funkList( feats_dict, G, G.nodes )
                 result= GraphBase.parallFeatFunc( feats_nx, feats_nk ) # 12
                 date= re.search('(\d{8}).\d{4}', path).group(1)
@@ -434,6 +514,8 @@ class FET():
         '''
         if not len( self.featNms ):
             raise Exception('You have not select features. Please using `FET.FET.setCustomFeats()`')
+        if self.udf_check:
+            raise ValueError('`udf_check` is not thread-safe and is only supported by `monitorHandler()` on local files, `run()` downloads and parses through `TaskScheduler`')
             
         complete_graph_feats= featTree.getAllFeats()[104:]
         complete_tradi_feats= featTree.getAllFeats()[:104]
@@ -441,24 +523,63 @@ class FET():
         
         self.need_upd = False if only_rib else True
         
+        if self.profile:
+            utils.profiler.enable(self.raw_dir+ 'profile/')
         t_prepare_data= time.time()
         event_path= os.path.dirname(__file__)+'/event_list.csv'
-        grd= GetRawData(event_path, self.raw_dir ,self.increment, self.duration, self.need_upd, self.need_rib)
-        fileDict= grd.run()
+        grd= GetRawData(event_path, self.raw_dir ,self.increment, self.duration, self.need_upd, self.need_rib, mirror= self.mirror)
+        with utils.profiler.span('GetRawData', 'stage'):
+            fileDict= grd.run()
         logger.info(f'time cost at download & parse data: {(time.time()-t_prepare_data):.3f}sec')
         
-        utils.runJobs(fileDict, self.eventHandler)
+        if (self.ed_processes or 1)> 1 and len( set(featTree.getAllFeats(featTree.featTree['peerPfx']['peerPfx_editdist']))& set(self.featNms) ):
+            self.ed_pool= featTradition.edPool(self.ed_processes)
+        try:
+            utils.runJobs(fileDict, self.eventHandler)
+        finally:
+            if self.ed_pool is not None:
+                self.ed_pool.close()
+                self.ed_pool.join()
+                self.ed_pool= None
         
         p=self.raw_dir+ 'features/'
         logger.info(f'FEATURE output path: {p}')
+        if self.profile:
+            self.profileReport()
+            utils.profiler.disable()
         return p
 
+    def profileReport(self):
+        '''- 剖析模式: 合并各进程的span, 写出`raw_dir/profile/trace.json`与`summary.csv`, 并打印汇总表。return {pl.DataFrame}: 汇总表'''
+        summary= utils.profiler.merge()
+        if len(summary):
+            logger.info('PROFILE summary (trace: %strace.json):\n%s' % (utils.profiler.root,
+                summary.to_pandas().to_string(index= False, max_colwidth= 40)))
+        return summary
 
-def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_dir= './raw_data/', make_plot= False):
+    def rollup(self, slot, evtNm= None):
+        '''
+        - description: 由`partials=True`时保存的部分聚合, 得到`slot`粒度(须为`self.slot`的整数倍)的传统特征, 无需重新运行
+        - args-> slot {int}: 目标粒度(s)
+        - args-> evtNm {str}: 只处理该事件; 默认为`raw_dir/partials/`下的全部
+        - return {list}: 输出文件, 即`./Dataset/features/{date}__{evtNm}__{monitor}__{slot}s.csv`
+        '''
+        res= []
+        for root in sorted(glob.glob(self.raw_dir+ 'partials/*/')):
+            name= os.path.basename(root.rstrip('/'))
+            if evtNm is not None and name.split('__')[1]!= evtNm:
+                continue
+            p= utils.makePath(self.raw_dir+ f'features/{name}__{slot}s.csv')
+            featRollup.rollup(root, slot).to_csv(p)
+            res.append(p)
+        return res
+
+
+def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_dir= './raw_data/', make_plot= False, mirror= None):
     '''快速得到某一时段的简单特征, 并作曲线'''
     utils.makePath(stored_dir)
     if not df:
-        paths= sorted(DownloadParseFiles('a', t_start, t_end, collector, stored_dir).run())
+        paths= sorted(DownloadParseFiles('a', t_start, t_end, collector, stored_dir, mirror= mirror).run())
         t0= time.time()
         bigdf= utils.csv2df(paths)
         print(f'read to bigdf cost: {(time.time()-t0):.2f} s')
@@ -470,9 +591,9 @@ def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_di
     df= (bigdf.lazy()
         .filter((pl.col("msg_type") != 'STATE'))
         .filter( ((pl.col('path').is_not_null()) | (pl.col("msg_type") == 'W') )) 
-        .with_column( pl.col('path').str.replace(' \{.*\}', ''))
+        .with_column( utils.pathStr('path'))
         .select([ 
-            ((pl.col('timestamp')- first_ts)// 60).cast(pl.Int16).alias('time_bin'),
+            ((pl.col('timestamp')- first_ts)// 60).cast(utils.bin_dtype).alias('time_bin'),
             pl.col('timestamp'), 
             pl.when( pl.col('msg_type')== 'A').then( pl.lit(1)).otherwise(pl.lit(0)).cast(pl.Int8).alias('msg_type'),
             'peer_AS', 
@@ -480,10 +601,11 @@ def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_di
             pl.col('path').cast(pl.Utf8)        
         ])
         .with_columns( [
-            pl.col('path').str.extract(' (\d+)$', 1).cast(pl.UInt32).alias('origin_AS')
+            utils.pathList('path', clean= False).arr.last().alias('origin_AS')
         ] )
         .with_row_count('index')
     ).collect()
+    df= utils.IdEncoder().encode(df, 'dest_pref', 'pfx_id')
     print(f"feats pre-process: {(time.time()-t1):.2f} s, num_of_miniutes= {df['time_bin'].unique().shape[0]}")
 
     t2= time.time()
@@ -505,7 +627,7 @@ def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_di
     print(f"got feats({len(df_list)}): {(time.time()-t2):.2f} s")
     
     df_res= df.groupby('time_bin').agg(
-        pl.col('timestamp').first().apply( lambda x: dt.datetime.fromtimestamp(x, tz= dt.timezone.utc).strftime('%Y/%m/%d %H:%M')).alias('date')
+        utils.tsFormat( pl.col('timestamp').first()).alias('date')
     ) 
     for df_ in df_list:   
         df_res= df_res.join(df_, on='time_bin')   
@@ -519,53 +641,108 @@ def FET_vSimple(t_start= None, t_end= None, collector= None, df= None, stored_di
         simple_plot(p, subplots=False, has_label=False)
     return df_res
 
-@utils.timer
-def preProcess(fields, chunk, slot, first_ts, tag_plen= True, tag_punq= True, tag_oriAS= True, space= None):   # space8
-    '''对chunk预处理
-    - fields: DF的列名
-    - chunk: 文件名列表
-    - slot: 时间片大小
-    - first_ts:起始时间
-    - tag_plen, tag_punq, tag_oriAS: 分别标记是否需要在预处理中执行3种expr
-    '''
-    df= utils.csv2df(chunk, fields ).with_columns([
-        pl.col('path').cast(pl.Utf8),
-        pl.col('dest_pref').cast(pl.Utf8),
-        pl.col('local_pref').cast(pl.Int64),
-        pl.col('MED').cast(pl.Int64),
-    ])   
+def _preProcessLazy(ldf: pl.LazyFrame, fields, need= None):
+    '''- 与时间片无关的预处理(除`time_bin`与`index`外的全部列), 可逐文件缓存
+    - need: 需计算的派生列, 见`featTree.getRequiredCols`; 为None时计算全部'''
+    need= set(featTree.derivedDepend)| {'path_list'} if need is None else need
+    casts= [ pl.col('path').cast(pl.Utf8), pl.col('dest_pref').cast(pl.Utf8) ]
+    if 'hash_attr' in need:
+        casts+= [ pl.col('local_pref').cast(pl.Int64), pl.col('MED').cast(pl.Int64) ]
+        # 属性字段以`|`(bgpdump的分隔符, 不会出现在字段内)拼接后hash; null记为空串
+        ldf= ldf.with_columns(casts).with_column(
+            pl.concat_str([ pl.col(c).cast(pl.Utf8).fill_null('') for c in fields[2:] ], sep= '|').hash(42).alias('hash_attr') )
+    else:
+        ldf= ldf.with_columns(casts)
     sel_list= [ 
             pl.col('timestamp').cast(pl.Int32),
-            ((pl.col('timestamp')- first_ts)// slot).cast(pl.Int16).alias('time_bin'),
             pl.when( pl.col('msg_type')== 'A').then( pl.lit(1)).otherwise(pl.lit(0)).cast(pl.Int8).alias('msg_type'),
             pl.col('peer_AS').cast(pl.Int32),
             'dest_pref',
-            pl.col('path').suffix('_raw'),
-            pl.col('origin').map(lambda x: 0 if x=='IGP' else ( 1 if x== 'EGP' else 2)).cast(pl.UInt8),
-            'hash_attr'
             ]
-    add_col_list= []
-    if tag_plen:
-        
-        sel_list.append( pl.col('path').str.split(" ").arr.lengths().cast(pl.Int64).alias('path_len') )    # .cast(pl.Int8)
-    if tag_punq:
-        sel_list.append( pl.col('path').str.split(" ").arr.unique().alias('path_unq') )
-        add_col_list.append( pl.col('path_unq').arr.lengths().cast(pl.Int64).alias('path_unq_len') )       # .cast(pl.Int8)
-    if tag_oriAS:  
-        add_col_list.append( pl.col('path_raw').str.extract(' (\d+)$', 1).cast(pl.UInt32).alias('origin_AS') )
+    if 'path_id' in need:
+        sel_list.append( pl.col('path').suffix('_raw') )
+    if 'path_list' in need:
+        sel_list.append( utils.pathList('path', clean= False).alias('path_list') )   # 全部path特征共用的唯一一次解析
+    if 'origin' in need:
+        sel_list.append( pl.when( pl.col('origin')== 'IGP').then(0).when( pl.col('origin')== 'EGP').then(1)
+                .when( pl.col('origin').is_not_null()).then(2).otherwise(None).cast(pl.UInt8).alias('origin') )
+    if 'hash_attr' in need:
+        sel_list.append( 'hash_attr' )
+    add_col_list, add_col_list2= [], []
+    if 'path_len' in need:
+        add_col_list.append( pl.col('path_list').arr.lengths().cast(pl.Int64).alias('path_len') )    # .cast(pl.Int8)
+    if 'path_unq' in need:
+        add_col_list.append( pl.col('path_list').arr.unique().alias('path_unq') )
+        add_col_list2.append( pl.col('path_unq').arr.lengths().cast(pl.Int64).alias('path_unq_len') )       # .cast(pl.Int8)
+    if 'origin_AS' in need:  
+        add_col_list2.append( pl.col('path_list').arr.last().alias('origin_AS') )
     
-    df['hash_attr']= df[:, 2:].hash_rows(k0=42)
-    
-    df= (df.lazy()
+    return (ldf
         .filter((pl.col("msg_type") != 'STATE'))
         .filter( ((pl.col('path').is_not_null()) | (pl.col("msg_type") == 'W') ))     
-        .with_column( pl.col('path').str.replace(' \{.*\}', ''))
+        .with_column( utils.pathStr('path'))
         .select( sel_list )
         .with_columns( add_col_list )
+        .with_columns( add_col_list2 )
+    )
+
+def _cachedPreProcess(fields, path, cache_dir, need, cols= None):
+    '''- 单个upds文件的预处理结果, 以IPC格式缓存于`cache_dir`。
+    - key: 文件路径、大小、mtime, 读取列与派生列, 以及`_preProcessLazy`与path解析的源码(预处理逻辑变更后自动失效)
+    - return {(LazyFrame, bool)}: 结果及是否命中缓存'''
+    st= os.stat(path)
+    key_str= '|'.join([ os.path.abspath(path), str(st.st_size), str(st.st_mtime_ns), str(cols), str(sorted(need)) if need is not None else 'None',
+                        inspect.getsource(_preProcessLazy), inspect.getsource(utils.pathStr), inspect.getsource(utils.pathList) ])
+    out= f'{cache_dir}{hashlib.sha1(key_str.encode()).hexdigest()}.ipc'
+    if os.path.exists(out):
+        return pl.scan_ipc(out), True
+    df= _preProcessLazy(utils.csv2df(path, fields, lazy= True, cols= cols), fields, need).collect()
+    tmp= f'{out}.{os.getpid()}.tmp'
+    df.write_ipc(tmp)
+    os.replace(tmp, out)
+    return df.lazy(), False
+
+@utils.timer
+def preProcess(fields, chunk, slot, first_ts, need= None, space= None, cache_dir= None, pfx_enc= None, path_enc= None, bins= None, cols= None):   # space8
+    '''对chunk预处理
+    - fields: DF的列名
+    - chunk: 文件名列表
+    - slot: 时间片大小
+    - first_ts:起始时间
+    - need, cols: 需计算的派生列与需读取的原始列, 见`featTree.getRequiredCols`; 为None时全部计算/读取
+    - cache_dir: 逐文件预处理结果的缓存目录; 为None时不缓存。`time_bin`与`index`总是现算, 故缓存与slot/first_ts无关
+    - bins: 只保留`lo<= time_bin< hi`的行, 任一端为None时不设界; chunk按time_bin切分时, 跨chunk的文件只贡献本chunk的时间片
+    - pfx_enc, path_enc: `utils.IdEncoder`, 给出时`dest_pref`与`path_raw`分别替换为编号列`pfx_id`与`path_id`, 字符串只保存在字典中(需要时经`decode`还原); path字典同时保存`path_list`
+    '''
+    if cache_dir:
+        utils.makePath(cache_dir)
+        res= [ _cachedPreProcess(fields, p, cache_dir, need, cols) for p in chunk if p!= None ]
+        ldf= pl.concat([ r[0] for r in res ])
+        if space != None:
+            logger.info(' '*(space+2)+ 'preprocess cache: %d/%d files hit' % (sum([ r[1] for r in res ]), len(res)))
+    else:
+        ldf= _preProcessLazy(utils.csv2df(chunk, fields, lazy= True, cols= cols ), fields, need)
+
+    cols= ldf.columns
+    ldf= (ldf
+        .with_column( ((pl.col('timestamp')- first_ts)// slot).cast(utils.bin_dtype).alias('time_bin') )
+        .select( cols[:1]+ ['time_bin']+ cols[1:] ))
+    lo, hi= bins or (None, None)
+    if lo!= None:
+        ldf= ldf.filter( pl.col('time_bin')>= lo )
+    if hi!= None:
+        ldf= ldf.filter( pl.col('time_bin')< hi )
+    df= (ldf
         .with_row_count('index')
-        
     ).collect()
 
+    if pfx_enc!= None and path_enc!= None:
+        cols= [ {'dest_pref': 'pfx_id', 'path_raw': 'path_id'}.get(c, c) for c in df.columns ]
+        df= pfx_enc.encode(df, 'dest_pref', 'pfx_id')
+        if 'path_raw' in df.columns:
+            df= path_enc.encode(df, 'path_raw', 'path_id', payload= ['path_list'])
+        df= df.select(cols)
+
     if space != None:
        logger.info(' '*(space+2)+ 'after preprocess: df_mem: %sMb; pre_DF shape: %s' % (utils.computMem(df), str(df.shape)))
     return df  
@@ -1,5 +1,8 @@
 import time
+import heapq
+import subprocess
 import multiprocessing
+from urllib.parse import urlparse
 
 class ProcessingQueue(object):
     
@@ -126,3 +129,132 @@ class ProcessingQueue(object):
 
 
 
+
+class TaskScheduler(object):
+    '''有界、带优先级的外部命令调度器, 用于MRT文件的下载(wget)与解析(bgpdump)。
+    - 下载任务: 按host限制并发连接数(`host_limit`)；
+    - 解析任务: 共享全局CPU预算(`cpu_budget`)；
+    - 优先级数值越小越先执行；任务可通过`after`依赖另一任务成功结束后才就绪。
+    '''
+    def __init__(self, host_limit= 4, cpu_budget= None, report_interval= 10):
+        '''
+        - args-> host_limit {int | dict}: 每个host的最大并发下载数; dict时形如`{'data.ris.ripe.net': 8}`, 未列出的host取默认值4
+        - args-> cpu_budget {int}: 同时运行的解析任务数上限, 默认为`cpu_count()//2`
+        - args-> report_interval {int}: 打印进度摘要的间隔(s)
+        '''
+        self.host_limit = host_limit
+        self.cpu_budget = cpu_budget if cpu_budget else max(multiprocessing.cpu_count()//2, 1)
+        self.report_interval = report_interval
+
+        self.tasks = {}      # tid -> dict(cmd, kind, priority, host, after, state, rc)
+        self.ready = []      # heap of (priority, tid)
+        self.waiting = []    # tid, 等待依赖的任务
+        self.running = {}    # tid -> Popen
+        self.host_busy = {}
+        self.cpu_busy = 0
+
+    def _hostLimit(self, host):
+        if isinstance(self.host_limit, dict):
+            return self.host_limit.get(host, 4)
+        return self.host_limit
+
+    def addTask(self, cmd, kind= 'parse', priority= 0, host= None, after= None):
+        '''- kind: `'download'` or `'parse'`; return: 任务id'''
+        tid = len(self.tasks)
+        self.tasks[tid] = {'cmd': cmd, 'kind': kind, 'priority': priority, 'host': host,
+                           'after': after, 'state': 'pending', 'rc': None}
+        if after is None:
+            heapq.heappush(self.ready, (priority, tid))
+        else:
+            self.waiting.append(tid)
+        return tid
+
+    def addDownload(self, url, path, priority= 0):
+        cmd = f"wget -q -O {path} {url}"
+        return self.addTask(cmd, 'download', priority, host= urlparse(url).netloc)
+
+    def addParse(self, src, dst, priority= 0, after= None):
+        cmd = f"bgpdump -q -m {src} > {dst}"
+        return self.addTask(cmd, 'parse', priority, after= after)
+
+    def _release(self):
+        '''把依赖已满足的任务移入就绪堆; 依赖失败的任务直接标记为`skipped`。'''
+        still = []
+        for tid in self.waiting:
+            dep = self.tasks[ self.tasks[tid]['after'] ]
+            if dep['state'] == 'done':
+                heapq.heappush(self.ready, (self.tasks[tid]['priority'], tid))
+            elif dep['state'] in ('failed', 'skipped'):
+                self.tasks[tid]['state'] = 'skipped'
+            else:
+                still.append(tid)
+        self.waiting = still
+
+    def _dispatch(self):
+        '''按优先级启动资源允许的任务, 资源不足的任务放回就绪堆。'''
+        deferred = []
+        while self.ready:
+            prio, tid = heapq.heappop(self.ready)
+            task = self.tasks[tid]
+            if task['kind'] == 'download':
+                busy = self.host_busy.get(task['host'], 0)
+                if busy >= self._hostLimit(task['host']):
+                    deferred.append((prio, tid))
+                    continue
+                self.host_busy[task['host']] = busy+ 1
+            else:
+                if self.cpu_busy >= self.cpu_budget:
+                    deferred.append((prio, tid))
+                    continue
+                self.cpu_busy += 1
+            self.running[tid] = subprocess.Popen(task['cmd'], shell= True)
+            task['state'] = 'running'
+        for item in deferred:
+            heapq.heappush(self.ready, item)
+
+    def _reap(self):
+        for tid, p in list(self.running.items()):
+            rc = p.poll()
+            if rc is None:
+                continue
+            task = self.tasks[tid]
+            task['rc'] = rc
+            task['state'] = 'done' if rc == 0 else 'failed'
+            if task['kind'] == 'download':
+                self.host_busy[task['host']] -= 1
+            else:
+                self.cpu_busy -= 1
+            self.running.pop(tid)
+
+    def summary(self):
+        '''- return {str}: 各类任务的 完成/总数、运行中、失败 情况'''
+        s = []
+        for kind in ('download', 'parse'):
+            states = [t['state'] for t in self.tasks.values() if t['kind'] == kind]
+            if not len(states):
+                continue
+            s.append(f"{kind}: {states.count('done')}/{len(states)} done, {states.count('running')} running, "
+                     f"{states.count('failed')+ states.count('skipped')} failed")
+        return '; '.join(s)
+
+    def run(self, logger= None, space= 4):
+        '''阻塞直至所有任务结束。
+        - return {dict}: `{tid: returncode | None}`, 被跳过的任务为None'''
+        report = logger.info if logger else print
+        t_report = time.time()
+        try:
+            while self.ready or self.waiting or self.running:
+                self._reap()
+                self._release()
+                self._dispatch()
+                if time.time()- t_report >= self.report_interval:
+                    report(' '*space+ f'<scheduler> {self.summary()}')
+                    t_report = time.time()
+                time.sleep(0.1)
+        except Exception as e:
+            for p in self.running.values():
+                p.terminate()
+            raise(e)
+        if len(self.tasks):
+            report(' '*space+ f'<scheduler> finished: {self.summary()}')
+        return {tid: t['rc'] for tid, t in self.tasks.items()}
@@ -35,7 +35,9 @@ import matplotlib.ticker as ticker
 from matplotlib.dates import DateFormatter, AutoDateLocator
 from matplotlib_venn import venn2
 
-from fastFET import utils
+from fastFET import utils, mrtSource
+from fastFET.MultiProcess import TaskScheduler
+from fastFET.pfxTrie import PfxTrie
 from fastFET.RIPEStatAPI import ripeAPI
 from fastFET.featGraph import graphInterAS
 logger= utils.logger
@@ -400,21 +402,7 @@ class MRTfileHandler():
         - args-> tarTime {str| datetime}: like `20210412.0800`
         - return {str}
         '''
-        if isinstance(tarTime, datetime):
-            tarTime= tarTime.strftime('%Y%m%d.%H%M')
-        month= f'{tarTime[:4]}.{tarTime[4:6]}'
-        type= type if type== 'updates' else 'ribs'
-        dic= {
-            'rrc':{
-                'updates': f"https://data.ris.ripe.net/{monitor}/{month}/updates.{tarTime}.gz",
-                'ribs'   : f"https://data.ris.ripe.net/{monitor}/{month}/bview.{tarTime}.gz"
-            },
-            'rou':{
-                'updates': f"http://archive.routeviews.org/{monitor}/bgpdata/{month}/UPDATES/updates.{tarTime}.bz2",
-                'ribs'   : f"http://archive.routeviews.org/{monitor}/bgpdata/{month}/RIBS/rib.{tarTime}.bz2"
-            }
-        }
-        return dic[ monitor[:3]][type]
+        return mrtSource.upstream_url(type, monitor, tarTime)
 
     @staticmethod
     def _convert_file_size(size_str):
@@ -496,11 +484,12 @@ class MRTfileHandler():
         return {collector: res_dic}
 
     @staticmethod
-    def _get_collectors_file_size(time_start='20211004.1200', time_end=None, project=None, custom_rrcs= None):
+    def _get_collectors_file_size(time_start='20211004.1200', time_end=None, project=None, custom_rrcs= None, index= None):
         '''
-        - description: 并行使用`_get_collector_file_size`。返回值排除了空数据的采集点。
+        - description: 从`FileSizeIndex`读取各采集点的file size(增量补全索引)。返回值排除了空数据的采集点。
         - args-> project {str}: either-or of 'RouteViews' and 'RIPE'
         - args-> custom_rrcs {list}: 自定义采集点列表
+        - args-> index {FileSizeIndex}: 默认为`FileSizeIndex()`
         - return {dict}: `{'rrc': DF(collectors* dates), 'rou': ~same~}`
         '''
         if time_end==None:
@@ -510,47 +499,23 @@ class MRTfileHandler():
             collector_list= custom_rrcs
         else:
             collector_list= proj_map[project] if project else proj_map['RIPE']+ proj_map['RouteViews']
-        month_list= MRTfileHandler._get_month_list(time_start, time_end)
-        
-        from tqdm import tqdm
-         
-        with Pool(processes=50) as pool:
-            total = len(collector_list)* len(month_list)
-            candi_list= [(c, m) for c in collector_list for m in month_list ]
-            desc = 'Processing collector files'
-            results = list(tqdm(pool.imap(MRTfileHandler._get_collector_file_size, candi_list), total=total, desc=desc))
+        index= index or FileSizeIndex()
+        df_long= index.query(collector_list, time_start, time_end)
 
         res= {}
-        res_rrc= {}
-        res_rou= {}
-        for r in results:
-            rrc_name= list(r.keys())[0]
-            if 'rrc' in rrc_name:
-                if rrc_name in list(res_rrc.keys()):
-                    res_rrc[rrc_name].update( r[rrc_name])
-                else:
-                    res_rrc.update(r)
-            else:
-                if rrc_name in list(res_rou.keys()):
-                    res_rou[rrc_name].update( r[rrc_name])
-                else:
-                    res_rou.update(r)
-                    
-        for dic in [res_rou, res_rrc]:
-            if dic=={}:
+        for prjt in ['rou', 'rrc']:
+            df= df_long.filter(pl.col('collector').str.slice(0, 3)== prjt)
+            if not df.shape[0]:
                 continue
-            
-            df= pd.DataFrame(dic )#.astype(str)
-            df.sort_index()
-            df.index = pd.to_datetime(df.index, format='%Y%m%d.%H%M')
-            a= datetime.strptime(time_start, '%Y%m%d.%H%M')
-            b= datetime.strptime(time_end, '%Y%m%d.%H%M')
-            df = (df.loc[(df.index >= a) & (df.index <= b)]
-                    .fillna('0')
-                    .applymap(lambda x: MRTfileHandler._convert_file_size(x))
-                    )
-            
-            empty_collectors=[]
+            df= (df.to_pandas()
+                    .pivot(index='ts', columns='collector', values='size')
+                    .sort_index()
+                    .fillna(0.0)
+                )
+            df.index.name= None
+            df.columns.name= None
+
+            empty_collectors= [c for c in collector_list if c[:3]== prjt and c not in df.columns]
             low_var_collectors= []
             for coll in df.columns:
                 # 筛掉404的采集点
@@ -564,7 +529,7 @@ class MRTfileHandler():
             print(f'`{empty_collectors=}`')
             print(f'`{low_var_collectors=}`')
                             
-            res[list(dic.keys())[0][:3]]= df
+            res[prjt]= df
             
         return res
 
@@ -574,7 +539,8 @@ class MRTfileHandler():
         time_end: str=None, 
         event_period: tuple=None,
         project: str= None,
-        custom_rrcs: list= None
+        custom_rrcs: list= None,
+        index= None
         ):
         '''
         - description: 画图对比各采集点的`file_size`走势
@@ -585,7 +551,7 @@ class MRTfileHandler():
         if time_end== None:
             time_end= time_start
         #if not data:
-        data= MRTfileHandler._get_collectors_file_size(time_start, time_end,project= project, custom_rrcs= custom_rrcs)
+        data= MRTfileHandler._get_collectors_file_size(time_start, time_end,project= project, custom_rrcs= custom_rrcs, index= index)
         
         for project, df in data.items():
             #size_map= {'RIPE': 23, 'RouteViews': 32}
@@ -609,9 +575,9 @@ class MRTfileHandler():
         return data
 
     @staticmethod
-    def select_collector_based_kurt(time_start='20211004.1200', time_end=None, data=None):
+    def select_collector_based_kurt(time_start='20211004.1200', time_end=None, data=None, index= None):
         '''
-        - description: 根据峰度获得所有采集点排名，默认为RIPE和RouteViews的总排名。
+        - description: 根据峰度获得所有采集点排名，默认为RIPE和RouteViews的总排名。索引已覆盖该时段时无需联网。
         - 注：起止时间范围越宽，采集点的峰度分数越有代表性。
         - 注：对于双峰数据(如泄露事件的异常形成与恢复过程),峰度排名不再有效，仍需画图观察
         - return {*}
@@ -619,18 +585,129 @@ class MRTfileHandler():
         if time_end== None:
             time_end= time_start
         if not data:
-            data= MRTfileHandler._get_collectors_file_size(time_start, time_end)
-        res= pd.Series()
+            data= MRTfileHandler._get_collectors_file_size(time_start, time_end, index= index)
+        res= pd.Series(dtype= float)
         for project, df in data.items():
-            kurt = df.apply(kurtosis)
+            if not df.shape[1]:
+                continue
+            kurt= (pl.from_pandas(df.reset_index(drop= True))
+                    .select(pl.all().kurtosis())
+                    .to_pandas().iloc[0])
             score = (10 * (kurt - kurt.min()) / (kurt.max() - kurt.min())).sort_values(ascending=False)
             res= pd.concat([res, score])
         res= res.sort_values(ascending=False)
         return res, data
 
+class FileSizeIndex():
+    '''- 采集点活跃度索引: 各采集点每个updates文件的大小(MB)的时间序列, 按`{root}/{collector}/{YYYY.MM}.parquet`持久化。
+    - 已结束的月份只抓取一次; 当前月份(及抓取失败的月份)在每次`update()`时重新抓取。
+    - 抓取是IO密集型, 用线程池并发; 指定镜像(`mirror`)时直接`os.stat`本地文件, 无网络请求。
+    '''
+    schema= {'collector': pl.Utf8, 'ts': pl.Datetime, 'size': pl.Float64}
+
+    def __init__(self, root= './file_size_index/', mirror= None, workers= 32) -> None:
+        self.root= root
+        self.source= mrtSource.getSource(mirror)
+        self.workers= workers
+
+    def _path(self, collector, month):
+        return f'{self.root}{collector}/{month}.parquet'
+
+    def _is_stale(self, collector, month):
+        return (not os.path.exists(self._path(collector, month))) or month>= datetime.now().strftime('%Y.%m')
+
+    def _fetch_listing(self, collector, month):
+        '''- 解析官网目录页; 404视为该月无数据(空表), 其他失败返回None'''
+        pattern_dir={
+            'rrc': r'href="updates\.(\d{8}\.\d+)\.gz.*:\d\d\s*(\d+\.?\d*[MKG]?)\s*', 
+            'rou': r'updates\.(\d{8}\.\d+)\.bz2.*"right">\s*(\d+\.?\d*[MKG]?)\s*'
+        }
+        url= os.path.dirname(mrtSource.upstream_url('updates', collector, f'{month[:4]}{month[5:]}01.0000'))+ '/'
+        try:
+            respon= requests.get(url, timeout= 10)
+        except Exception as e:
+            print(f'请求异常：{collector}--> {e}')
+            return None
+        if respon.status_code== 404:
+            return []
+        if respon.status_code!= 200:
+            print(f'请求失败: {collector}--> {url}')
+            return None
+        return [(t, MRTfileHandler._convert_file_size(size)) for t, size in re.findall(pattern_dir[collector[:3]], respon.text)]
+
+    def _fetch_mirror(self, collector, month):
+        sample= self.source.locate('updates', collector, f'{month[:4]}{month[5:]}01.0000')
+        if sample.startswith('http'):
+            return self._fetch_listing(collector, month) if getattr(self.source, 'http_fallback', False) else None
+        if not os.path.isdir(os.path.dirname(sample)):
+            return None
+        res= []
+        for f in glob.glob(f'{os.path.dirname(sample)}/updates.*'):
+            t= re.search(r'\d{8}\.\d{4}', os.path.basename(f)).group()
+            res.append((t, os.stat(f).st_size/ 10**6))
+        return res
+
+    def _fill(self, task):
+        '''- 抓取一个(collector, month)并落盘。return {bool}: 是否成功'''
+        collector, month= task
+        fetch= self._fetch_mirror if self.source.offline else self._fetch_listing
+        rows= fetch(collector, month)
+        if rows is None:
+            return False
+        interval= utils.intervalMin('updates', collector)
+        rows= [(t, s) for t, s in rows if int(t[-2:])% interval== 0]
+        df= pl.DataFrame({
+                'collector': [collector]* len(rows),
+                'ts': [datetime.strptime(t, '%Y%m%d.%H%M') for t, _ in rows],
+                'size': [s for _, s in rows]
+            }, columns= list(self.schema.items()))
+        utils.makePath(self._path(collector, month))
+        df.write_parquet(self._path(collector, month))
+        return True
+
+    def update(self, collectors, time_start, time_end= None):
+        '''
+        - description: 增量补全索引: 只抓取缺失的月份与当前月份。
+        - args-> collectors {list}: 
+        - args-> time_start, time_end {str}: like `20211004.1200`
+        - return {list}: 抓取失败的`(collector, month)`
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        month_list= MRTfileHandler._get_month_list(time_start, time_end or time_start)
+        tasks= [(c, m) for c in collectors for m in month_list if self._is_stale(c, m)]
+        if not len(tasks):
+            return []
+        with ThreadPoolExecutor(max_workers= self.workers) as pool:
+            oks= list(tqdm.tqdm(pool.map(self._fill, tasks), total= len(tasks), desc= 'Indexing collector files'))
+        failed= [t for t, ok in zip(tasks, oks) if not ok]
+        if len(failed):
+            print(f'`{failed=}`')
+        return failed
+
+    def query(self, collectors, time_start, time_end= None, update= True) -> pl.DataFrame:
+        '''
+        - description: 获取指定采集点、时段内的file size时间序列。
+        - args-> update {bool}: 先增量补全索引; 为False时只读已有索引(不联网)
+        - return {pl.DataFrame}: 长表, 列为`collector, ts, size(MB)`
+        '''
+        time_end= time_end or time_start
+        if update:
+            self.update(collectors, time_start, time_end)
+        month_list= MRTfileHandler._get_month_list(time_start, time_end)
+        paths= [ self._path(c, m) for c in collectors for m in month_list]
+        paths= [p for p in paths if os.path.exists(p)]
+        if not len(paths):
+            return pl.DataFrame(columns= list(self.schema.items()))
+        a= datetime.strptime(time_start, '%Y%m%d.%H%M')
+        b= datetime.strptime(time_end, '%Y%m%d.%H%M')
+        return (pl.concat([ pl.scan_parquet(p) for p in paths ])
+                .filter((pl.col('ts')>= a) & (pl.col('ts')<= b))
+                .sort(['collector', 'ts'])
+                .collect())
+
 class DownloadParseFiles():
     '''- 简单场景下的MRT文件的下载和解析'''
-    def __init__(self, mode= 'a', time_str= '20230228.0000', time_end= None, coll= None, target_dir= './raw_data/', core_num= 60) -> None:
+    def __init__(self, mode= 'a', time_str= '20230228.0000', time_end= None, coll= None, target_dir= './raw_data/', core_num= 60, host_limit= 8, mirror= None) -> None:
         ''' 
         - args-> mode {'all'/'a'}: 
             - `all`: 所有采集点模式，用于下载并解析`指定时刻time_str`的`所有采集点`的(rib)表；
@@ -640,12 +717,16 @@ class DownloadParseFiles():
         - args-> coll {*}: 当mode='a'时有效
         - args-> target_dir {*}: 
         - args-> core_num {*}: 默认60核
+        - args-> host_limit {*}: 每个数据源host的最大并发下载数
+        - args-> mirror {*}: 数据源, 详见`mrtSource.getSource()`; 本地镜像时以软链接代替下载
         '''
         self.mode= mode
         self.time_str= time_str
         self.time_end= time_end
         self.coll= coll
         self.core_num= core_num
+        self.host_limit= host_limit
+        self.source= mrtSource.getSource(mirror)
         self.p_down= utils.makePath(f'{target_dir}/raw/')
         os.system(f'rm -r {target_dir}/raw/*')
         self.p_pars= utils.makePath(f'{target_dir}/parsed/')
@@ -653,9 +734,10 @@ class DownloadParseFiles():
         print(f"will download and parse at: {target_dir}")
 
     def _get_url_list(self):
+        '''- return {list}: `[(collector, url或本地路径), ...]`'''
         if self.mode== 'all':
             collectors= MRTfileHandler.collector_list()
-            url_list= [ MRTfileHandler.get_download_url('ribs', coll, self.time_str) for coll in collectors]
+            url_list= [ (coll, self.source.locate('ribs', coll, self.time_str)) for coll in collectors]
         else:
             interval= utils.intervalMin('updates', self.coll[:3])
             # 拿到标准起止时间
@@ -668,87 +750,36 @@ class DownloadParseFiles():
                 need.append( satTime.strftime( '%Y%m%d.%H%M' ))
                 satTime += timedelta(seconds= interval* 60)
                 
-            url_list= [ MRTfileHandler.get_download_url('updates', self.coll, n) for n in need]
+            url_list= [ (self.coll, self.source.locate('updates', self.coll, n)) for n in need]
 
         return url_list
 
-    def _download_file(self, queue, urls:list):
-        ''''''
-        for url in urls:
-            # 先判url有效性
-            response = requests.head(url).status_code
-            if response==404:
-                print(f"FAILD: {url=}")
-            else:
-                url_nodes= url.split('/')
-                output_file = f"{ self.p_down}{url_nodes[3]}_{url_nodes[-1]}"
-                subprocess.call(['wget', '-q', '-O', output_file, url])
-                queue.put(output_file)
-
-    def _parse_file(self, queue):
-        ''''''
-        target_files=[]
-        while True:      
-            source = queue.get()     
-            if source== None:
-                break
-            output_file= self.p_pars+ os.path.basename(source)+ '.txt'
-            subprocess.call(f'bgpdump -q -m {source} > {output_file}', shell=True)
-            target_files.append(output_file)
-            #print(f"done : {os.path.basename(source)}.txt")
-        return target_files
-
     #@utils.timer
     def run(self):
-        
+        '''- 下载与解析交由`TaskScheduler`: 每个host限`host_limit`个连接, 解析进程共享`core_num//2`的CPU预算；
+            url列表靠前者优先。
+        - return {list}: 成功解析的`.txt`文件列表'''
         t1= time.time()
         url_list= self._get_url_list()
-        queue= multiprocessing.Manager().Queue()     
-        cores_p= self.core_num//2
-        cores_c= self.core_num//2
-        pool1 = multiprocessing.Pool(processes=cores_p)
-        pool2 = multiprocessing.Pool(processes=cores_c)
-        
-        sub_set_size= round( len(url_list)/ cores_p )
-        for i in range(cores_p):
-            if i+1== cores_p:
-                sub_set= url_list[i*sub_set_size:]
-            else:
-                sub_set= url_list[i*sub_set_size: (i+1)*sub_set_size]
-            pool1.apply_async( self._download_file, (queue, sub_set))
-        pool1.close()
-
-        print("has parsed files:")
-        with tqdm.tqdm(total= len(url_list), dynamic_ncols= True) as pbar:            
-            results= []
-            real_res= []
-
-            for i in range(cores_c):
-                res= pool2.apply_async(self._parse_file, (queue,))
-                results.append(res)
-            pool1.join()
-
-            for i in range(cores_c):
-                queue.put(None)
-
-            while len(results)>0:
-                for i in range(len(results)):
-                    r= results[i]
-                    if r.ready():
-                        results.pop(i)
-                        r_= r.get()
-                        real_res+= r_
-                        pbar.update(len(r_))
-                        break
-                    else:
-                        time.sleep(0.1)
+        sched= TaskScheduler(host_limit= self.host_limit, cpu_budget= max(self.core_num//2, 1))
 
-            pool2.close()
-            pool2.join()
-
-        '''real_res=[]
-        for r in results:
-            real_res+= r.get()'''
+        parse_tasks= {}
+        for prio, (coll, url) in enumerate(url_list):
+            if self.source.offline and not self.source.exists(url):
+                print(f"FAILD: {url=}")
+                continue
+            output_file = f"{ self.p_down}{coll}_{os.path.basename(url)}"
+            tid= sched.addTask(self.source.fetchCmd(url, output_file), 'download', prio, host= self.source.host(url))
+            target= self.p_pars+ os.path.basename(output_file)+ '.txt'
+            parse_tasks[ sched.addParse(output_file, target, prio, after= tid) ]= (url, target)
+
+        rcs= sched.run()
+        real_res= []
+        for tid, (url, target) in parse_tasks.items():
+            if rcs[tid]== 0:
+                real_res.append(target)
+            else:
+                print(f"FAILD: {url=}")
         real_res= sorted(real_res)
         print(f'download and parse cost: {(time.time()-t1):.2f}s')
         return real_res
@@ -1010,6 +1041,25 @@ class   UpdsMsgPreHandler():
         )
         return df
 
+    @staticmethod
+    def covering_origin(global_mapping: pl.DataFrame, pfxs):
+        '''
+        - description: 为每个前缀找出全局映射中最长匹配(含自身)的前缀及其originAS; 子前缀宣告可据此与其父前缀的origin比较。
+        - args-> global_mapping {pl.DataFrame}: from `pfx_oriAS_mapping_from_global_rib()`
+        - args-> pfxs {list | pl.Series}: 
+        - return {pl.DataFrame}: `pfx, cover_pfx, cover_originAS`, 无覆盖前缀时后两列为null
+        '''
+        idx= PfxTrie(global_mapping['pfx']).longestMatch(pfxs)
+        cover= (global_mapping
+            .select([ pl.col('pfx').alias('cover_pfx'), pl.col('originAS').alias('cover_originAS') ])
+            .with_row_count('_i')
+            .with_column( pl.col('_i').cast(pl.Int64) ))
+        return (pl.DataFrame({
+                'pfx': pl.Series(list(pfxs) if not isinstance(pfxs, pl.Series) else pfxs).cast(pl.Utf8),
+                '_i' : idx })
+            .join( cover, on= '_i', how= 'left')
+            .drop('_i'))
+
     ## main steps
     @staticmethod
     def peers_select_by_updates(df, topN=12):
@@ -1041,7 +1091,7 @@ class   UpdsMsgPreHandler():
             #    &( pl.col('time_bin')<500)
             #)
             .groupby('time_bin', maintain_order=True).agg([
-                pl.col('timestamp').first().apply( lambda x: datetime.fromtimestamp(x, tz= timezone.utc).strftime('%Y/%m/%d %H:%M')).alias('date'),
+                utils.tsFormat( pl.col('timestamp').first()).alias('date'),
                 pl.col('timestamp').count().alias('count')
             ])
             .select(pl.exclude('time_bin'))
@@ -1120,12 +1170,17 @@ class   UpdsMsgPreHandler():
     @staticmethod
     def cut_peak(df:pl.DataFrame, dic_suspi, peak_not_event):
         '''- '''
-        a=( df.filter( pl.col('time_bin').is_in(peak_not_event)   
+        # 每个时间片内按随机数排名, 保留前`dic_suspi[time_bin]`条, 即无放回抽样
+        quota= pl.DataFrame({
+            'time_bin': peak_not_event, 
+            'quota': [ int(dic_suspi[t]) for t in peak_not_event ]}).with_column(pl.col('time_bin').cast(df['time_bin'].dtype))
+        a= df.filter( pl.col('time_bin').is_in(peak_not_event)   
             # & (pl.col('msg_type')== 'A')   
             )
-            .groupby('time_bin').apply(
-                lambda group_df: (group_df.sample( int(dic_suspi[group_df['time_bin'][0]]), shuffle=True ) )
-            ))
+        a=( a.with_column( pl.Series('rnd', np.random.rand(a.height)) )
+            .join(quota, on= 'time_bin', how= 'left')
+            .filter( pl.col('rnd').rank('ordinal').over('time_bin')<= pl.col('quota') )
+            .select(df.columns))
         a= df.filter(~pl.col('time_bin').is_in(peak_not_event)).vstack(a)
 
         a= a.sort('id')
@@ -1148,7 +1203,7 @@ class   UpdsMsgPreHandler():
             #    &( pl.col('time_bin')<500)
             #)
             .groupby('time_bin', maintain_order=True).agg([
-                pl.col('timestamp').first().apply( lambda x: datetime.fromtimestamp(x, tz= timezone.utc).strftime('%Y/%m/%d %H:%M')).alias('date'),
+                utils.tsFormat( pl.col('timestamp').first()).alias('date'),
                 pl.col('timestamp').count().alias('count')
             ])
             .select(pl.exclude('time_bin'))
@@ -1170,10 +1225,11 @@ class RawMrtDataAnaly():
         self.df= (df
             .filter(pl.col('msg_type')!= 'STATE')
             .with_columns([
-                ((pl.col('timestamp')- first_ts)// 60).cast(pl.Int16).alias('protocol'),
-                pl.col('path').str.replace(' \{.*\}', '')
+                ((pl.col('timestamp')- first_ts)// 60).cast(utils.bin_dtype).alias('protocol'),
+                utils.pathStr('path')
             ])
-            .with_column(pl.col('path').str.split(' ').arr.last().alias('originAS'))
+            .with_column(utils.pathList('path', clean= False).alias('path_list'))
+            .with_column(pl.col('path_list').arr.last().cast(pl.Utf8).alias('originAS'))
             .rename({'protocol': 'time_bin'})
             .with_row_count('id')
             #.groupby('time_bin')
@@ -1184,7 +1240,7 @@ class RawMrtDataAnaly():
         _, peer_reserve= self.list_peers_rank()
         
         self.figsize= (8,6)
-        self.ts2dt_str= pl.col('timestamp').first().apply( lambda x: datetime.fromtimestamp(x, tz= timezone.utc).strftime('%Y/%m/%d %H:%M')).alias('date')
+        self.ts2dt_str= utils.tsFormat( pl.col('timestamp').first()).alias('date')
         self.filter_dict={
             'full-table': pl.col('peer_IP').is_in(full_table_peer),     
             'num_gt_5pmin': pl.col('peer_IP').is_in(list(peer_reserve)), 
@@ -1360,15 +1416,7 @@ class RawMrtDataAnaly():
                 'time_bin', 
                 self.ts2dt_str,
                 'dest_pref',
-                pl.col('path').str.extract(' (\d+)$', 1).cast(pl.Utf8).alias('loc_0'),
-                pl.col('path').str.extract(' (\d+) \d+$', 1).cast(pl.Utf8).alias('loc_1'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+$', 1).cast(pl.Utf8).alias('loc_2'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_3'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_4'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_5'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+ \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_6'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+ \d+ \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_7'),
-                pl.col('path').str.extract(' (\d+) \d+ \d+ \d+ \d+ \d+ \d+ \d+ \d+$', 1).cast(pl.Utf8).alias('loc_8'),
+                *[ pl.col('path_list').arr.get(-k-1).cast(pl.Utf8).alias(f'loc_{k}') for k in range(9) ]
             ])
             .collect()
             .to_pandas()
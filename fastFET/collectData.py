@@ -5,19 +5,11 @@ from datetime import datetime
 from copy import deepcopy
 import glob
 import time
-import requests
-
-import multiprocessing, subprocess
 
 #sys.path.append( os.path.dirname(os.path.dirname(__file__)))
-from fastFET.BGPMAGNET.dataGetter import downloadByParams
-from fastFET.BGPMAGNET.base import base_params, bgpGetter
-from fastFET.BGPMAGNET.params import BGP_DATATYPE
 from fastFET.utils import logger
-from fastFET import utils, bgpToolKit
-
-
-processList= []
+from fastFET import utils, mrtSource
+from fastFET.MultiProcess import TaskScheduler
 
 
 class GetRawData(object):
@@ -28,7 +20,10 @@ class GetRawData(object):
         increment= 4,  
         duration= 2,
         updates= True,
-        ribs= False    ):
+        ribs= False,
+        host_limit= 4,
+        cpu_budget= None,
+        mirror= None    ):
         '''
         - description: `event_list.csv` -> download `.gz`files -> `bgpdump` to `.txt` -> `.txt`files
         - args-> event_list_path {*}: 事件列表路径
@@ -37,6 +32,9 @@ class GetRawData(object):
         - args-> duration {*}: 当事件缺省结束时间时，将其指定为 start_time + duration (h)
         - args-> updates {*}: 是否需要收集updates数据。
         - args-> ribs {*}: 是否需要收集ribs数据
+        - args-> host_limit {*}: 每个数据源host的最大并发下载数
+        - args-> cpu_budget {*}: 同时运行的`bgpdump`解析进程数上限, 默认为`cpu_count()//2`
+        - args-> mirror {*}: 数据源, 详见`mrtSource.getSource()`。默认从官网下载; 给定本地镜像时全程无需网络
         - return {*}
         '''        
         self.path= event_list_path
@@ -47,6 +45,10 @@ class GetRawData(object):
         self.duration= duration
         self.ribTag= ribs
         self.updTag= updates
+        # 所有rib的下载、解析任务统一由调度器限流, 在`run()`末尾执行
+        self.sched= TaskScheduler(host_limit, cpu_budget)
+        self.source= mrtSource.getSource(mirror)
+        self.pending_dwlad= {}
 
         logger.info('')
         s= '# download & decode to ASCII #'
@@ -111,40 +113,26 @@ class GetRawData(object):
         - return: cuted  raw_files, or maybe empty list'''
 
         str_map= {'updates': 'updates', 'rib.': 'ribs', 'bview.': 'ribs'}
-        if not isinstance(satTime, str):
-            sat= satTime.strftime('%Y-%m-%d')+ "-00:00"
-            end= endTime.strftime('%Y-%m-%d')+ "-23:59"
-        else:
-            sat= satTime
-            end= endTime
+        if isinstance(satTime, str):
+            satTime= datetime.strptime(satTime, '%Y-%m-%d-%H:%M')
+            endTime= datetime.strptime(endTime, '%Y-%m-%d-%H:%M')
         if type!= 'updates' and only_rib== False:
             target_time= satTime.strftime('%Y%m%d.%H%M')
-            a_rib_url= bgpToolKit.MRTfileHandler.get_download_url(type, monitor, target_time)
-            a_rib_filename= a_rib_url.split('/')[-1]
+            a_rib_loc= self.source.locate(type, monitor, target_time)
+            a_rib_filename= os.path.basename(a_rib_loc)
             
-            response = requests.head(a_rib_url).status_code
-            if response==200:
-                target_path= f'{self.collection_data_lib}{monitor}/'
-                cmd= f"cd {target_path}; wget {a_rib_url}; mv {a_rib_filename} {monitor}_{a_rib_filename}"
-                p= subprocess.Popen(cmd, shell=True)
-                logger.info(f'    - {p.pid=}, downloading a `{monitor}` rib table...')
-                processList.append(p)
-                return [ f"{target_path}{monitor}_{a_rib_filename}"]
+            if self.source.exists(a_rib_loc):
+                target_file= utils.makePath(f'{self.collection_data_lib}{monitor}/')+ f'{monitor}_{a_rib_filename}'
+                tid= self.sched.addTask(self.source.fetchCmd(a_rib_loc, target_file), 'download', 
+                                        satTime.timestamp(), host= self.source.host(a_rib_loc))
+                self.pending_dwlad[target_file]= tid
+                logger.info(f'    - task-{tid}, downloading a `{monitor}` rib table...')
+                return [ target_file ]
             else:
-                logger.warning(f'    - in {monitor}, url WRONG:`{a_rib_url}`')
+                logger.warning(f'    - in {monitor}, url WRONG:`{a_rib_loc}`')
                 return []
 
-        bgpdbp=downloadByParams( 
-            urlgetter=bgpGetter(base_params(
-                start_time= sat,
-                end_time  = end,
-                bgpcollectors=[monitor],
-                data_type=BGP_DATATYPE[str_map[type].upper()]
-            )),
-            destination= self.collection_data_lib,
-            save_by_collector=1
-        )
-        bgpdbp.start_on()
+        self.source.fetchRange(str_map[type], monitor, satTime, endTime, self.collection_data_lib)
         # check_error_list(sys.path[0]+ "/errorInfo.txt")
         whole_files= glob.glob(self.collection_data_lib+ monitor+ os.sep+ monitor+ '_'+ type+ '*')
         
@@ -154,29 +142,24 @@ class GetRawData(object):
             return []
         return dest_files
 
-    def trans_multiproc(self, tup):
-            os.system('bgpdump -m '+ tup[1] + ' > '+ tup[0] +  os.path.basename(tup[1])+ '.txt')
-
-    def raw2txt(self, dest_dir, raw_files, type, monitor= None):       
+    def raw2txt(self, dest_dir, raw_files, type, monitor= None, priority= 0):       
         '''- description: transform BGP update raw data to .txt by command `bgpdump`
+        - 单个文件(rib)的解析任务只入队, 在`run()`中统一调度；多个文件(updates)则立即调度执行至完成。
         - return `.txt list`
         '''
         if len(raw_files)==1:
             target_path= f"{dest_dir}{os.path.basename(raw_files[0])}.txt"
-            cmd= f"bgpdump -m {raw_files[0]} > {target_path}"
-            p= subprocess.Popen(cmd, shell=True)
-            logger.info(f"    - {p.pid=}, parsing a rib of `{monitor if monitor!=None else ' '}`...")
-            processList.append(p)
+            tid= self.sched.addParse(raw_files[0], target_path, priority, after= self.pending_dwlad.get(raw_files[0]))
+            logger.info(f"    - task-{tid}, parsing a rib of `{monitor if monitor!=None else ' '}`...")
             return [target_path]
 
-        dest_dirs= [ dest_dir ]* len(raw_files)
-        
-        pool= multiprocessing.Pool(multiprocessing.cpu_count()//2)
-        pool.map(self.trans_multiproc, zip(dest_dirs, raw_files))
-        pool.close()
-        pool.join()
-
-        parsed_files= sorted(glob.glob(f'{dest_dir}/*{type}*'))
+        sched= TaskScheduler(cpu_budget= self.sched.cpu_budget)
+        parsed_files= []
+        for raw in sorted(raw_files):
+            target_path= f"{dest_dir}{os.path.basename(raw)}.txt"
+            sched.addParse(raw, target_path, priority)
+            parsed_files.append(target_path)
+        sched.run(logger)
         return parsed_files
 
     def oneMonitor(self, type, txt_dir, monitor, fact_satTime: datetime, endTime: datetime):
@@ -197,7 +180,7 @@ class GetRawData(object):
             return []
 
         st2= time.time()
-        txtfiles= self.raw2txt( curDir, raw_files, type, monitor )
+        txtfiles= self.raw2txt( curDir, raw_files, type, monitor, priority= fact_satTime.timestamp() )
         #logger.info(' '*4+ '- %s parsed: %.3f sec, %d files.' %( monitor, time.time()- st2, len(raw_files)))
 
         return txtfiles
@@ -246,11 +229,9 @@ class GetRawData(object):
     def getRibTxts(self, events_dict):
         '''
         - description: 解析rib文件
+        - 下载和解析任务交由`self.sched`调度: 事件越早, 优先级越高(其rib决定图特征的起点)。
         - return {*}: `{'evtNm': {'monitor': [.txt]|[] } } `
         '''
-        list_parsing=[]
-        list_downloading=[]
-
         strmap= {'rrc': 'bview.', 'rou': 'rib.'}
         res= deepcopy( events_dict )
         ppath, dirs, _= os.walk( self.collection_data_lib_parsed ).__next__()
@@ -266,22 +247,24 @@ class GetRawData(object):
                 if self.updTag:
                     if len(txtfiles) != 1:
                         target_time= satRIBtime.strftime('%Y%m%d.%H%M')
-                        a_rib_url= bgpToolKit.MRTfileHandler.get_download_url(type, monitor, target_time)
-                        basename = a_rib_url.split('/')[-1]
+                        a_rib_loc= self.source.locate('ribs', monitor, target_time)
+                        basename = os.path.basename(a_rib_loc)
                         download_file= f"{self.collection_data_lib}{monitor}/{monitor}_{basename}"
                         pathTXT= f"{self.collection_data_lib_parsed}{evtNm}/{monitor}/{monitor}_{basename}.txt"
+                        priority= satRIBtime.timestamp()
                         
                         if not os.path.exists(download_file):
-                            response = requests.head(a_rib_url).status_code
-                            if response==404:
-                                logger.warning(f'    - in {monitor}, url WRONG:`{a_rib_url}`')
+                            if not self.source.exists(a_rib_loc):
+                                logger.warning(f'    - in {monitor}, url WRONG:`{a_rib_loc}`')
                                 res[evtNm][monitor]= []
                             else:
-                                list_downloading.append({'url': a_rib_url, 'path': download_file})
-                                list_parsing.append({'pathMRT': download_file, 'pathTXT': pathTXT})
+                                utils.makePath(f"{self.collection_data_lib}{monitor}/")
+                                tid= self.sched.addTask(self.source.fetchCmd(a_rib_loc, download_file), 'download', 
+                                                        priority, host= self.source.host(a_rib_loc))
+                                self.sched.addParse(download_file, pathTXT, priority, after= tid)
                                 res[evtNm][monitor]= [pathTXT]
                         else:
-                            list_parsing.append({'pathMRT': download_file, 'pathTXT': pathTXT})
+                            self.sched.addParse(download_file, pathTXT, priority)
                             res[evtNm][monitor]= [pathTXT]
                     else:   
                         logger.info(' '*4+ '- %s: ribs has existed, don\'t need to parse.' % monitor)    
@@ -294,26 +277,6 @@ class GetRawData(object):
                     else:
                         txtfiles= self.oneMonitor(strmap[monitor[:3]], ppath+ evtNm+ '/', monitor, satRIBtime, endRIBtime)
                     res[evtNm][monitor]= txtfiles 
-                    
-        if list_downloading:
-            plist=[]
-            for dic in list_downloading:
-                cmd= f"wget -q -O {dic['path']} {dic['url']}"
-                p= subprocess.Popen(cmd, shell=True)
-                logger.info(f'    - {p.pid=}, downloading: `{cmd}`...')
-                plist.append(p)
-            for p in plist:
-                p.wait()
-                
-        if list_parsing:
-            p2list=[]
-            for dic in list_parsing:
-                cmd= f"bgpdump -m {dic['pathMRT']} > {dic['pathTXT']}"
-                p= subprocess.Popen(cmd, shell=True)
-                logger.info(f'    - {p.pid=}, parsing: `{cmd}`...')
-                p2list.append(p)
-            for p in p2list:
-                p.wait()
 
         return res
 
@@ -351,9 +314,8 @@ class GetRawData(object):
         evtDic= self.getEventsDict()
         txtDic= self.getRawTxts(evtDic)
 
-        # ending all of subprocess
-        for p in processList:
-            p.wait()
+        # 执行所有排队中的rib下载、解析任务
+        self.sched.run(logger)
         return txtDic
         
         
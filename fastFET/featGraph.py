@@ -11,8 +11,9 @@ from fastFET.utils import logger
 import multiprocessing
 import networkit as nk
 import networkx  as nx
-import pandas    as pd
 import polars    as pl
+import pyarrow   as pa
+import pyarrow.compute as pc
 from networkx import find_cliques
 
 
@@ -31,7 +32,7 @@ class GraphBase( object ):
                 .groupby( 'dest_pref' )
                 .tail(1)
                 #.filter( (~pl.col('path').str.contains('\{')) )
-                .with_column( pl.col('path').str.replace(' \{.*\}', ''))
+                .select([ 'peer_AS', 'dest_pref', utils.pathList('path').alias('path_list') ])
             )
         return res
 
@@ -42,7 +43,7 @@ class GraphBase( object ):
                 .groupby( ['peer_AS','dest_pref'] )
                 .tail(1)
                 #.filter( (~pl.col('path').str.contains('\{')) )
-                .with_column( pl.col('path').str.replace(' \{.*\}', ''))
+                .select([ 'peer_AS', 'dest_pref', utils.pathList('path').alias('path_list') ])
             )
         return res
     
@@ -55,7 +56,7 @@ class GraphBase( object ):
         - args-> paths_priming {list}: 需合并到rib的updates数据
         - args-> cut_peer {bool}: 默认需要裁剪至只剩单个peer
         - args-> space {*}: 用于logger
-        - return {`(pd_df_rib ['peer_AS', 'dest_pref', 'path_raw' ], peer)`}
+        - return {`(pl_df_rib ['peer_AS', 'dest_pref', 'path_list' ], peer)`}
         '''
         peer= None
         df_rib= utils.csv2df( path_rib, raw_fields).select( [
@@ -88,74 +89,77 @@ class GraphBase( object ):
                 #.with_row_count('index')    
             )
         
-        res= ldf_rib.rename( {'path': 'path_raw'}).collect().to_pandas()
+        res= ldf_rib.with_column( pl.col('peer_AS').cast(pl.Int64) ).collect()
         return res, peer
 
+    @staticmethod
+    def topoIndex(df_topo: pl.DataFrame, df_upds: pl.DataFrame= None):
+        '''
+        - description: 在主进程中把拓扑表与updates一次性整理为只含numpy数组的边索引, 供fork出的子进程按slot直接切片。
+            子进程中不再调用polars(其线程池在fork后可能死锁)与pandas, 数组经fork共享, 无转换与复制。
+        - args-> df_topo {pl.DF}: `['peer_AS', 'dest_pref', 'path_list']`, 如`latestPrimingTopo`的结果
+        - args-> df_upds {pl.DF}: `['time_bin', 'peer_AS', 'dest_pref', 'path_list']`, 按时间排序
+        - return {dict}: 
+            - `time_bin`, `key`: 每行的时间片(拓扑表为-1)与`(peer_AS, dest_pref)`编号
+            - `e_row`, `e_src`, `e_dst`: 每行path中的相邻AS对(不含path prepending造成的自环)及其所在行
+            - `bins`: updates中出现的时间片(升序)
+        '''
+        sel= [ pl.col('peer_AS').cast(pl.Int64), pl.col('dest_pref').cast(pl.Utf8), 'path_list' ]
+        ldfs= [ df_topo.lazy().select([ pl.lit(-1).cast(pl.Int32).alias('time_bin') ]+ sel) ]
+        if df_upds is not None:
+            ldfs.append( df_upds.lazy().select([ pl.col('time_bin').cast(pl.Int32) ]+ sel) )
+        df= pl.concat(ldfs).collect()
+        key= ( df.lazy()
+            .select([ 'peer_AS', 'dest_pref' ])
+            .with_row_count('row')
+            .groupby([ 'peer_AS', 'dest_pref' ])
+            .agg( pl.col('row') )
+            .with_row_count('key')
+            .select([ 'key', 'row' ])
+            .explode('row')
+            .sort('row')
+        ).collect()['key'].to_numpy()
+
+        arr= df['path_list'].to_arrow()
+        if isinstance(arr, pa.ChunkedArray):
+            arr= arr.combine_chunks()
+        vals  = arr.flatten()
+        parent= pc.list_parent_indices(arr).to_numpy()
+        valid = pc.is_valid(vals).to_numpy(zero_copy_only= False)
+        vals  = pc.fill_null(vals, 0).to_numpy().astype(np.int64)
+        keep= (parent[:-1]== parent[1:]) & valid[:-1] & valid[1:] & (vals[:-1]!= vals[1:])
+        time_bin= df['time_bin'].to_numpy()
+        return {
+            'time_bin': time_bin,
+            'key'     : key,
+            'e_row'   : parent[:-1][keep],
+            'e_src'   : vals[:-1][keep],
+            'e_dst'   : vals[1:][keep],
+            'bins'    : np.unique(time_bin[time_bin>= 0]).tolist(),
+        }
+
+    @staticmethod
+    def slotEdges(topo_index: dict, j= None):
+        '''- 时间片j结束时的拓扑: 每个`(peer_AS, dest_pref)`取`time_bin<= j`的最新一行(j为None时取全部), 返回其去重的AS边
+        - return {np.ndarray}: shape (n, 2), int64'''
+        tb, key= topo_index['time_bin'], topo_index['key']
+        rows= np.arange(len(tb)) if j is None else np.where(tb<= j)[0]
+        _, last= np.unique(key[rows][::-1], return_index= True)
+        latest= np.zeros(len(tb), dtype= bool)
+        latest[ rows[::-1][last] ]= True
+        m= latest[ topo_index['e_row'] ]
+        # AS号为32位无符号数(如私有的42xxxxxxxx), 在uint64中打包, 以免高位AS进入int64的符号位
+        src, dst= topo_index['e_src'][m].astype(np.uint64), topo_index['e_dst'][m].astype(np.uint64)
+        pair= np.unique( (src<< np.uint64(32))| dst )
+        return np.stack([ pair>> np.uint64(32), pair& np.uint64(0xFFFFFFFF) ], axis= 1).astype(np.int64)
+
     @staticmethod 
     #@utils.timer
-    def perSlotTopo(pd_shared_topo, pd_shared_preDF= None, j= None, space=12):   # space14()
+    def perSlotTopo(topo_index, j= None, space=12):   # space14()
         '''获取当前slot的拓扑的边关系
-        - pd_shared_preDF(pd.DF)
-        - pd_shared_topo(pd.DF
+        - topo_index(dict): 见`topoIndex`; 仅含numpy数组, 可在fork出的子进程中直接读取
         '''
-        if pd_shared_preDF== None:
-            pd_cur_upds= pd.DataFrame()
-            pd_topo= pd_shared_topo
-        else:
-            pd_cur_upds= ( pd_shared_preDF.value
-                .loc[ pd_shared_preDF.value['time_bin']<= j]
-                .groupby([ 'peer_AS', 'dest_pref' ])
-                .tail(1)
-                .iloc[:, 1:])
-            pd_topo= pd_shared_topo.value
-
-        all_path= ( pd.concat([pd_topo, pd_cur_upds], ignore_index=True)
-            .groupby([ 'peer_AS', 'dest_pref' ])
-            .tail(1)
-            .reset_index(drop=True)
-            .loc[:,'path_raw']
-            .str
-            .split(" ")
-            .explode()           
-            .rename('AS_raw')
-            )
-             
-        #logger.info(f'合并后: {utils.curMem()}')   
-        all_path_shift= ( all_path
-            .groupby(all_path.index)
-            .shift(-1)
-            #.fillna(method='ffill')     
-            .rename('AS_shift'))
-             
-        res= ( pd.concat([ all_path, all_path_shift], axis=1)
-                .rename(columns= {0: "AS_raw", 1: "AS_shift"})
-            )
-        res= (res
-            .loc[res['AS_raw']!= res['AS_shift'], :]
-            .drop_duplicates()
-            .dropna()).values
-        
-        '''ldf_cur_upds= ( pd_shared_preDF.value#.lazy()   
-            .filter( (pl.col('time_bin')<= j) )    
-            .groupby([ 'peer_AS', 'dest_pref' ])
-            .tail(1)
-            .select( ['peer_AS','dest_pref','path_raw'] )    
-        )#.collect()
-        res = ( pl.concat( [ pd_shared_topo.value.lazy(), ldf_cur_upds.lazy() ])   
-            .groupby( [ 'peer_AS', 'dest_pref' ] )
-            .tail(1)
-            #.with_row_count('index')             
-            .drop_nulls()    
-            .select([                             
-                pl.col('path_raw').str.split(" ").alias('path_list_raw'),
-                pl.col('path_raw').str.split(" ").arr.shift( -1 ).alias('path_list_sft')
-            ])
-            .explode( ['path_list_raw', 'path_list_sft'] )   
-            .filter( (pl.col('path_list_sft') != None)&
-                    (pl.col('path_list_raw') != pl.col('path_list_sft')) 
-                    )       
-            .unique()
-        ).collect().to_numpy()'''
+        res= GraphBase.slotEdges(topo_index, j)
 
         G= nx.Graph()
         G.add_edges_from( res )
@@ -218,7 +222,8 @@ class GraphBase( object ):
             featFunc, *args= val
             try:
                 t_= time()
-                res_nk[ featNm ]= featFunc( *args )
+                with utils.profiler.span(featNm, 'graph', lib= 'networkit'):
+                    res_nk[ featNm ]= featFunc( *args )
                 #logger.info(f' '*(space)+ f'thread_func= `{featNm}`; cost={(time() - t_):3.2f} sec; cur_memo= {utils.curMem()}')
 
             except Exception as e :
@@ -298,7 +303,8 @@ class GraphBase( object ):
             res_nx= manager.dict()
             for featNm, (func, *args) in feats_nx.items():
                 t_= time()
-                res_nx[ featNm ]= func( *args )
+                with utils.profiler.span(featNm, 'graph', lib= 'networkx'):
+                    res_nx[ featNm ]= func( *args )
                 #logger.info(f' '*(space)+ f'nx_func= `{featNm}`; cost={(time() - t_):3.2f} sec; cur_memo= {utils.curMem()}')
 
             
@@ -314,11 +320,11 @@ class GraphBase( object ):
 
     @staticmethod
     @utils.timer
-    def perSlotComput(pd_shared_topo,pd_shared_preDF,shared_res, feats_dict, raw_dir, j, lock= None, space=10):   #space12()
-        ''''''
+    def perSlotComput(topo_index, shared_res, feats_dict, raw_dir, j, lock= None, space=10):   #space12()
+        '''- topo_index: 见`topoIndex`'''
         logger.info(f' '*(space)+ f'start `perSlotComput`-----------{j:4d}: ( pid:{os.getpid()}[{utils.curMem()}], ppid:{os.getppid()}[{utils.curMem(True)}] )')
         
-        G = GraphBase.perSlotTopo(pd_shared_topo,pd_shared_preDF, j, space+2)
+        G = GraphBase.perSlotTopo(topo_index, j, space+2)
         num_ori_nodes= len(G.nodes)
         G, nodes= GraphBase.getKcoreNodes(G, j, space+2)    
 
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: 按peer输出的传统特征(`FET(by_peer= True)`), 用于比较各peer会话(如哪些peer看到了泄露), 无需按peer过滤输入后逐个重跑。
+    - `FeatPlan.run`在按time_bin聚合之后, 以`['time_bin', 'peer_AS']`为分组键(`featTradition._grain`)再次调用各叶子节点,
+      两种粒度的聚合在同一次`pl.collect_all`中计算, 共享全部上游节点(预处理、peerPfx历史、grouping sets、编辑距离等)。
+    - 输出为长格式Parquet: 每个(time_bin, peer_AS)一行, 列为`time_bin`, `date`, `peer_AS`, 特征..., ratio特征。
+      某peer在某时间片没有某叶子节点的行(如只有撤销时的path类)时, 该组特征为null。
+    - 各chunk的结果先写为`{输出}.parts/part-*.parquet`, 结束时合并为一个文件; `top_peers= K`时只保留全程报文数最多的K个peer。
+    - 不支持: 图特征, 稀有AS(`AS_rare_*`, 依赖全局累计状态), 以及sketch模式。
+'''
+import os, glob, shutil
+import polars as pl
+
+from fastFET import utils, featTradition
+from fastFET.featTree import featTree
+
+grain= [ 'time_bin', 'peer_AS' ]
+_skip= [ 'path_AStotal_rare' ]      # 不按peer输出的叶子节点
+
+
+def groupsOf(groups: dict) -> dict:
+    '''- 按peer输出的特征组。args-> groups {dict}: `FeatPlan.groups`。return {dict}: 路径元组 -> 特征'''
+    return { path: feats for path, feats in groups.items() if path[-1] not in _skip }
+
+def align(dfs: list, on= grain) -> pl.DataFrame:
+    '''- 把若干以`on`(多列)为唯一键的结果按键对齐后横向拼接, 保留任一结果中出现过的键, 缺失处为null。return {pl.DataFrame}: 按`on`升序'''
+    dfs= [ df.with_columns([ pl.col('time_bin').cast(utils.bin_dtype), pl.col('peer_AS').cast(pl.Int32) ]) for df in dfs ]
+    res= pl.concat([ df.select(on) for df in dfs ]).unique().sort(on)
+    for df in dfs:
+        res= res.join(df, on= on, how= 'left')
+    return res
+
+
+class PeerSink():
+    '''- 按peer的特征表: 逐chunk写出, 结束时合并并按报文数截取top-K peer'''
+    def __init__(self, path: str, featNms: list, top= None) -> None:
+        '''
+        - args-> path {str}: 输出文件, 如`Dataset/features/20211004__evt__rrc00__peer.parquet`
+        - args-> featNms {list}: 目标特征(`FET.featNms`), 只输出其中可按peer计算的
+        - args-> top {int}: 只保留全程报文数最多的K个peer; 默认全部
+        '''
+        self.path= path
+        self.parts= path+ '.parts/'
+        self.top= top
+        self.part= 0
+        self.cnt= None      # 各peer的累计报文数, `['peer_AS', 'n']`
+        self.date= None     # 本chunk各时间片的`date`
+        self.featNms= list(featNms)
+        if os.path.isdir(self.parts):
+            shutil.rmtree(self.parts)
+        os.makedirs(self.parts)
+
+    def sinks(self, root: pl.LazyFrame) -> list:
+        '''- 各peer的报文数与各时间片的`date`。return {list}: `[(ldf, writer)]`, 供`FeatPlan.run`与特征在同一次`pl.collect_all`中计算'''
+        return [
+            ( root.groupby('peer_AS').agg( pl.count().alias('n') ), self._count ),
+            ( root.groupby('time_bin').agg( utils.tsFormat(pl.col('timestamp').first()).alias('date') ), self._date ),
+        ]
+
+    def _count(self, df: pl.DataFrame):
+        df= df.with_columns([ pl.col('peer_AS').cast(pl.Int32), pl.col('n').cast(pl.UInt64) ])    # 不在`.agg`内cast, 见`featTradition.volGroupingSets`
+        self.cnt= df if self.cnt is None else (pl.concat([ self.cnt, df ])
+            .groupby('peer_AS').agg( pl.col('n').sum() ))
+
+    def _date(self, df: pl.DataFrame):
+        self.date= df.with_column( pl.col('time_bin').cast(utils.bin_dtype) )
+
+    def write(self, groups: dict, dfs: list):
+        '''
+        - description: 写出一个chunk的按peer特征
+        - args-> groups {dict}: 按peer输出的特征组(`groupsOf`)
+        - args-> dfs {list}: 各组按`grain`的聚合结果, 顺序同groups
+        '''
+        if not len(dfs):
+            return
+        feats= [ f for fs in groups.values() for f in fs ]
+        df= align(dfs).select( grain+ feats )
+        ratio_feats= [ f for f in self.featNms if f in featTree['ratio'] and set(featTree['ratio'][f])<= set(feats) ]
+        if len(ratio_feats):
+            df= featTradition.ratio(ratio_feats, featTree, df)
+        df= (df.join(self.date, on= 'time_bin', how= 'left')
+            .select( [ 'time_bin', 'date', 'peer_AS' ]+ feats+ ratio_feats ))
+        df.write_parquet(f'{self.parts}part-{self.part:05d}.parquet')
+        self.part+= 1
+
+    def close(self):
+        '''- 合并各chunk的结果为`self.path`(按time_bin, peer_AS升序), 只保留top-K peer。return {str}: 输出文件; 无结果时为None'''
+        files= sorted(glob.glob(self.parts+ 'part-*.parquet'))
+        if not len(files):
+            shutil.rmtree(self.parts)
+            return None
+        df= pl.concat([ pl.read_parquet(p) for p in files ])
+        if self.top is not None and self.cnt is not None:
+            peers= self.cnt.sort([ 'n', 'peer_AS' ], reverse= [ True, False ]).head(self.top)['peer_AS']
+            df= df.filter( pl.col('peer_AS').is_in(peers) )
+        df.sort(grain).write_parquet(self.path)
+        shutil.rmtree(self.parts)
+        return self.path
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: 传统特征的执行计划(DAG)。
+    - `FeatPlan(featNms)`把目标特征一次性编译为节点DAG: 节点为featTree中的路径前缀, 其函数为`featTradition`中的同名函数。
+      共享前缀的特征组只计算一次该前缀, 替代`FET.recurFunc`对每组的递归重算。
+    - 执行时按深度逐层计算节点。被多个下游使用、且不是直通(返回输入本身)的LazyFrame中间结果, 每层以一次`pl.collect_all`物化:
+      polars的`.cache()`只在单个查询计划内生效, 无法跨`collect_all`共享。
+    - 各组的聚合结果由`utils.alignHstack`按time_bin对齐后一次性横向拼接, 替代逐个`join(on='time_bin')`。
+    - 节点登记的旁路输出(`featTradition.addSink`, 如MOAS行), 以及供多粒度上卷的部分聚合(`featRollup.PartialStore`), 与各组的聚合在同一次`pl.collect_all`中计算。
+    - 按peer输出时(`featPeer.PeerSink`), 各叶子节点以`['time_bin', 'peer_AS']`为分组键再调用一次, 其聚合也在同一次`pl.collect_all`中计算。
+    - 开启剖析(`utils.profiler`)时, 每个节点与每组聚合单独物化并记为span(行数、估计大小、时间与内存), 不再跨节点合并计算。
+'''
+import polars as pl
+
+from fastFET import utils, featTradition, featRollup, featPeer
+from fastFET.featTree import featTree
+
+
+class FeatPlan(object):
+    '''传统特征(不含graph与ratio)的执行计划'''
+
+    def __init__(self, featNms, tree= featTree, sketched= ()) -> None:
+        '''
+        - args-> featNms {list}: 目标特征, 如`FET.featNms`
+        - args-> tree {dict}: 特征树
+        - args-> sketched {set}: sketch模式下以估计值代替的特征(`featSketch.sketchedFeats`), 节点已按time_bin给出该列, 聚合时取`.first()`
+        '''
+        self.featNms= list(featNms)
+        self.sketched= set(sketched)
+        index= utils.treeIndex(tree)
+        self.groups= { path: feats for path, feats in utils.featsGrouping(tree, self.featNms).items()
+                        if 'graph' not in path and 'ratio' not in path }
+        self.exprs= { path: [ pl.col(f).first().alias(f) if f in self.sketched else index[f][1] for f in feats ]
+                        for path, feats in self.groups.items() }
+
+        # 节点 -> 下游(子节点, 或本节点上的聚合'agg'), 保持featNms中的顺序
+        self.consumers= {}
+        def add(node, child):
+            if child not in self.consumers[node]:
+                self.consumers[node].append(child)
+        for path in self.groups:
+            for i in range(1, len(path)+ 1):
+                self.consumers.setdefault( path[:i], [] )
+                if i> 1:
+                    add( path[:i-1], path[:i] )
+            add( path, 'agg' )
+        depth= max([ len(n) for n in self.consumers ], default= 0)
+        self.levels= [ [ n for n in self.consumers if len(n)== d ] for d in range(1, depth+ 1) ]
+
+    def __len__(self):
+        return len(self.groups)
+
+    def describe(self):
+        '''- return {str}: DAG的树形文本, 节点后为其下游数量; 被多个下游共享的节点以`*`标出(非直通时在执行中物化)'''
+        lines= []
+        def recur(node):
+            mark= '*' if len(self.consumers[node])> 1 else ' '
+            lines.append( f"{'  '*(len(node)-1)}{mark}{node[-1]} ({len(self.consumers[node])})" )
+            for child in self.consumers[node]:
+                if child!= 'agg':
+                    recur(child)
+        for root in self.levels[0] if len(self.levels) else []:
+            recur(root)
+        return '\n'.join(lines)
+
+    def run(self, obj, root: pl.LazyFrame):
+        '''
+        - description: 在当前chunk上执行计划
+        - args-> obj {FET}: 节点函数的第2个参数(状态表、编码器、`midnode_res`等)
+        - args-> root {pl.LazyFrame}: 预处理结果
+        - return {list}: 每个特征组的聚合结果(pl.DataFrame), 顺序同`self.groups`; 旁路输出在返回前交给各自的writer
+        '''
+        # 开启剖析时(`utils.profiler`)逐节点物化并记录span, 以便把耗时归到节点上; 总耗时因此高于正常运行
+        prof= utils.profiler
+        rows= { (): root.select(pl.count()).collect()[0, 0] } if prof.on else {}
+        memo= { (): root }
+        for level in self.levels:
+            shared= []
+            for node in level:
+                name= node[-1]
+                if name in obj.midnode_res:
+                    memo[node]= obj.midnode_res[name].lazy()
+                    continue
+                inp= memo[ node[:-1] ]
+                with prof.span(name, 'node', rows_in= rows.get(node[:-1])) as sp:
+                    out= getattr(featTradition, name)( inp, obj )
+                    if prof.on and isinstance(out, pl.LazyFrame) and out is not inp:
+                        df= out.collect()
+                        sp.update( prof.frameArgs(df) )
+                        rows[node]= df.height
+                        out= df.lazy()
+                    elif prof.on:
+                        rows[node]= rows.get(node[:-1])     # 直通或LazyGroupBy: 沿用输入行数
+                memo[node]= out
+                if ( isinstance(out, pl.LazyFrame) and out is not inp and name not in obj.midnode_res
+                        and len(self.consumers[node])> 1 and not prof.on ):
+                    shared.append(node)
+            if len(shared):
+                for node, df in zip( shared, pl.collect_all([ memo[n] for n in shared ]) ):
+                    memo[node]= df.lazy()
+
+        # 多粒度上卷的部分聚合与特征在同一次`.agg`中计算(polars 0.13的LazyGroupBy只能`.agg`一次), 写出后只保留特征列
+        store= getattr(obj, 'partial_store', None)
+        extra= { path: featRollup.partialExprs(path, feats) if store is not None else [] for path, feats in self.groups.items() }
+        ldfs= [ memo[path].agg( self.exprs[path]+ extra[path] ) for path in self.groups ]
+        # 按peer输出: 叶子节点以`featPeer.grain`再调用一次(输入为已计算的上游节点), 其聚合排在各组之后
+        peers= getattr(obj, 'peer_sink', None)
+        pgroups= featPeer.groupsOf(self.groups) if peers is not None else {}
+        if len(pgroups):
+            obj.grain= featPeer.grain
+            try:
+                ldfs+= [ getattr(featTradition, path[-1])( memo[path[:-1]], obj ).agg( self.exprs[path] ) for path in pgroups ]
+            finally:
+                obj.grain= None
+        sinks= featTradition.popSinks(obj)
+        if store is not None:
+            sinks.append( store.dateSink(root) )
+        if peers is not None:
+            sinks+= peers.sinks(root)
+        if prof.on:
+            dfs= []
+            names= [ path[-1] for path in self.groups ]+ [ path[-1]+ '@peer' for path in pgroups ]     # 按peer的聚合单独记为span
+            for path, name, ldf in zip( list(self.groups)+ list(pgroups), names, ldfs ):
+                with prof.span(name, 'agg', rows_in= rows.get(path)) as sp:
+                    dfs.append( ldf.collect() )
+                    sp.update( prof.frameArgs(dfs[-1]) )
+            with prof.span('sinks', 'agg', n= len(sinks)):
+                dfs+= pl.collect_all([ ldf for ldf, _ in sinks ]) if len(sinks) else []
+        else:
+            dfs= pl.collect_all( ldfs+ [ ldf for ldf, _ in sinks ] ) if len(ldfs)+ len(sinks) else []
+        for (_, writer), df in zip( sinks, dfs[len(ldfs):] ):
+            writer(df)
+        if peers is not None:
+            peers.write( pgroups, dfs[len(self.groups): len(ldfs)] )
+        dfs= dfs[:len(self.groups)]
+        if store is not None:
+            for i, (path, feats) in enumerate(self.groups.items()):
+                store.writeGroup(path, feats, dfs[i])
+                dfs[i]= dfs[i].select( dfs[i].columns[: 1+ len(self.exprs[path])] )
+        return dfs
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: 传统特征的多时间粒度上卷(roll-up)。
+    - 以细粒度(如slot=60s)运行时, 每个特征组在聚合前另存一份"可合并的部分聚合"(partials), 写入`PartialStore`:
+        - 行级特征: 每个时间片的sum/max, 均值存为(和, 个数);
+        - 键控特征(`exprDict`族, 如`v_pfx_t_*`、`As_total_*`): 每个时间片内各键的计数;
+        - 去重计数(`v_peer`): 每个时间片内出现过的键的集合(精确);
+        - 稀有AS(`AS_rare_*`): 每个时间片结束时的累计值`rare_num`与`upds_num`。
+    - `rollup(root, slot)`把time_bin映射到更粗的时间片(须为细粒度slot的整数倍), 合并部分聚合后再套用`featTree`中的原表达式,
+      结果与以该slot直接运行`FET.run`一致(同样的chunk划分下), 无需重新解析与计算。图特征不参与上卷。
+'''
+import os, glob, json, shutil
+import polars as pl
+
+from fastFET import utils, featTradition
+from fastFET.featTree import featTree
+
+_max= [ 'path_len_max', 'path_unq_len_max', 'ED_max' ]
+    # 均值: 特征 -> (和, 个数, 结果类型), 与`featTree`中的原表达式一致
+_mean= {
+    'path_len_avg':     (pl.col('path_len').sum(),     pl.col('path_len').is_not_null().sum(),     pl.Float64),
+    'path_unq_len_avg': (pl.col('path_unq_len').sum(), pl.col('path_unq_len').is_not_null().sum(), pl.Float64),
+    'ED_avg':           (pl.col('ED').sum(),           pl.col('ED').count(),                       pl.Float32),
+}
+    # 去重计数: 特征 -> 键
+_distinct= { 'v_peer': 'peer_AS' }
+    # 键控的叶子节点 -> (键, 计数列)
+_keyed= dict([ (node, (keys, name)) for node, (keys, _, name) in featTradition.vol_sets.items() ]+
+             [ ('path_AStotal_count', (('AS',), 'As_total')) ])
+    # 每个时间片一行的叶子节点 -> {列: 上卷时的合并方式}
+_frames= { 'path_AStotal_rare': { 'rare_num': pl.col('rare_num').last(), 'upds_num': pl.col('upds_num').sum() } }
+
+
+def groupsOf(featNms):
+    '''- 参与上卷的特征组(与`FeatPlan.groups`相同)。return {dict}: 路径元组 -> 特征'''
+    return { path: feats for path, feats in utils.featsGrouping(featTree, featNms).items()
+                if 'graph' not in path and 'ratio' not in path }
+
+def parts(path, feats):
+    '''- 一个特征组的部分聚合表。return {list}: `[(表名, 特征)]`; 行级特征合为一张表, 每个去重计数特征各一张表'''
+    name= '.'.join(path)
+    dist= [ f for f in feats if f in _distinct ]
+    rest= [ f for f in feats if f not in _distinct ]
+    return ( [(name, rest)] if len(rest) else [] )+ [ (f'{name}#{f}', [f]) for f in dist ]
+
+def partialExprs(path, feats) -> list:
+    '''- 部分聚合所需的额外聚合表达式, 与该组的特征在同一次`.agg`中计算(sum/max特征的部分聚合即特征本身, 无需额外表达式)'''
+    node= path[-1]
+    if node in _keyed:
+        keys, col= _keyed[node]
+        return [ pl.col(k) for k in keys ]+ [ pl.col(col) ]     # 每个时间片的键与计数(列表)
+    if node in _frames:
+        return [ pl.col(c).first() for c in _frames[node] ]
+    res= []
+    for f in feats:
+        if f in _mean:
+            s, n, _= _mean[f]
+            res+= [ s.alias(f+ '__s'), n.alias(f+ '__n') ]
+        elif f in _distinct:
+            res.append( pl.col(_distinct[f]).unique() )
+    return res
+
+def partials(path, feats, df: pl.DataFrame) -> list:
+    '''
+    - description: 从该组的聚合结果(特征列及`partialExprs`的列)中取出部分聚合表
+    - return {list}: `[(表名, pl.DataFrame)]`, 表名同`parts`
+    '''
+    node= path[-1]
+    tabs= dict(parts(path, feats))
+    if node in _keyed:
+        keys, col= _keyed[node]
+        return [ (name, df.select( ['time_bin']+ list(keys)+ [col] ).explode( list(keys)+ [col] )) for name in tabs ]
+    if node in _frames:
+        return [ (name, df.select( ['time_bin']+ list(_frames[node]) )) for name in tabs ]
+    res= []
+    for name, fs in tabs.items():
+        if fs[0] in _distinct:
+            key= _distinct[fs[0]]
+            res.append( (name, df.select(['time_bin', key]).explode(key)) )
+        else:
+            cols= []
+            for f in fs:
+                cols+= [ f+ '__s', f+ '__n' ] if f in _mean else [ f ]
+            res.append( (name, df.select( ['time_bin']+ cols )) )
+    return res
+
+def _merge(path, feats, df: pl.DataFrame) -> pl.DataFrame:
+    '''- 把time_bin已映射到粗粒度的部分聚合表合并为该粒度下的特征'''
+    node= path[-1]
+    index= utils.treeIndex(featTree)
+    orig= [ index[f][1] for f in feats ]
+    if node in _keyed:
+        keys, col= _keyed[node]
+        return (df.lazy()
+            .groupby(['time_bin']+ list(keys)).agg( pl.col(col).sum() )
+            .groupby('time_bin').agg(orig)).collect()
+    if node in _frames:
+        return (df.lazy()
+            .sort('fine_bin')
+            .groupby('time_bin', maintain_order= True).agg( list(_frames[node].values()) )
+            .groupby('time_bin').agg(orig)).collect()
+    if feats[0] in _distinct:
+        return (df.lazy()
+            .select([ 'time_bin', _distinct[feats[0]] ]).unique()
+            .groupby('time_bin').agg(orig)).collect()
+    merge, final= [], []
+    for f in feats:
+        if f in _mean:
+            merge+= [ pl.col(f+ '__s').sum(), pl.col(f+ '__n').sum() ]
+            final.append( (pl.col(f+ '__s')/ pl.col(f+ '__n')).cast(_mean[f][2]).alias(f) )
+        elif f in _max:
+            merge.append( pl.col(f).max() )
+            final.append( pl.col(f) )
+        else:
+            merge.append( pl.col(f).sum() )
+            final.append( pl.col(f) )
+    return df.lazy().groupby('time_bin').agg(merge).select( ['time_bin']+ final ).collect()
+
+
+class PartialStore():
+    '''- 部分聚合的存储: `{root}meta.json`, 及每张部分聚合表的`{root}{表名}/part-{序号}.parquet`(每个chunk一个文件)'''
+    def __init__(self, root: str, slot= None, first_ts= None, featNms= None) -> None:
+        '''
+        - args-> root {str}: 存储目录, 如`Dataset/partials/20211004__evt__rrc00/`
+        - args-> slot, first_ts, featNms: 写入时给出(清空已有目录并写meta); 只读时省略, 从meta读取
+        '''
+        self.root= root if root.endswith('/') else root+ '/'
+        self.part= {}
+        if slot is not None:
+            if os.path.isdir(self.root):
+                shutil.rmtree(self.root)
+            os.makedirs(self.root)
+            self.meta= { 'slot': slot, 'first_ts': int(first_ts), 'featNms': list(featNms) }
+            with open(self.root+ 'meta.json', 'w') as f:
+                json.dump(self.meta, f)
+        else:
+            with open(self.root+ 'meta.json') as f:
+                self.meta= json.load(f)
+
+    def write(self, name: str, df: pl.DataFrame):
+        n= self.part.get(name, 0)
+        os.makedirs(self.root+ name, exist_ok= True)
+        df.write_parquet(f'{self.root}{name}/part-{n:05d}.parquet')
+        self.part[name]= n+ 1
+
+    def read(self, name: str) -> pl.DataFrame:
+        return pl.concat([ pl.read_parquet(p) for p in sorted(glob.glob(f'{self.root}{name}/part-*.parquet')) ])
+
+    def dateSink(self, root: pl.LazyFrame):
+        '''- 每个时间片的首条报文时间(上卷后的`date`列)。return {tuple}: `(ldf, writer)`, 供`FeatPlan.run`与特征在同一次`pl.collect_all`中计算'''
+        return ( root.groupby('time_bin').agg( pl.col('timestamp').first().alias('ts') ), lambda df: self.write('_date', df) )
+
+    def writeGroup(self, path, feats, df: pl.DataFrame):
+        '''- 写出一个特征组的部分聚合, df为`.agg(特征+ partialExprs)`的结果'''
+        for name, part in partials(path, feats, df):
+            self.write(name, part)
+
+
+def rollup(root: str, slot: int) -> pl.DataFrame:
+    '''
+    - description: 由`PartialStore`中的部分聚合得到`slot`粒度的传统特征
+    - args-> root {str}: `PartialStore`的目录
+    - args-> slot {int}: 目标粒度(s), 须为存储时slot的整数倍
+    - return {pl.DataFrame}: 列同`FET`的输出(`time_bin`, `date`, 特征..., ratio特征), 按time_bin升序
+    '''
+    store= PartialStore(root)
+    fine, featNms= store.meta['slot'], store.meta['featNms']
+    if slot% fine:
+        raise ValueError(f'slot {slot} is not a multiple of the stored slot {fine}')
+    k= slot// fine
+    coarse= lambda df: df.with_columns([ pl.col('time_bin').alias('fine_bin'), (pl.col('time_bin')// k).cast(utils.bin_dtype).alias('time_bin') ])
+
+    dfs= []
+    for path, feats in groupsOf(featNms).items():
+        sub= [ _merge(path, fs, coarse(store.read(name))) for name, fs in parts(path, feats) ]
+        df= utils.alignHstack(sub) if len(sub)> 1 else sub[0]
+        dfs.append( df.select( ['time_bin']+ feats ) )
+    df_res= utils.alignHstack(dfs)
+    ratio_feats= [ f for f in featNms if f in featTree['ratio'] ]
+    if len(ratio_feats):
+        df_res= featTradition.ratio(ratio_feats, featTree, df_res)
+
+    df_date= (coarse(store.read('_date')).lazy()
+        .sort('fine_bin')
+        .groupby('time_bin', maintain_order= True).agg( utils.tsFormat(pl.col('ts').first()).alias('date') )
+    ).collect()
+    return (df_date.join(df_res, on= 'time_bin', how= 'outer')
+        .sort('time_bin')
+        .fill_null('forward'))
@@ -0,0 +1,290 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: 近似计数(sketch)模式, 按类别替代体量类/路径类中代价最高的精确去重与按键计数(需在(time_bin, 键)上建分组, 全球泄露时达数百万组)。
+    用`FET.setCustomFeats(FEAT, sketch= [...])`按类别开启, 默认关闭(精确模式)。
+    - 去重计数(`v_peer`, `*_cnt`): HyperLogLog, m= 2^p个寄存器。相对标准误差约 1.04/√m (p=12: 1.6%; p=14: 0.8%);
+      估计值 ≤ 2.5m 时改用线性计数, 小基数(如`v_peer`)下几乎精确。
+    - 每键计数的最大值(`*_max`): Count-Min, 宽w为不小于e/ε的2的幂, 深d= ⌈ln(1/δ)⌉。单个键的估计f̂满足 f ≤ f̂ ≤ f+ ε·N (概率 ≥ 1-δ),
+      N为该时间片内参与计数的报文数; 结果取各报文所属键的估计的最大值, 故不会低于精确值。
+    - 每键计数的均值(`*_avg`): N/ 去重计数的估计。N精确, 相对误差同HLL。
+    - 内存只与时间片数和sketch大小有关(每个时间片m字节的寄存器与d·w个计数器, 及按块(`Sketcher.block`行)处理的临时数组), 与键的数量无关。
+    - 与`featRollup`的部分聚合不兼容(sketch的估计值不可按键合并)。
+    - 基准测试: `benchmark()`, 或`python -m fastFET.featSketch [updates目录]`, 对比两种模式的耗时、峰值内存与误差。
+'''
+import os, glob, time, random, resource, argparse
+import multiprocessing
+import numpy as np
+import polars as pl
+
+from fastFET import utils
+from fastFET.featTree import featTree, getAllFeats
+
+    # 可开启sketch的类别 -> 以估计值代替的特征
+cateFeats= {
+    'volume': ['v_peer']+ getAllFeats(featTree['volume']['vol_pfx'])+ getAllFeats(featTree['volume']['vol_oriAS']),
+    'path':   getAllFeats(featTree['path']['path_AStotal']['path_AStotal_count']),
+}
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    '''- murmur3的fmix64: `hash_rows`对整数键的输出各位分布不均, HLL与Count-Min需要均匀的64位hash'''
+    h= h^ (h>> np.uint64(33))
+    h*= np.uint64(0xff51afd7ed558ccd)
+    h^= h>> np.uint64(33)
+    h*= np.uint64(0xc4ceb9fe1a85ec53)
+    h^= h>> np.uint64(33)
+    return h
+
+
+class Sketcher():
+    '''一个类别的sketch参数, 及在一个chunk上的估计'''
+    seeds= ( (11, 23, 37, 41), (53, 67, 71, 83) )     # `hash_rows`的两组种子: HLL、Count-Min
+    block= 1<< 18                                       # 分块处理的行数
+
+    def __init__(self, p= 12, eps= 1e-3, delta= 1e-2) -> None:
+        '''
+        - args-> p {int}: HLL的寄存器数为2^p, 7 ≤ p ≤ 16
+        - args-> eps {float}: Count-Min的相对误差ε(相对于时间片内的报文数)
+        - args-> delta {float}: Count-Min误差超过ε·N的概率δ
+        '''
+        if not 7<= p<= 16:
+            raise ValueError(f'HLL precision p= {p} is out of range [7, 16]')
+        self.p, self.m= p, 1<< p
+        self.alpha= 0.7213/ (1+ 1.079/ self.m)
+        self.w= 1<< int(np.ceil(np.log2(np.e/ eps)))       # 取2的幂(≥ e/ε), 以位与代替取模
+        self.d= int(np.ceil(np.log(1/ delta)))
+
+    def bound(self) -> dict:
+        '''- return {dict}: HLL的相对标准误差, Count-Min的(ε, δ)'''
+        return { 'hll_rse': 1.04/ np.sqrt(self.m), 'cm_eps': np.e/ self.w, 'cm_delta': np.exp(-self.d) }
+
+    def _registers(self, bins: np.ndarray, h: np.ndarray, nb: int) -> np.ndarray:
+        '''
+        - description: HyperLogLog的寄存器。寄存器取hash的高p位, 秩为低32位中最低的置1位的位置(+1), 寄存器取秩的最大值
+        - args-> bins {np.ndarray}: 每行的时间片序号(0~nb-1)
+        - args-> h {np.ndarray}: 每行键的64位hash(uint64)
+        - return {np.ndarray}: `nb*m`个寄存器(uint8)
+        '''
+        reg= (h>> np.uint64(64- self.p)).astype(np.int64)+ bins* self.m
+        low= h.astype(np.uint32)| np.uint32(1<< 31)        # 哨兵位: 秩至多为32
+        rank= np.frexp( (low& (~low+ np.uint32(1))).astype(np.float32) )[1].astype(np.uint8)
+        M= np.zeros(nb* self.m, np.uint8)
+        np.maximum.at(M, reg, rank)
+        return M
+
+    def _estimate(self, M: np.ndarray, nb: int) -> np.ndarray:
+        '''- return {np.ndarray}: 每个时间片的去重计数估计(float)'''
+        m= self.m
+        M= M.reshape(nb, m)
+        E= self.alpha* m* m/ np.ldexp(1.0, -M.astype(np.int64)).sum(axis= 1)
+        V= (M== 0).sum(axis= 1)
+        small= (E<= 2.5* m)& (V> 0)
+        E[small]= m* np.log(m/ V[small])
+        return E
+
+    def _cmIndex(self, bins: np.ndarray, h: np.ndarray) -> list:
+        '''- Count-Min各行的计数器下标: 行哈希由h的高低32位组合得到(Kirsch-Mitzenmacher), 每个时间片w个计数器'''
+        lo= (h& np.uint64(0xffffffff)).astype(np.int64)
+        hi= (h>> np.uint64(32)).astype(np.int64)
+        base= bins* self.w
+        return [ base+ ((lo+ r* hi)& (self.w- 1)) for r in range(self.d) ]
+
+    def _blocks(self, df: pl.DataFrame, keys, where, b0: int, seeds):
+        '''- 逐块产出`(时间片序号, 键的hash...)`, 每组种子`self.seeds[i]`一个hash; 临时数组的内存与块大小成正比'''
+        for i in range(0, len(df), self.block):
+            sub= df.slice(i, self.block)
+            if where is not None:
+                sub= sub.filter(where)
+            if len(sub):
+                key= sub.select(list(keys))
+                yield ( sub['time_bin'].to_numpy().astype(np.int64)- b0, )+ tuple( _mix(key.hash_rows(*self.seeds[j]).to_numpy()) for j in seeds )
+
+    def _sketch(self, df: pl.DataFrame, keys, where, top: bool):
+        '''
+        - description: 在df上逐块累积HLL寄存器与Count-Min计数器; top时再逐块查询每行所属键的计数估计, 取每个时间片的最大值
+        - return {tuple}: `(首个时间片, 每个时间片的报文数N, 去重计数估计, 每键计数最大值的估计或None)`
+        '''
+        b0= int(df['time_bin'].min())
+        nb= int(df['time_bin'].max())- b0+ 1
+        N= np.zeros(nb, np.int64)
+        M= np.zeros(nb* self.m, np.uint8)
+        C= np.zeros((self.d, nb* self.w), np.int64) if top else None
+        for bins, h, *g in self._blocks(df, keys, where, b0, (0, 1) if top else (0,)):
+            N+= np.bincount(bins, minlength= nb)
+            np.maximum(M, self._registers(bins, h, nb), out= M)
+            if top:
+                for r, idx in enumerate(self._cmIndex(bins, g[0])):
+                    C[r]+= np.bincount(idx, minlength= nb* self.w)
+        mx= None
+        if top:
+            mx= np.zeros(nb, np.int64)
+            for bins, g in self._blocks(df, keys, where, b0, (1,)):
+                idx= self._cmIndex(bins, g)
+                est= C[0][idx[0]]
+                for r in range(1, self.d):
+                    np.minimum(est, C[r][idx[r]], out= est)
+                np.maximum.at(mx, bins, est)
+        K= np.clip( np.rint(self._estimate(M, nb)), 1, np.maximum(N, 1) )
+        return b0, N, K, mx
+
+    def count(self, df: pl.DataFrame, keys, name: str, where= None) -> pl.DataFrame:
+        '''
+        - description: 每个时间片内键的去重计数, 对应精确模式的`pl.col(键).unique().count()`
+        - args-> df {pl.DataFrame}: 含`time_bin`与键列
+        - args-> where {pl.Expr}: 只计入满足条件的行
+        - return {pl.DataFrame}: `['time_bin', name]`, 只含有报文的时间片
+        '''
+        if not len(df):
+            return pl.DataFrame([ pl.Series('time_bin', [], utils.bin_dtype), pl.Series(name, [], pl.UInt32) ])
+        b0, N, K, _= self._sketch(df, keys, where, False)
+        on= np.flatnonzero(N> 0)
+        return pl.DataFrame([
+            pl.Series('time_bin', on+ b0).cast(utils.bin_dtype),
+            pl.Series(name, K[on].astype(np.uint32)) ])
+
+    def keyed(self, df: pl.DataFrame, keys, name: str, where= None) -> pl.DataFrame:
+        '''
+        - description: 每个时间片内的按键计数, 对应精确模式下`utils.exprDict(name)`在`(time_bin, 键)`分组计数上的三个特征
+        - args-> df {pl.DataFrame}: 含`time_bin`与键列, 每行(报文)计1次
+        - args-> where {pl.Expr}: 只计入满足条件的行
+        - return {pl.DataFrame}: `['time_bin', name_cnt, name_avg, name_max]`, 只含有报文的时间片
+        '''
+        if not len(df):
+            return pl.DataFrame([ pl.Series('time_bin', [], utils.bin_dtype), pl.Series(name+ '_cnt', [], pl.UInt32),
+                pl.Series(name+ '_avg', [], pl.Float64), pl.Series(name+ '_max', [], pl.UInt32) ])
+        b0, N, K, mx= self._sketch(df, keys, where, True)
+        on= np.flatnonzero(N> 0)
+        return pl.DataFrame([
+            pl.Series('time_bin', on+ b0).cast(utils.bin_dtype),
+            pl.Series(name+ '_cnt', K[on].astype(np.uint32)),
+            pl.Series(name+ '_avg', N[on]/ K[on]),
+            pl.Series(name+ '_max', mx[on].astype(np.uint32)) ])
+
+
+def sketchers(spec) -> dict:
+    '''
+    - description: 解析`FET.setCustomFeats`的`sketch`参数
+    - args-> spec {list | dict | None}: 类别列表(默认参数), 或 类别 -> `Sketcher`的参数, 如`{'volume': {'p': 14}}`
+    - return {dict}: 类别 -> `Sketcher`
+    '''
+    if not spec:
+        return {}
+    if not isinstance(spec, dict):
+        spec= { cate: {} for cate in spec }
+    bad= set(spec)- set(cateFeats)
+    if bad:
+        raise ValueError(f'sketch mode is not available for {sorted(bad)}, only for {list(cateFeats)}')
+    return { cate: Sketcher(**(kw or {})) for cate, kw in spec.items() }
+
+def sketchedFeats(featNms, sketch: dict) -> set:
+    '''- return {set}: featNms中以估计值代替的特征'''
+    res= set()
+    for cate in sketch:
+        res|= set(cateFeats[cate])
+    return res& set(featNms)
+
+def compare(df_exact: pl.DataFrame, df_sketch: pl.DataFrame, feats= None) -> pl.DataFrame:
+    '''
+    - description: 对比同一事件在精确模式与sketch模式下的特征(如两次`FET.run`的输出), 用于评估误差
+    - args-> feats {list}: 要对比的特征, 默认为两表共有的`cateFeats`特征
+    - return {pl.DataFrame}: 每个特征一行: 相对误差`|估计-精确|/精确`的均值、最大值, 及估计值偏高的时间片比例
+    '''
+    if feats is None:
+        allf= set().union(*cateFeats.values())
+        feats= [ f for f in df_exact.columns if f in allf and f in df_sketch.columns ]
+    df= df_exact.select(['time_bin']+ feats).join(df_sketch.select(['time_bin']+ feats), on= 'time_bin', suffix= '__s')
+    res= { 'feat': [], 'rel_err_mean': [], 'rel_err_max': [], 'over_ratio': [] }
+    for f in feats:
+        e= df[f].cast(pl.Float64).fill_null(0).to_numpy()
+        s= df[f+ '__s'].cast(pl.Float64).fill_null(0).to_numpy()
+        rel= np.abs(s- e)/ np.maximum(e, 1)
+        res['feat'].append(f)
+        res['rel_err_mean'].append( float(rel.mean()) if len(rel) else 0. )
+        res['rel_err_max'].append( float(rel.max()) if len(rel) else 0. )
+        res['over_ratio'].append( float((s> e).mean()) if len(rel) else 0. )
+    return pl.DataFrame(res)
+
+
+def synthUpdates(out_dir: str, n= 1200000, files= 6, peers= 40, seed= 46) -> list:
+    '''
+    - description: 生成合成的`bgpdump -m`格式updates文件(每个文件5分钟, 约15%为撤销, 前缀取自60万个/24, 路径为peer AS加1~5跳), 供没有录制事件时的`benchmark`使用
+    - args-> out_dir {str}: 输出目录, 文件名同RIS的`rrc00_updates.YYYYMMDD.HHMM.txt`
+    - return {list}: 文件名, 按时间升序
+    '''
+    rnd= random.Random(seed)
+    os.makedirs(out_dir, exist_ok= True)
+    peer_list= [ (f'192.0.2.{i}', 65000+ i) for i in range(1, peers+ 1) ]
+    ases= [3356, 1299, 174, 2914, 6939, 15169, 13335, 8075, 4637, 7018, 701, 6453, 3257, 9002, 20940]+ list(range(20000, 20400))
+    t0= 1633348800      # 2021-10-04 12:00 UTC
+    res= []
+    for k in range(files):
+        ts0= t0+ k* 300
+        lines= []
+        for _ in range(n// files):
+            ts= rnd.randint(ts0, ts0+ 299)
+            ip, asn= rnd.choice(peer_list)
+            i= rnd.randrange(600000)
+            pfx= f'{(i>>16)+ 11}.{(i>>8)& 255}.{i& 255}.0/24'
+            if rnd.random()< 0.15:
+                lines.append( (ts, f'BGP4MP|{ts}|W|{ip}|{asn}|{pfx}') )
+                continue
+            path= [asn]+ rnd.sample(ases, rnd.randint(1, 5))
+            lines.append( (ts, f'BGP4MP|{ts}|A|{ip}|{asn}|{pfx}|{" ".join(map(str, path))}|IGP|{ip}|0|0||NAG||') )
+        lines.sort()
+        name= os.path.join(out_dir, time.strftime('rrc00_updates.%Y%m%d.%H%M.txt', time.gmtime(ts0)))
+        with open(name, 'w') as f:
+            f.write('\n'.join(l for _, l in lines)+ '\n')
+        res.append(name)
+    return res
+
+def _benchRun(paths, raw_dir, feats, sketch, slot):
+    '''- `benchmark`的子进程: 运行一次`FET.monitorHandler`。return {tuple}: (耗时s, 本进程峰值RSS(MB), 输出csv)'''
+    from fastFET import FET
+    for p in glob.glob(raw_dir+ 'features/*.csv'):     # `monitorHandler`以追加方式写出
+        os.remove(p)
+    fet= FET.FET(slot= slot, raw_dir= raw_dir)
+    fet.setCustomFeats(list(feats), sketch= sketch)
+    fet.need_rib= False
+    t= time.time()
+    fet.monitorHandler(paths, None, None, 'bench', 'sketch' if sketch else 'exact', dont_label= True)
+    t= time.time()- t
+    return t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/ 1024, glob.glob(raw_dir+ 'features/*.csv')[0]
+
+def benchmark(src= None, sketch= ('volume', 'path'), feats= ('volume', 'path'), slot= 60, n= 1200000, raw_dir= './Dataset/bench_sketch/'):
+    '''
+    - description: 精确模式与sketch模式的基准测试。两种模式各在一个新进程(spawn)中对同一输入运行`FET.monitorHandler`, 峰值RSS互不影响
+    - args-> src {str}: 录制事件的updates目录, 如`Dataset/raw_parsed/{事件}/{采集器}/`(取其中的`*updates*`文件); 默认在`raw_dir`下生成n条合成updates(`synthUpdates`)
+    - args-> sketch {list | dict}: sketch模式的参数, 同`FET.setCustomFeats`
+    - args-> feats {list}: 特征(类别)
+    - return {(pl.DataFrame, pl.DataFrame)}: 各模式的`['mode', 'time_s', 'peak_rss_mb']`, 及sketch相对精确结果的误差(`compare`)
+    '''
+    if src is None:
+        src= f'{raw_dir}synth_{n}/'
+        paths= sorted(glob.glob(src+ '*updates*')) or synthUpdates(src, n)
+    else:
+        paths= sorted(glob.glob(os.path.join(src, '*updates*')))
+    if not len(paths):
+        raise ValueError(f'no updates files in `{src}`')
+    ctx= multiprocessing.get_context('spawn')
+    runs= {}
+    for mode, sk in [ ('exact', None), ('sketch', sketch) ]:
+        with ctx.Pool(1) as pool:
+            runs[mode]= pool.apply( _benchRun, (paths, f'{raw_dir}{mode}/', feats, sk, slot) )
+    perf= pl.DataFrame({ 'mode': list(runs), 'time_s': [ r[0] for r in runs.values() ], 'peak_rss_mb': [ r[1] for r in runs.values() ] })
+    err= compare( pl.read_csv(runs['exact'][2]), pl.read_csv(runs['sketch'][2]) )
+    return perf, err
+
+
+if __name__=='__main__':
+    parser= argparse.ArgumentParser(description= 'exact vs sketch mode: time, peak RSS and error')
+    parser.add_argument('src', nargs= '?', help= 'updates directory of a recorded event; synthetic updates if omitted')
+    parser.add_argument('-n', type= int, default= 1200000, help= 'number of synthetic updates')
+    parser.add_argument('--slot', type= int, default= 60)
+    parser.add_argument('--raw_dir', default= './Dataset/bench_sketch/')
+    args= parser.parse_args()
+    from fastFET import featSketch      # 子进程按模块名导入`_benchRun`
+    perf, err= featSketch.benchmark(args.src, slot= args.slot, n= args.n, raw_dir= args.raw_dir)
+    pl.Config.set_tbl_rows(len(err))
+    print(perf)
+    print(err)
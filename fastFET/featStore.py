@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: 特征结果库(`FET(store= True)`), 以(事件, 采集器, slot, 特征, 代码版本)为键保存已算出的特征。
+    - 目录: `{root}event={evtNm}/collector={monitor}/slot={slot}/`, 每个特征一个`{特征}__{版本}.parquet`(`time_bin`, 特征),
+      以及`_date.parquet`(`time_bin`, `date`)与`meta.json`(输出csv的文件名)。
+    - 版本(`featVersion`)为特征所经featTree节点的函数源码、这些函数(递归)引用的本包函数/类/常量的源码, 及调用方给出的salt
+      (预处理源码、输入文件、sketch参数等)的hash。某个节点的代码变更只使经过它的特征失效。
+    - `FET.monitorHandler`只计算库中缺失或版本不符的特征(及其依赖, 如ratio的分量), 再与库中其余特征按time_bin横向合并写出csv。
+'''
+import os, glob, json, hashlib, inspect
+import polars as pl
+
+from fastFET import utils, featTradition, featSketch, featGraph
+from fastFET.featTree import featTree
+
+_mods= ( featTradition, utils, featSketch )
+_methods= {}    # 方法名 -> 定义它的类
+_src= {}        # id(函数/类) -> 源码
+_closure= {}    # 节点函数 -> `_sources`
+
+def _source(obj) -> str:
+    if id(obj) not in _src:
+        _src[id(obj)]= inspect.getsource(obj)
+    return _src[id(obj)]
+
+def _sources(func) -> list:
+    '''
+    - description: func及其(递归)引用的`_mods`中函数、类与常量的源码。按名字匹配: 以属性调用的方法(如`obj.ed_engine.lookup`)匹配到定义该方法名的类
+    - return {list}: 源码/repr字符串, 顺序确定; 每个进程内按func缓存
+    '''
+    if func in _closure:
+        return _closure[func]
+    if not len(_methods):
+        for mod in _mods:
+            for obj in vars(mod).values():
+                if inspect.isclass(obj) and obj.__module__== mod.__name__:
+                    for name in vars(obj):
+                        _methods.setdefault(name, []).append(obj)
+    methods= _methods
+    res, seen= [], set()
+    def add(obj):
+        if id(obj) in seen:
+            return []
+        seen.add(id(obj))
+        if inspect.isfunction(obj):
+            res.append( _source(obj) )
+            return [ obj.__code__ ]
+        if inspect.isclass(obj):
+            res.append( _source(obj) )
+            return [ f.__code__ for f in [ getattr(v, '__func__', v) for v in vars(obj).values() ] if inspect.isfunction(f) ]
+        res.append( repr(obj) )
+        return []
+    codes= add(func)
+    while len(codes):
+        co= codes.pop(0)
+        codes+= [ c for c in co.co_consts if inspect.iscode(c) ]
+        for name in co.co_names:
+            for mod in _mods:
+                obj= vars(mod).get(name)
+                if obj is None or inspect.ismodule(obj):
+                    continue
+                if ( inspect.isfunction(obj) or inspect.isclass(obj) ) and obj.__module__!= mod.__name__:
+                    continue
+                if inspect.isfunction(obj) or inspect.isclass(obj) or isinstance(obj, (dict, list, tuple, str, int, float)):
+                    codes+= add(obj)
+            for cls in methods.get(name, []):
+                codes+= add(cls)
+    _closure[func]= res
+    return res
+
+def featVersion(feat: str, salt= '') -> str:
+    '''
+    - description: 特征的代码版本
+    - args-> feat {str}: 特征名
+    - args-> salt {str}: 与特征无关、但影响结果的输入, 见`FET.featVersions`
+    - return {str}: 12位hex
+    '''
+    path, expr= utils.treeIndex(featTree)[feat]
+    parts= [ salt, feat, str(expr) ]
+    if 'ratio' in path:
+        parts+= _sources(featTradition.ratio)+ [ featVersion(f, salt) for f in featTree['ratio'][feat] ]
+    elif any([ 'graph' in node for node in path ]):
+        parts.append( _source(featGraph) )
+    else:
+        for node in path:
+            func= getattr(featTradition, node, None)
+            if func is not None:
+                parts+= _sources(func)
+    return hashlib.sha1( '\n'.join(parts).encode() ).hexdigest()[:12]
+
+
+class ResultStore():
+    '''一个(事件, 采集器, slot)的特征结果'''
+    def __init__(self, root: str, evtNm: str, monitor: str, slot: int) -> None:
+        self.dir= os.path.join(root, f'event={evtNm}', f'collector={monitor}', f'slot={slot}')+ '/'
+        os.makedirs(self.dir, exist_ok= True)
+
+    def stored(self) -> dict:
+        '''- return {dict}: 特征 -> 已保存的版本'''
+        res= {}
+        for p in glob.glob(self.dir+ '*__*.parquet'):
+            feat, ver= os.path.basename(p)[:-len('.parquet')].rsplit('__', 1)
+            res[feat]= ver
+        return res
+
+    def missing(self, vers: dict) -> list:
+        '''- return {list}: `vers`(特征 -> 当前版本)中未保存或版本不符的特征, 顺序同`vers`'''
+        old= self.stored()
+        return [ f for f, v in vers.items() if old.get(f)!= v ]
+
+    def _replace(self, df: pl.DataFrame, name: str):
+        tmp= f'{self.dir}{name}.{os.getpid()}.tmp'
+        df.write_parquet(tmp)
+        os.replace(tmp, self.dir+ name)
+
+    def write(self, df: pl.DataFrame, vers: dict, meta: dict= None):
+        '''
+        - description: 保存df中的特征(替换其旧版本), 以及`date`列与meta
+        - args-> df {pl.DataFrame}: `['time_bin', 'date', 特征...]`, 如各chunk的`FET.chunkHandler`结果
+        - args-> vers {dict}: 特征 -> 版本, 只保存其中的特征
+        '''
+        old= self.stored()
+        for f, v in vers.items():
+            if f not in df.columns:
+                continue
+            self._replace( df.select(['time_bin', f]), f'{f}__{v}.parquet' )
+            if f in old and old[f]!= v:
+                os.remove(f'{self.dir}{f}__{old[f]}.parquet')
+        if 'date' in df.columns:
+            self._replace( df.select(['time_bin', 'date']), '_date.parquet' )
+        if meta is not None:
+            with open(self.dir+ 'meta.json', 'w') as f:
+                json.dump(meta, f)
+
+    def meta(self) -> dict:
+        p= self.dir+ 'meta.json'
+        if not os.path.exists(p):
+            return {}
+        with open(p) as f:
+            return json.load(f)
+
+    def load(self, vers: dict) -> pl.DataFrame:
+        '''
+        - description: 读出`vers`中的特征(须均已保存为该版本), 按time_bin对齐
+        - return {pl.DataFrame}: `['time_bin', 'date', 特征...]`, 特征顺序同`vers`, 按time_bin升序
+        '''
+        dfs= [ pl.read_parquet(self.dir+ '_date.parquet') ]+ [ pl.read_parquet(f'{self.dir}{f}__{v}.parquet') for f, v in vers.items() ]
+        return utils.alignHstack(dfs).select( ['time_bin', 'date']+ list(vers) ).sort('time_bin')
@@ -13,8 +13,11 @@ import multiprocessing
 import polars as pl
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import editdistance
 import time
+from functools import reduce
 
 from fastFET import utils
 from fastFET.MultiProcess import ProcessingQueue
@@ -24,75 +27,165 @@ from fastFET.MultiProcess import ProcessingQueue
 # feat tree node func. #
 ########################  
 
+def addSink(obj, name: str, ldf: pl.LazyFrame, writer):
+    '''- 节点登记的旁路输出(如MOAS行): ldf与本chunk的特征聚合在同一次`pl.collect_all`中计算(见`FeatPlan.run`), 结果交给`writer(df)`'''
+    obj.midnode_res.setdefault('sinks', {})[name]= (ldf, writer)
+
+def popSinks(obj) -> list:
+    '''- 取出并清空本chunk登记的旁路输出。return {list}: `[(ldf, writer), ...]`'''
+    return list(obj.midnode_res.pop('sinks', {}).values())
+
 ### 
+# 体量类叶子节点 -> (分组键, 计数列, 特征列名)。计数列: `n`全部报文, `nA`宣告, `nW`撤销
+vol_sets= {
+    'vol_pfx_total':      (('pfx_id',),                        'n',  'v_pfx_t'),
+    'vol_pfx_A':          (('pfx_id',),                        'nA', 'v_pfx_A'),
+    'vol_pfx_W':          (('pfx_id',),                        'nW', 'v_pfx_W'),
+    'vol_pfx_peer_total': (('peer_AS', 'pfx_id'),              'n',  'v_pp_t'),
+    'vol_pfx_peer_A':     (('peer_AS', 'pfx_id'),              'nA', 'v_pp_A'),
+    'vol_pfx_peer_W':     (('peer_AS', 'pfx_id'),              'nW', 'v_pp_W'),
+    'vol_oriAS_total':    (('origin_AS',),                     'nA', 'v_oriAS_t'),
+    'vol_oriAS_peer':     (('origin_AS', 'peer_AS'),           'nA', 'v_oriAS_peer'),
+    'vol_oriAS_pfx':      (('origin_AS', 'pfx_id'),            'nA', 'v_oriAS_pfx'),
+    'vol_oriAS_peer_pfx': (('peer_AS', 'pfx_id', 'origin_AS'), 'nA', 'v_oriAS_pp'),
+}
+
+def _withPeer(keys) -> tuple:
+    '''- 按peer输出时叶子节点的键组合: 加上`peer_AS`'''
+    return tuple(keys) if 'peer_AS' in keys else ('peer_AS',)+ tuple(keys)
+
+def volGroupingSets(ldf: pl.LazyFrame, nodes: list, peer= False):
+    '''
+    - description: 体量类特征的grouping sets: 先在最细的键组合上对chunk做唯一一次groupby, 得到按msg_type拆分的计数;
+        再由该结果上卷(rollup)到各节点所需的较粗键组合(同一键组合的节点共享一次上卷)。
+    - args-> ldf {pl.LazyFrame}: 预处理结果
+    - args-> nodes {list}: `vol_sets`中的节点名
+    - args-> peer {bool}: 是否同时给出按peer输出所需的键组合(各键组合加上`peer_AS`, 见`featPeer`)
+    - return {dict}: 键组合(tuple) -> pl.DataFrame `['time_bin', *键, 计数列...]`
+    '''
+    sets= {}
+    for node in nodes:
+        keys, cnt, _= vol_sets[node]
+        for ks in [ keys ]+ ( [ _withPeer(keys) ] if peer else [] ):
+            sets.setdefault( frozenset(ks), (ks, set()) )[1].add(cnt)
+    finest= []
+    for keys, _ in sets.values():
+        finest+= [ k for k in keys if k not in finest ]
+    cnts= set().union(*[ c for _, c in sets.values() ])
+    aggs= {
+        'n':  pl.count().alias('n'),
+        'nA': (pl.col('msg_type')== 1).sum().alias('nA'),
+        'nW': (pl.col('msg_type')== 0).sum().alias('nW'),
+    }
+    # 类型转换放在`.agg`之外: polars 0.13在组数较少时, `.agg`内`.sum().cast()`的结果与分组键错位
+    base= (ldf.groupby(['time_bin']+ finest).agg([ aggs[c] for c in ['n', 'nA', 'nW'] if c in cnts ])
+        .with_columns([ pl.col(c).cast(pl.UInt32) for c in ['nA', 'nW'] if c in cnts ]).collect())
+
+    rollup= [ k for k in sets if k!= frozenset(finest) ]
+    dfs= pl.collect_all([ base.lazy().groupby(['time_bin']+ list(sets[k][0])).agg([ pl.col(c).sum() for c in sorted(sets[k][1]) ])
+                            for k in rollup ]) if len(rollup) else []
+    res= dict(zip( [ sets[k][0] for k in rollup ], dfs ))
+    if frozenset(finest) in sets:
+        res[ sets[frozenset(finest)][0] ]= base
+    return res
+
+def volSketch(ldf: pl.LazyFrame, nodes: list, sk, peer= False):
+    '''
+    - description: sketch模式下的体量类特征(见`featSketch`): 只读取一次所需列, 每个节点用HLL/Count-Min估计, 不建(time_bin, 键)分组
+    - args-> nodes {list}: `vol_sets`中的节点名
+    - args-> sk {featSketch.Sketcher}: 
+    - args-> peer {bool}: 是否估计`v_peer`
+    - return {dict}: 节点名(及`'v_peer'`) -> pl.DataFrame `['time_bin', 特征...]`, 每个时间片一行
+    '''
+    cols= ['time_bin', 'msg_type']
+    for node in nodes:
+        cols+= [ k for k in vol_sets[node][0] if k not in cols ]
+    if peer and 'peer_AS' not in cols:
+        cols.append('peer_AS')
+    df= ldf.select(cols).collect()
+    where= { 'n': None, 'nA': pl.col('msg_type')== 1, 'nW': pl.col('msg_type')== 0 }
+    res= {}
+    for node in nodes:
+        keys, cnt, name= vol_sets[node]
+        res[node]= sk.keyed(df, keys, name, where[cnt])
+    if peer:
+        res['v_peer']= sk.count(df, ('peer_AS',), 'v_peer')
+    return res
+
+def _sketcher(obj, cate):
+    '''- 该类别开启sketch模式时的`featSketch.Sketcher`, 否则为None'''
+    return ( getattr(obj, 'sketch', None) or {} ).get(cate)
+
+def _grain(obj) -> list:
+    '''- 叶子节点的分组键: 默认`['time_bin']`; `FeatPlan.run`按peer再次调用叶子节点时为`['time_bin', 'peer_AS']`, 见`featPeer`'''
+    return list( getattr(obj, 'grain', None) or ['time_bin'] )
+
+def _peerCol(obj) -> list:
+    '''- 按peer输出时(`FET(by_peer= True)`), 中间节点须保留的列'''
+    return [ 'peer_AS' ] if getattr(obj, 'by_peer', None) else []
+
+def _volSet(ldf, obj, node):
+    '''- 体量类叶子节点: 从共享的grouping sets结果中取出该节点的计数列(只保留计数>0的组), 再按time_bin(或`_grain`)分组'''
+    keys, cnt, name= vol_sets[node]
+    if obj is not None and 'vol_sketch' in obj.midnode_res:
+        return obj.midnode_res['vol_sketch'][node].lazy().groupby('time_bin')
+    grain= _grain(obj)
+    if 'peer_AS' in grain:
+        keys= _withPeer(keys)
+    sets= obj.midnode_res.get('vol_sets') if obj is not None else None
+    if sets is None or frozenset(keys) not in [ frozenset(k) for k in sets ]:
+        sets= volGroupingSets(ldf, [node], peer= 'peer_AS' in grain)      # 单独调用时(如`FET_vSimple`)就地计算
+    df= { frozenset(k): v for k, v in sets.items() }[ frozenset(keys) ]
+    return (df.lazy()
+        .filter( pl.col(cnt)> 0 )
+        .select([ 'time_bin', *keys, pl.col(cnt).alias(name) ])       # 保留键, 供`featRollup`取出部分聚合
+        .groupby(grain))
+
 def volume(ldf, obj):     
+    '''- 体量类的根节点: 为本chunk需要的全部体量类叶子节点一次性计算grouping sets, 存于`obj.midnode_res['vol_sets']`;
+    sketch模式下改为估计值, 存于`obj.midnode_res['vol_sketch']`'''
+    if obj is not None and 'vol_sets' not in obj.midnode_res and 'vol_sketch' not in obj.midnode_res:
+        nodes= [ path[-1] for path in obj.feats_dict if path[-1] in vol_sets ]
+        sk= _sketcher(obj, 'volume')
+        if sk is not None:
+            obj.midnode_res['vol_sketch']= volSketch(ldf, nodes, sk, peer= 'v_peer' in obj.featNms)
+        elif len(nodes):
+            obj.midnode_res['vol_sets']= volGroupingSets(ldf, nodes, peer= bool(_peerCol(obj)))
     return ldf
 def vol_sim(ldf, obj):     
-    return ldf.groupby("time_bin")
+    sk= obj.midnode_res.get('vol_sketch', {}) if obj is not None else {}
+    if 'v_peer' in sk:
+        ldf= ldf.join(sk['v_peer'].lazy(), on= 'time_bin', how= 'left')    # 估计值按time_bin广播, 特征表达式取`.first()`
+    return ldf.groupby(_grain(obj))
 
 def vol_pfx(ldf, obj):    
     return ldf
 def vol_pfx_total(ldf_vol_pfx, obj):
-    ldf= ldf_vol_pfx.groupby(["time_bin", "dest_pref"]) \
-        .agg([
-            pl.col("msg_type").count().alias("v_pfx_t")
-        ]) \
-        .groupby("time_bin")
-    return ldf
+    return _volSet(ldf_vol_pfx, obj, 'vol_pfx_total')
 def vol_pfx_A(ldf_vol_pfx, obj):
-    ldf= ldf_vol_pfx.groupby(["time_bin", "msg_type", "dest_pref"])\
-        .agg([pl.col("timestamp").count().alias("v_pfx_A")]) \
-        .filter(pl.col("msg_type")== 1).groupby("time_bin")
-    return ldf
+    return _volSet(ldf_vol_pfx, obj, 'vol_pfx_A')
 def vol_pfx_W(ldf_vol_pfx, obj):
-    ldf= ldf_vol_pfx.groupby(["time_bin", "msg_type", "dest_pref"])\
-        .agg([pl.col("timestamp").count().alias("v_pfx_W")]) \
-        .filter(pl.col("msg_type")== 0 ).groupby("time_bin")
-    return ldf
+    return _volSet(ldf_vol_pfx, obj, 'vol_pfx_W')
 def vol_pfx_peer(ldf_vol_pfx, obj):   
     return ldf_vol_pfx
 def vol_pfx_peer_total( ldf_vol_pfx_peer, obj ):
-    ldf= ldf_vol_pfx_peer.groupby(['time_bin','peer_AS','dest_pref']) \
-    .agg([pl.col('index').count().alias("v_pp_t")]) \
-    .groupby('time_bin')
-    return ldf
+    return _volSet(ldf_vol_pfx_peer, obj, 'vol_pfx_peer_total')
 def vol_pfx_peer_A( ldf_vol_pfx_peer, obj ):
-    ldf= ldf_vol_pfx_peer.groupby(["time_bin", "msg_type",'peer_AS', "dest_pref"])\
-        .agg([pl.col("timestamp").count().alias("v_pp_A")]) \
-        .filter(pl.col("msg_type")== 1).groupby("time_bin")
-    return ldf
+    return _volSet(ldf_vol_pfx_peer, obj, 'vol_pfx_peer_A')
 def vol_pfx_peer_W( ldf_vol_pfx_peer, obj ):
-    ldf= ldf_vol_pfx_peer.groupby(["time_bin", "msg_type",'peer_AS', "dest_pref"])\
-        .agg([pl.col("timestamp").count().alias("v_pp_W")]) \
-        .filter(pl.col("msg_type")== 0).groupby("time_bin")
-    return ldf
+    return _volSet(ldf_vol_pfx_peer, obj, 'vol_pfx_peer_W')
 
 def vol_oriAS(ldf, obj):  
-    return ldf.filter(pl.col('msg_type')== 1)
-def vol_oriAS_total( ldf_vol_oriAS, obj ):
-    ldf= ldf_vol_oriAS \
-        .groupby(['time_bin', 'origin_AS']) \
-        .agg(pl.col('msg_type').count().alias("v_oriAS_t")) \
-        .groupby('time_bin')
+    '''- 子节点只使用宣告计数`nA`, 故无需在此过滤出宣告'''
     return ldf
+def vol_oriAS_total( ldf_vol_oriAS, obj ):
+    return _volSet(ldf_vol_oriAS, obj, 'vol_oriAS_total')
 def vol_oriAS_peer( ldf_vol_oriAS, obj ):
-    ldf= ldf_vol_oriAS \
-        .groupby(['time_bin', 'origin_AS', 'peer_AS']) \
-        .agg(pl.col('msg_type').count().alias("v_oriAS_peer")) \
-        .groupby('time_bin')
-    return ldf
+    return _volSet(ldf_vol_oriAS, obj, 'vol_oriAS_peer')
 def vol_oriAS_pfx( ldf_vol_oriAS, obj ): 
-    ''''''
-    ldf= ldf_vol_oriAS \
-        .groupby(['time_bin', 'origin_AS', 'dest_pref']) \
-        .agg(pl.col('msg_type').count().alias("v_oriAS_pfx")) \
-        .groupby('time_bin')
-    return ldf
+    return _volSet(ldf_vol_oriAS, obj, 'vol_oriAS_pfx')
 def vol_oriAS_peer_pfx( ldf_vol_oriAS, obj ):
-    ldf= ldf_vol_oriAS.groupby(['time_bin','peer_AS','dest_pref', 'origin_AS']) \
-            .agg([pl.col('index').count().alias('v_oriAS_pp')]) \
-            .groupby('time_bin')
-    return ldf
+    return _volSet(ldf_vol_oriAS, obj, 'vol_oriAS_peer_pfx')
 
 #### path类
 def get_rareAS_tag(grouped_df, obj):
@@ -126,7 +219,7 @@ def get_rareAS_tag(grouped_df, obj):
 def path(ldf, obj):   
     return ldf
 def path_sim(ldf, obj):
-    return ldf.filter(pl.col('msg_type')== 1).groupby('time_bin')
+    return ldf.filter(pl.col('msg_type')== 1).groupby(_grain(obj))
 
 def path_AStotal(ldf:pl.LazyFrame, obj ): 
     '''得到当前df中所有的AS''' 
@@ -135,6 +228,7 @@ def path_AStotal(ldf:pl.LazyFrame, obj ):
         .select([
             #'index',    
             'time_bin',
+            *_peerCol(obj),
             pl.col('path_unq').alias('AS')
         ])
         .drop_nulls()                    
@@ -143,9 +237,12 @@ def path_AStotal(ldf:pl.LazyFrame, obj ):
     )        
     return ldf_all_AS
 def path_AStotal_count( ldf_path_AStotal, obj ):
-    ldf= ldf_path_AStotal.groupby(['time_bin','AS']) \
+    sk= _sketcher(obj, 'path')
+    if sk is not None:
+        return sk.keyed(ldf_path_AStotal.select(['time_bin', 'AS']).collect(), ('AS',), 'As_total').lazy().groupby('time_bin')
+    ldf= ldf_path_AStotal.groupby(_grain(obj)+ ['AS']) \
         .agg([pl.col('index').count().alias("As_total")
-        ]).groupby('time_bin')
+        ]).groupby(_grain(obj))
     return ldf
 @utils.timer
 def _path_AStotal_rare( ldf_path_AStotal:pl.LazyFrame, obj, space= 8 ):
@@ -217,7 +314,8 @@ def __path_AStotal_rare( ldf_path_AStotal:pl.LazyFrame, obj, space= 8 ):
     return ldf
 @utils.timer
 def path_AStotal_rare( ldf_path_AStotal:pl.LazyFrame, obj, space= 8 ):    
-    '''获取稀有AS'''
+    '''- 获取稀有AS: 每个时间片结束时, 累计次数(跨chunk, 见`obj.as_state`即`utils.RareASState`)不大于5%分位数的AS个数。
+    - 各时间片只累加本片的`(AS, 次数)`, 代价与本片数据量成正比'''
     df_path_AStotal= ( ldf_path_AStotal
         .groupby(['time_bin','AS'])
         .agg([
@@ -228,23 +326,12 @@ def path_AStotal_rare( ldf_path_AStotal:pl.LazyFrame, obj, space= 8 ):
     )   
     upds= ldf_path_AStotal.groupby('time_bin').agg(pl.col('index').unique().count().alias('upds_num')).collect()
 
-    rareAS_num=[]
-    slots= df_path_AStotal['time_bin'].max()+1
-    for i in range( slots ):
-        num= (df_path_AStotal
-            .filter( pl.col('time_bin') <= i) 
-            .groupby('AS').agg([
-                pl.col('counts').sum()
-            ])
-            .select(
-                ((pl.col('counts')- pl.col('counts').quantile(0.05))<= 0).sum()
-            )
-        )[0,0]
-        rareAS_num.append(num)
-    
-    df= (pl.DataFrame({'time_bin': list(range(slots)), 'rare_num': rareAS_num})
+    slots, rareAS_num= obj.as_state.update( df_path_AStotal['time_bin'].to_numpy(),
+                                            df_path_AStotal['AS'].cast(pl.Int64).to_numpy(),
+                                            df_path_AStotal['counts'].cast(pl.Int64).to_numpy() )
+    df= (pl.DataFrame({'time_bin': slots, 'rare_num': rareAS_num})
         .with_columns( [
-            pl.col('time_bin').cast(pl.Int16),
+            pl.col('time_bin').cast(utils.bin_dtype),
             pl.col('rare_num').cast(pl.Int32)
         ])
         .join(upds, on='time_bin')
@@ -256,113 +343,77 @@ def path_AStotal_rare( ldf_path_AStotal:pl.LazyFrame, obj, space= 8 ):
 #### peerPfx类
 @utils.timer
 def peerPfx(ldf: pl.LazyFrame, obj ):
-    ''''''    
-    ldf_cur= ldf.select( pl.exclude([ 'path_unq', 'origin'])) \
-        .with_column( pl.col('peer_AS').cast(pl.Boolean).alias('tag_hist_cur') )
-    obj.df_peer_pfx= obj.df_peer_pfx.select(ldf_cur.columns)
-    df_all= pl.concat([ obj.df_peer_pfx, ldf_cur.collect() ])   
-    
-    obj.df_peer_pfx= ( df_all.lazy()
-        .groupby(['peer_AS', 'dest_pref', 'msg_type'])
-        .tail(1)
-        .with_column((pl.col('tag_hist_cur')*0).cast(pl.Boolean))    
+    '''- 当前chunk与其中出现过的(peer, pfx)的历史(`obj.pp_state`, 见`utils.PeerPfxState`)纵向拼接; 历史行`tag_hist_cur`为False'''    
+    df_cur= (ldf.select( pl.exclude([ 'path_unq', 'origin', 'path_list']))
+        .with_column( pl.lit(True).alias('tag_hist_cur') )
     ).collect()
+    df_all= pl.concat([ obj.pp_state.history(df_cur), df_cur ])
+    obj.pp_state.update(df_cur)
     obj.midnode_res[ peerPfx.__name__ ]= df_all
 
     return df_all.lazy()
-    
+
 def peerPfx_dynamic(ldf_peerPfx: pl.LazyFrame, obj):
-    ''''''
-    feats= obj.feats_dict[ ('peerPfx', 'peerPfx_dynamic') ] 
+    '''- 动态类特征: 按(peer_AS, pfx_id, 行序)排序一次, 相邻行的差分即各键的滞后差分, 键的首行(`first`)处置空; 只保留当前chunk的行。
+    - 行序即`peerPfx`中的拼接顺序(历史行在前), 不能用index排序: 历史行的index来自各自的chunk。
+    - 组内的forward fill: 只取本键(`gid`)内的上一个非空值。
+    - 差分写作`x- x.shift()`: polars 0.13中`.diff()`的结果为多个chunk, 在其后的`groupby().agg`中会panic。
+    '''
+    feats= obj.feats_dict[ ('peerPfx', 'peerPfx_dynamic') ]
+    first= pl.col('first')
+    lag= lambda e: pl.when(first).then(None).otherwise(e- e.shift())
+    lag2= lambda e: pl.when(first| first.shift().fill_null(True)).then(None).otherwise( (e- e.shift())- (e- e.shift()).shift() )
+    def ffill(e):
+        own= pl.when(e.is_null()).then(None).otherwise(pl.col('gid')).fill_null('forward')== pl.col('gid')
+        return pl.when(own).then(e.fill_null('forward')).otherwise(None)
     candidate= {
         ("is_new",):  
-            (pl.col('tag_hist_cur').all().alias('has_new'), ),   
-        ("is_dup_ann","is_imp_wd","is_WnA","is_AWn","is_AnW","is_WAn","is_dup_wd","is_dup","is_imp_wd_spath","is_imp_wd_dpath"):    
-            (pl.col('msg_type'), 'msg_type'),
+            (pl.col('tag_hist_cur')& first).alias('is_new'),     # 无历史的键的首行(历史行排在前)
         ("is_WA","is_AW","is_dup_ann","is_AWnA","is_imp_wd","is_dup_wd","is_dup","is_flap","is_NADA","is_imp_wd_spath","is_imp_wd_dpath"):    
-            (pl.col('msg_type').diff().alias('type_diff'), 'type_diff'),
+            lag(pl.col('msg_type')).alias('type_diff'),
         ("is_WAW","is_AWnA","is_WnA","is_AWn","is_AnW","is_WAn","is_flap","is_NADA"):    
-            (pl.col('msg_type').diff().diff().alias('type_diff2'), 'type_diff2'),
+            lag2(pl.col('msg_type')).alias('type_diff2'),
         ("is_imp_wd_spath","is_imp_wd_dpath"):    
-            (pl.col('path_raw').hash(k0= 42).diff().alias('hash_path_diff'), 'hash_path_diff'),
-            
+            lag(pl.col('path_id').fill_null(0).cast(pl.Int64)).alias('hash_path_diff'),
         ("is_longer_path","is_shorter_path"):    
-            (pl.when(pl.col('path_len')== 0).then(None).otherwise(pl.col('path_len')).fill_null('forward').diff().alias('path_len_diff'), 'path_len_diff'),
+            lag(ffill( pl.when(pl.col('path_len')== 0).then(None).otherwise(pl.col('path_len')) )).alias('path_len_diff'),
         ("is_longer_unq_path","is_shorter_unq_path"):    
-            (pl.when(pl.col('path_unq_len')== 0).then(None).otherwise(pl.col('path_unq_len')).fill_null('forward').diff().alias('path_unq_len_diff'), 'path_unq_len_diff'),
-        #("is_MOAS",):    (pl.col('origin_AS').alias('is_MOAS'), 'is_MOAS'),     
-
+            lag(ffill( pl.when(pl.col('path_unq_len')== 0).then(None).otherwise(pl.col('path_unq_len')) )).alias('path_unq_len_diff'),
         ("is_imp_wd","is_dup","is_flap","is_NADA","is_imp_wd_spath","is_imp_wd_dpath"):    
-            (pl.when(pl.col('msg_type')== 0).then(None).otherwise(pl.col('hash_attr')).fill_null('forward').diff().alias('hash_attr_diff'), 'hash_attr_diff'),
-        }
-    agg_apend, explode_apend = [], []
-    for k, v in candidate.items():
-        if (set(k) & set(feats)):
-            agg_apend.append(v[0])
-            try:     explode_apend.append(v[1])
-            except:  pass     
-    agg_list= [pl.col('index'),
-            pl.col('time_bin'),
-            pl.col('tag_hist_cur').alias('belong_cur'),  
-            ]+ agg_apend
-    explode_list= ['index','time_bin', 'belong_cur']+ explode_apend
-     
-    '''modify_list= []
-    if 'path_len_diff' in explode_list: modify_list.append( pl.col('path_len_diff').cast(pl.Int8) )
-    if 'path_unq_len_diff' in explode_list: modify_list.append( pl.col('path_unq_len_diff').cast(pl.Int8) )'''
-         
-    #if 'is_MOAS' in explode_list: modify_list.append( pl.col('is_MOAS').diff().cast(pl.Boolean).cast(pl.Int8) )
+            lag(ffill( pl.when(pl.col('msg_type')== 0).then(None).otherwise(pl.col('hash_attr')) )).alias('hash_attr_diff'),
+    }
+    sel_apend= [ v for k, v in candidate.items() if set(k)& set(feats) ]
+    flags= []
+    if len(set(['is_dup_ann', 'is_dup', 'is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath'])& set(feats)):
+        flags.append( ((pl.col('msg_type')== 1)& (pl.col('type_diff')== 0)).alias('is_dup_ann') )
+    if len(set(['is_AWnA', 'is_flap', 'is_NADA'])& set(feats)):
+        flags.append( ((pl.col('type_diff')== 1)& (pl.col('type_diff2')>= 1)).alias('is_AWnA') )
     
-    ldf_13= (ldf_peerPfx.groupby(['peer_AS','dest_pref']) 
-        .agg(agg_list)
-        .explode(explode_list)   
-        .filter( pl.col('belong_cur')== True )   
-        #.with_columns(modify_list)  
+    ldf_res= (ldf_peerPfx
+        .with_row_count('row')
+        .sort(['peer_AS', 'pfx_id', 'row'])
+        .with_column( ((pl.col('peer_AS')!= pl.col('peer_AS').shift())| (pl.col('pfx_id')!= pl.col('pfx_id').shift())).fill_null(True).alias('first') )
+        .with_column( first.cumsum().alias('gid') )
+        .select( ['index']+ _grain(obj)+ ['tag_hist_cur', 'msg_type']+ sel_apend )
+        .filter( pl.col('tag_hist_cur') )
+        .with_columns( flags )
     )
+    if len(set(['is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath'])& set(feats)): 
+        ldf_res= ldf_res.with_column( ((pl.col('is_dup_ann')== 1)& (pl.col('hash_attr_diff')!= 0)).alias('is_imp_wd') )
 
-    candidate2= {
-        ('is_new',):
-            [(pl.col('has_new')- (pl.col('has_new').shift_and_fill(1, 0)) ).alias('is_new'), 'is_new'], 
-        ('is_dup_ann', 'is_dup', 'is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath'):
-           [ ( (pl.col('msg_type')== 1) & (pl.col('type_diff')== 0)).alias('is_dup_ann'), 'is_dup_ann'],
-        ('is_AWnA', 'is_flap', 'is_NADA'):
-            [((pl.col('type_diff')== 1) & (pl.col('type_diff2')>=1)).alias('is_AWnA'), 'is_AWnA'],
-    }
-    agg2_apend, explode2_apend= [], []
-
-    for k,v in candidate2.items():
-        if (set(k) & set(feats)): 
-            agg2_apend.append(v[0])
-            explode2_apend.append(v[1])
-    ldf_3= (ldf_13.groupby(['peer_AS','dest_pref'])
-            .agg([pl.col('index')]+ agg2_apend)
-            .explode(['index']+ explode2_apend)
-            )
-    
-    modify_list3= []
-    if 'is_new' in feats: 
-        modify_list3.append( pl.col('is_new').cast(pl.Boolean) )
-    if len(set(['is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath']) & set(feats)): 
-        modify_list3.append( ((pl.col('is_dup_ann')== 1) & (pl.col('hash_attr_diff')!= 0)).alias('is_imp_wd') )
-    ldf_res17= ( ldf_13.join( 
-                    ldf_3.select(['index']+ explode2_apend),     
-                    on='index')
-                .with_columns( modify_list3 )
-                )
-    
-    return ldf_res17.groupby('time_bin')
+    return ldf_res.groupby(_grain(obj))
 
 def peerPfx_relateHijack( ldf_peerPfx: pl.LazyFrame, obj ):
     '''- args: ldf_peerPfx：列12，行结合了历史peer-pfx表。
-    - return: 一个新的ldf(最多5+4+4=13列)[ index, time_bin, 'tag_hist_cur', peer, dest_pref]+ ['path_loc0(i.e. is_MOAS)', 'path_loc1/2/3' ] + [type_0,1,2,3]
+    - return: 一个新的ldf(最多5+4+4=13列)[ index, time_bin, 'tag_hist_cur', peer, pfx_id]+ ['path_loc0(i.e. is_MOAS)', 'path_loc1/2/3' ] + [type_0,1,2,3]
     - 如何使用：path_loc0123即ARTEMIS模型中的劫持类型Type0,1,2,3。注意，在判断loc1的两AS是否相同时，前提是loc0的AS必须相同。以此类推。
     '''
     feats= obj.feats_dict[ ('peerPfx', 'peerPfx_relateHijack') ]     
      
     sel_apend= [pl.col('origin_AS').alias('path_loc0'),  
-                pl.col('path_raw').str.extract(' (\d+) \d+$', 1).cast(pl.UInt32).alias('path_loc1'),
-                pl.col('path_raw').str.extract(' (\d+) \d+ \d+$', 1).cast(pl.UInt32).alias('path_loc2'),
-                pl.col('path_raw').str.extract(' (\d+) \d+ \d+ \d+$', 1).cast(pl.UInt32).alias('path_loc3')
+                pl.col('path_loc1'),
+                pl.col('path_loc2'),
+                pl.col('path_loc3')
     ]
     if 'type_3' not in feats: 
         sel_apend= sel_apend[:3]    
@@ -372,13 +423,21 @@ def peerPfx_relateHijack( ldf_peerPfx: pl.LazyFrame, obj ):
                 sel_apend= sel_apend[:1]
                 if 'type_0' not in feats:
                     sel_apend=[]
-    ldf_locAS= ldf_peerPfx.select( [ pl.col('index'), 'time_bin', 'peer_AS', 'dest_pref', 'path_raw', 'tag_hist_cur']+ sel_apend )
+    # loc1/2/3直接取path字典中已解析的`path_list`, 再按path_id连接
+    ldf_loc_map= obj.path_enc.table.lazy().select([
+                pl.col('id').alias('path_id'),
+                pl.col('path_list').arr.get(-2).alias('path_loc1'),
+                pl.col('path_list').arr.get(-3).alias('path_loc2'),
+                pl.col('path_list').arr.get(-4).alias('path_loc3')
+    ])
+    ldf_locAS= (ldf_peerPfx.join( ldf_loc_map, on= 'path_id', how= 'left')
+        .select( [ pl.col('index'), 'time_bin', 'peer_AS', 'pfx_id', 'path_id', 'tag_hist_cur']+ sel_apend ))
      
     agg_apend= []
     locNms= [nm for nm in ldf_locAS.columns if 'path_loc' in nm ]
     for colNm in locNms:
         agg_apend.append( pl.col(colNm ).diff().cast(pl.Boolean) )     ###### main
-    ldf_locAS= ldf_locAS.groupby(['peer_AS', 'dest_pref']) \
+    ldf_locAS= ldf_locAS.groupby(['peer_AS', 'pfx_id']) \
         .agg( [ 'index', 'time_bin', 'tag_hist_cur' ]+ agg_apend ) \
         .explode( [ 'index', 'time_bin', 'tag_hist_cur' ]+ locNms ) \
         .filter( pl.col('tag_hist_cur')== True )     
@@ -396,17 +455,25 @@ def peerPfx_relateHijack( ldf_peerPfx: pl.LazyFrame, obj ):
         except:
             pass 
 
-    if 'path_loc0' in locNms:            
-        indexs= (ldf_locAS.filter(pl.col('path_loc0')== True)
-            .select(pl.col('index')).collect()
-            .to_series()
-            .to_list())
-         
-        content= ldf_peerPfx.collect()[indexs].to_csv(has_header= False)
-        with open(obj.path_df_MOAS, 'a') as f:
-            f.write(content)
+    # MOAS/type-N候选行: 按index与触发的类型标志连接回当前chunk的行, 在同一查询计划中计算, 写入分区Parquet(`obj.moas_sink`)
+    flags= {}
+    if 'path_loc0' in locNms:
+        flags['type_0']= pl.col('path_loc0')
+    for i in range(1, 4):
+        if 'type_'+ str(i) in feats:
+            flags['type_'+ str(i)]= pl.col('type_'+ str(i)).cast(pl.Boolean)
+    if len(flags) and getattr(obj, 'moas_sink', None) is not None:
+        ldf_cand= (ldf_locAS.select([ 'index' ]+ [ expr.fill_null(False).alias(nm) for nm, expr in flags.items() ])
+            .filter( reduce(lambda a, b: a| b, [ pl.col(nm) for nm in flags ]) ))
+        ldf_moas= (ldf_peerPfx.filter( pl.col('tag_hist_cur') )
+            .join( ldf_cand, on= 'index', how= 'inner')
+            .with_column( utils.tsFormat(pl.col('timestamp'), '%Y%m%d').alias('day') ))
+        # 编号解码回prefix与path字符串
+        ldf_moas= (obj.path_enc.decode( obj.pfx_enc.decode( ldf_moas, 'pfx_id', 'dest_pref'), 'path_id', 'path_raw')
+            .select( pl.exclude(['pfx_id', 'path_id', 'tag_hist_cur']) ))
+        addSink(obj, 'MOAS', ldf_moas, obj.moas_sink.write)
         
-    return ldf_locAS.groupby('time_bin')     
+    return ldf_locAS.groupby(_grain(obj))     
 
 def _cal_edit_distance(res_lis, lis:list):
     ''' subfunction of multithread in `peerPfx_editdist`, in `lis[(idx, time_bin, p1, p2), (), ...]` the p1 and p2 are type of `list`. 
@@ -440,29 +507,162 @@ def cal_edit_dist( tup ):
         r= None
     return r
 
+def _pad_lists(s: pl.Series):
+    '''- 把`List[UInt32]`列展开为定长矩阵(按行内最长补0)。return {(np.ndarray, np.ndarray)}: `(矩阵, 各行长度)`, null与空列表长度为0
+    - 经arrow的`flatten`展开: join得到的列表列带有偏移, polars 0.13的`explode`会错位'''
+    arr= s.to_arrow()
+    if isinstance(arr, pa.ChunkedArray):
+        arr= arr.combine_chunks()
+    lens= pc.list_value_length(arr).fill_null(0).to_numpy().astype(np.int64)
+    flat= arr.flatten().fill_null(0).to_numpy()
+    mat= np.zeros((len(lens), max(lens.max(initial= 0), 1)), dtype= np.uint32)
+    row= np.repeat(np.arange(len(lens)), lens)
+    mat[row, np.arange(len(row))- np.repeat(np.cumsum(lens)- lens, lens)]= flat
+    return mat, lens
+
+def _levenshtein(a, la, b, lb):
+    '''- 向量化的编辑距离: 对N对序列同时做DP, 每次迭代处理一整行; 行内的插入操作用`累计最小值`求出, 故只有`len(a)`次numpy运算。
+    - args-> a, b {np.ndarray}: `(N, L)`的补齐矩阵; la, lb: 实际长度
+    - return {np.ndarray}: N个距离'''
+    a, b= np.ascontiguousarray(a.T), np.ascontiguousarray(b.T)      # (L, N): 每一步的运算都在连续内存上
+    Lb, N= b.shape
+    ar= np.arange(Lb+ 1, dtype= np.int16)[:, None]
+    prev= np.repeat(ar, N, axis= 1)
+    cur= np.empty_like(prev)
+    res= lb.copy()      # la为0时距离即lb
+    for i in range(1, a.shape[0]+ 1):
+        cur[0]= i
+        np.minimum(prev[:-1]+ (a[i-1]!= b), prev[1:]+ 1, out= cur[1:])     # 替换/删除
+        cur-= ar
+        np.minimum.accumulate(cur, axis= 0, out= cur)                       # 插入
+        cur+= ar
+        hit= np.where(la== i)[0]
+        res[hit]= cur[lb[hit], hit]
+        prev, cur= cur, prev
+    return res
+
+def cal_edit_dist_batch(s1: pl.Series, s2: pl.Series, batch= 1<< 17):
+    '''- `cal_edit_dist`的批量版本, 无逐行的Python调用。按长度排序后分批, 以减少补齐。
+    - args-> s1, s2 {pl.Series}: 等长的`List[UInt32]`列
+    - return {pl.Series}: `ED`(Int64), s2为null或空列表时为null'''
+    a, la= _pad_lists(s1)
+    b, lb= _pad_lists(s2)
+    res= np.zeros(len(la), dtype= np.int64)
+    order= np.argsort(np.maximum(la, lb), kind= 'stable')
+    for k in range(0, len(order), batch):
+        idx= order[k: k+ batch]
+        ma, mb= max(la[idx].max(), 1), max(lb[idx].max(), 1)
+        res[idx]= _levenshtein(a[idx, :ma], la[idx], b[idx, :mb], lb[idx])
+    return (pl.DataFrame({'ED': res, 'valid': lb> 0})
+        .select( pl.when(pl.col('valid')).then(pl.col('ED')).otherwise(None).alias('ED') )
+        .to_series())
+
+def _ed_batches(args):
+    '''- 进程池的任务: 对一批已补齐的序列对计算编辑距离(只用numpy)'''
+    return _levenshtein(*args)
+
+def edPool(processes= None):
+    '''- `EditDistEngine`的进程池。`FET(ed_processes> 1)`时由`FET.run`创建, 在整个运行中共用一个, 结束时关闭; 默认不使用。
+    - 用spawn: 父进程中polars的线程池已在运行, fork出的子进程可能死锁; 而任务数组本就经pickle传给子进程, fork并无好处。
+      spawn的子进程会重新导入主模块, 调用`FET.run`的脚本须置于`if __name__=='__main__':`之下。
+    - args-> processes {int}: 进程数, 默认`min(cpu数, 4)`'''
+    return multiprocessing.get_context('spawn').Pool( processes or min(multiprocessing.cpu_count(), 4) )
+
+class EditDistEngine():
+    '''- `peerPfx_editdist`的编辑距离引擎, 在path字典的编号上工作:
+        - 一个chunk内先对`(前一条path_id, 当前path_id)`去重, 只为不同的编号对计算一次(振荡时同一对反复出现);
+        - 结果存于跨chunk的有界缓存(按最近一次使用的chunk淘汰, 即chunk粒度的LRU), 命中的编号对不再计算;
+        - 未命中的编号对按长度排序分批(`_levenshtein`), 批数较多时分发到进程池。'''
+    def __init__(self, cache_size= 1<< 20, pool= None, batch= 1<< 15) -> None:
+        '''
+        - args-> cache_size {int}: 缓存的编号对上限
+        - args-> pool {multiprocessing.pool.Pool}: 进程池(`edPool`), 由调用方创建与关闭; 为None时在本进程中计算
+        - args-> batch {int}: 每批的编号对数
+        '''
+        self.cache= pl.DataFrame(columns= [('pair', pl.Int64), ('ED', pl.Int64), ('used', pl.UInt32)])
+        self.cache_size= cache_size
+        self.pool= pool
+        self.batch= batch
+        self.tick= 0
+        self.hits, self.misses= 0, 0
+
+    def __len__(self):
+        return self.cache.height
+
+    @staticmethod
+    def pair(prev: str, cur: str) -> pl.Expr:
+        '''- 编号对的整数键`prev<<32 | cur`; prev为null时为null(无前一条path, ED为null)'''
+        return (pl.col(prev).cast(pl.Int64)* (1<< 32)+ pl.col(cur).fill_null(0).cast(pl.Int64)).alias('pair')
+
+    def compute(self, pairs: np.ndarray, path_enc) -> pl.Series:
+        '''
+        - description: 计算编号对的编辑距离, 不经缓存
+        - args-> pairs {np.ndarray}: Int64的编号对键
+        - args-> path_enc {utils.IdEncoder}: 带`path_list`的path字典(编号k位于第k-1行)
+        - return {pl.Series}: `ED`(Int64), 前一条path为空时为null
+        '''
+        paths= path_enc.table['path_list'].to_arrow()
+        def lists(ids):
+            return pl.from_arrow( paths.take( pa.array(ids- 1, mask= ids== 0) ) )
+        a, la= _pad_lists(lists(pairs& 0xFFFFFFFF))
+        b, lb= _pad_lists(lists(pairs>> 32))
+        order= np.argsort(np.maximum(la, lb), kind= 'stable')
+        tasks= []
+        for k in range(0, len(order), self.batch):
+            idx= order[k: k+ self.batch]
+            ma, mb= max(la[idx].max(), 1), max(lb[idx].max(), 1)
+            tasks.append( (a[idx, :ma], la[idx], b[idx, :mb], lb[idx]) )
+        if self.pool is not None and len(tasks)> 1:
+            outs= self.pool.map(_ed_batches, tasks)
+        else:
+            outs= [ _ed_batches(t) for t in tasks ]
+        res= np.zeros(len(order), dtype= np.int64)
+        for k, out in zip(range(0, len(order), self.batch), outs):
+            res[order[k: k+ self.batch]]= out
+        return (pl.DataFrame({'ED': res, 'valid': lb> 0})
+            .select( pl.when(pl.col('valid')).then(pl.col('ED')).otherwise(None).alias('ED') )
+            .to_series())
+
+    def lookup(self, pairs: pl.Series, path_enc) -> pl.DataFrame:
+        '''
+        - description: 去重后的编号对先查缓存, 未命中的计算后写回缓存(超出上限时淘汰最久未用的)
+        - return {pl.DataFrame}: `['pair', 'ED']`, 每个非null编号对一行
+        '''
+        self.tick+= 1
+        uniq= pl.DataFrame({'pair': pairs}).drop_nulls().unique()
+        hit= uniq.join( self.cache.select(['pair', 'ED']), on= 'pair', how= 'inner')
+        miss= uniq.join( self.cache.select('pair'), on= 'pair', how= 'anti')
+        self.hits+= hit.height
+        self.misses+= miss.height
+        miss= miss.with_column( self.compute(miss['pair'].to_numpy(), path_enc) if miss.height else pl.lit(None).cast(pl.Int64).alias('ED') )
+        res= pl.concat([ hit, miss ])
+
+        used= res.with_column( pl.lit(self.tick).cast(pl.UInt32).alias('used') )
+        cache= pl.concat([ self.cache.join( used.select('pair'), on= 'pair', how= 'anti'), used ])
+        if cache.height> self.cache_size:
+            cache= cache.sort('used', reverse= True).head(self.cache_size)
+        self.cache= cache
+        return res
+
 @utils.timer
 def peerPfx_editdist(ldf_peerPfx: pl.LazyFrame, obj):
-    ''''''
-    pre_df_ed= ( ldf_peerPfx.groupby(['peer_AS','dest_pref'])
+    '''- 每条当前宣告与同(peer, pfx)上一条path的编辑距离; 距离由`obj.ed_engine`(`EditDistEngine`)按去重后的编号对求得'''
+    df_ed= ( ldf_peerPfx.groupby(['peer_AS','pfx_id'])
         .agg([
             'index', 'time_bin', 'msg_type', 'tag_hist_cur', 
-            pl.col('path_raw').str.split(' ').suffix('_list'),   
-            pl.col('path_raw').fill_null('forward').shift(1).str.split(' ').suffix('_shift')     
+            pl.col('path_id'),   
+            pl.col('path_id').fill_null('forward').shift(1).alias('path_id_shift')     
         ])
-        .explode(['index', 'time_bin', 'msg_type', 'tag_hist_cur', 'path_raw_list', 'path_raw_shift' ])  
+        .explode(['index', 'time_bin', 'msg_type', 'tag_hist_cur', 'path_id', 'path_id_shift' ])  
         .filter( (pl.col('tag_hist_cur')== True) & (pl.col('msg_type')== 1 ) )   
-        .select( pl.exclude(['peer_AS','dest_pref','msg_type', 'tag_hist_cur']))     
-        #.sort('index')
+        .select([ 'index', 'time_bin', *_peerCol(obj), EditDistEngine.pair('path_id_shift', 'path_id') ])
     ).collect()
-    
-    #tasks= pre_df_ed.rows()      
-    col_ED= pre_df_ed.apply(cal_edit_dist)
-    pre_df_ed['ED']= col_ED['apply']
-    pre_df_ed= pre_df_ed.select([
-        pl.col('index'),
-        pl.col('time_bin'), 
-        pl.col('ED')])       
 
+    engine= getattr(obj, 'ed_engine', None) or EditDistEngine()
+    pre_df_ed= (df_ed
+        .join( engine.lookup(df_ed['pair'], obj.path_enc), on= 'pair', how= 'left')
+        .select(['index', 'time_bin', *_peerCol(obj), 'ED'])
+    )
     obj.midnode_res[ peerPfx_editdist.__name__ ]= pre_df_ed
 
     return pre_df_ed.lazy()
@@ -472,28 +672,21 @@ def peerPfx_editdist_sim( df_peerPfx_editdist, obj ):
         ldf_res= df_peerPfx_editdist.lazy() 
     else:
         ldf_res= df_peerPfx_editdist
-    return ldf_res.with_column( pl.col('time_bin').cast(pl.Int16)).groupby('time_bin')
+    return ldf_res.with_column( pl.col('time_bin').cast(utils.bin_dtype)).groupby(_grain(obj))
     
-def peerPfx_editdist_num( df_peerPfx_editdist: pl.DataFrame, obj ):
-    
-    if isinstance( df_peerPfx_editdist, pl.LazyFrame ):
-        df_peerPfx_editdist= df_peerPfx_editdist.collect()
-
+def peerPfx_editdist_num( df_peerPfx_editdist, obj ):
+    '''- ED=0..10的直方图: 按`(time_bin, ED)`计数后直接展开为`ED_0..ED_10`列'''
+    if not isinstance( df_peerPfx_editdist, pl.LazyFrame ): 
+        df_peerPfx_editdist= df_peerPfx_editdist.lazy() 
+    grain= _grain(obj)
     res= (df_peerPfx_editdist
-        .with_column(pl.col('time_bin').cast(pl.Int64))
-        .pivot(values= 'index', index= 'time_bin', columns= 'ED', aggregate_fn= 'count')
-        #.select( [pl.col('time_bin')]+[str(i) for i in range(11)] )     
-        .fill_null("zero")       
+        .groupby(grain+ ['ED'])
+        .agg( pl.count().alias('n') )
+        .groupby(grain)
+        .agg([ pl.when(pl.col('ED')== i).then(pl.col('n')).otherwise(0).sum().alias('ED_'+ str(i)) for i in range(11) ])
+        .with_columns([ pl.col('time_bin').cast(utils.bin_dtype) ]+ [ pl.col('ED_'+ str(i)).cast(pl.UInt32) for i in range(11) ])
     )
-    
-    target_res= res.select('time_bin')
-    for i in range(11):
-        if str(i) not in res.columns:
-            target_res= target_res.with_column( pl.Series('ED_'+ str(i), [0]* res.height))
-        else:
-            target_res= target_res.with_column( res[str(i)].rename('ED_'+ str(i)))
-    res= target_res.lazy().with_column(pl.col('time_bin').cast(pl.Int16)).groupby('time_bin')
-    return res
+    return res.groupby(grain)
 
 @utils.timer
 def ratio( ratio_feats:list, featTree:dict, df_res_tradi:pl.DataFrame):
@@ -156,7 +156,8 @@ featTree= {
 
 
 
-def getAllFeats( ):
+def getAllFeats( tree= None ):
+    '''- tree: featTree的子树, 默认为整棵树'''
     all= []
     def recur( key, dic ):
         if isinstance(dic, dict):
@@ -164,9 +165,40 @@ def getAllFeats( ):
                 recur( k, v )
         else:
             all.append( key )
-    recur('', featTree )
+    recur('', featTree if tree is None else tree )
     return all
 
+# 预处理阶段的派生列 -> 依赖它的特征
+derivedDepend= {
+    'origin':   ['v_IGP', 'v_EGP', 'v_ICMP'],
+    'hash_attr':['is_imp_wd', 'is_dup', 'is_flap', 'is_NADA', 'is_imp_wd_spath', 'is_imp_wd_dpath'],
+    'path_len': ['path_len_max', 'path_len_avg', 'is_longer_path', 'is_shorter_path'],
+    'path_unq': ['path_unq_len_max', 'path_unq_len_avg', 'is_longer_unq_path', 'is_shorter_unq_path']+ getAllFeats(featTree['path']['path_AStotal']),
+    'origin_AS':getAllFeats(featTree['volume']['vol_oriAS'])+ getAllFeats(featTree['peerPfx']['peerPfx_relateHijack']),
+    'path_id':  ['is_imp_wd_spath', 'is_imp_wd_dpath']+ getAllFeats(featTree['peerPfx']['peerPfx_relateHijack'])+ getAllFeats(featTree['peerPfx']['peerPfx_editdist']),
+}
+# 派生列 -> 所需的原始列(`utils.raw_fields`); 未列出的派生列只依赖path
+derivedRaw= {
+    'origin':   ['origin'],
+    'hash_attr':utils.raw_fields[2:],
+}
+
+def getRequiredCols( feats, graph= False ):
+    '''
+    - description: 把目标特征集合编译为预处理所需的最小列集合
+    - args-> feats {list}: 目标特征, 如`FET.featNms`
+    - args-> graph {bool}: 是否有图特征(需要`path_list`)
+    - return {(list, set)}: `(原始列, 派生列)`。原始列保持`raw_fields`中的顺序; 派生列为`derivedDepend`的键及`path_list`
+    '''
+    feats= set(feats)
+    need= set([ col for col, fs in derivedDepend.items() if feats & set(fs) ])
+    if graph or need & {'path_len', 'path_unq', 'origin_AS', 'path_id'}:
+        need.add('path_list')
+    raw= set(['timestamp', 'msg_type', 'peer_AS', 'dest_pref', 'path'])
+    for col in need:
+        raw|= set(derivedRaw.get(col, []))
+    return [ f for f in utils.raw_fields if f in raw ], need
+
 def getDepend( feats ):
     ''''''
     adds= []
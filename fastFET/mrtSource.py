@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: MRT原始数据的数据源层。把`(collector, type, timestamp)`解析为一个可获取的位置(url或本地路径)。
+    - `HttpSource`  : RIPE RIS 与 RouteViews 官网(默认)
+    - `MirrorSource`: 按上游目录结构rsync到本地磁盘的镜像, 用于离线/无外网的批处理集群; HTTP回退可选
+- 下载端只依赖4个接口: `locate`, `exists`, `fetchCmd`, `fetchRange`; 前缀/缓存逻辑(`raw_cmpres/`)对两种数据源一致。
+'''
+import os, re, glob
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import requests
+
+from fastFET import utils
+from fastFET.MultiProcess import TaskScheduler
+
+RIS_URL= 'https://data.ris.ripe.net/'
+RV_URL = 'http://archive.routeviews.org/'
+
+
+def upstream_url(type:str, monitor:str, tarTime):
+    '''
+    - description: 获取MRT文件在上游项目中的下载链接
+    - args-> type {str}: any of `updates, rib, rib., ribs, bview, bview.`
+    - args-> monitor {str}:
+    - args-> tarTime {str| datetime}: like `20210412.0800`
+    - return {str}
+    '''
+    if isinstance(tarTime, datetime):
+        tarTime= tarTime.strftime('%Y%m%d.%H%M')
+    month= f'{tarTime[:4]}.{tarTime[4:6]}'
+    type= type if type== 'updates' else 'ribs'
+    rv_root= f"{RV_URL}bgpdata" if monitor== 'route-views2' else f"{RV_URL}{monitor}/bgpdata"
+    dic= {
+        'rrc':{
+            'updates': f"{RIS_URL}{monitor}/{month}/updates.{tarTime}.gz",
+            'ribs'   : f"{RIS_URL}{monitor}/{month}/bview.{tarTime}.gz"
+        },
+        'rou':{
+            'updates': f"{rv_root}/{month}/UPDATES/updates.{tarTime}.bz2",
+            'ribs'   : f"{rv_root}/{month}/RIBS/rib.{tarTime}.bz2"
+        }
+    }
+    return dic[ monitor[:3]][type]
+
+def _month_list(satTime: datetime, endTime: datetime):
+    '''- 起止时间覆盖的月份列表，如：['2021.04', '2021.05',...]'''
+    res= []
+    cur= datetime(satTime.year, satTime.month, 1)
+    while cur<= endTime:
+        res.append(cur.strftime('%Y.%m'))
+        cur= (cur+ timedelta(days= 32)).replace(day= 1)
+    return res
+
+
+class HttpSource(object):
+    '''上游官网数据源。'''
+    offline= False
+
+    def locate(self, type, monitor, tarTime):
+        return upstream_url(type, monitor, tarTime)
+
+    def exists(self, loc):
+        return requests.head(loc).status_code== 200
+
+    def host(self, loc):
+        return urlparse(loc).netloc
+
+    def fetchCmd(self, loc, dest):
+        return f"wget -q -O {dest} {loc}"
+
+    def fetchRange(self, type, monitor, satTime: datetime, endTime: datetime, dest_lib):
+        '''- 下载`satTime`所在日至`endTime`所在日的全部`type`文件到`dest_lib/monitor/monitor_*`
+        - args-> type {str}: `'updates'` or `'ribs'`'''
+        from fastFET.BGPMAGNET.dataGetter import downloadByParams
+        from fastFET.BGPMAGNET.base import base_params, bgpGetter
+        from fastFET.BGPMAGNET.params import BGP_DATATYPE
+        bgpdbp=downloadByParams(
+            urlgetter=bgpGetter(base_params(
+                start_time= satTime.strftime('%Y-%m-%d')+ "-00:00",
+                end_time  = endTime.strftime('%Y-%m-%d')+ "-23:59",
+                bgpcollectors=[monitor],
+                data_type=BGP_DATATYPE[type.upper()]
+            )),
+            destination= dest_lib,
+            save_by_collector=1
+        )
+        bgpdbp.start_on()
+
+
+class MirrorSource(HttpSource):
+    '''本地镜像数据源: 目录结构与上游一致, 即
+        - `{ris_root}/rrc00/2021.10/updates.20211004.1200.gz`
+        - `{rv_root}/route-views.sg/bgpdata/2021.10/UPDATES/updates.20211004.1200.bz2`
+    镜像中缺失的文件, 仅在`http_fallback=True`时回退到官网下载, 否则视为不存在。
+    '''
+    offline= True
+
+    def __init__(self, ris_root= None, rv_root= None, http_fallback= False):
+        '''
+        - args-> ris_root {str}: RIPE RIS 镜像根目录(对应`https://data.ris.ripe.net/`)
+        - args-> rv_root {str}: RouteViews 镜像根目录(对应`http://archive.routeviews.org/`)
+        - args-> http_fallback {bool}: 镜像缺文件时是否回退到HTTP
+        '''
+        self.roots= {RIS_URL: ris_root, RV_URL: rv_root}
+        self.http_fallback= http_fallback
+
+    def _to_local(self, url):
+        for prefix, root in self.roots.items():
+            if url.startswith(prefix) and root:
+                return os.path.join(root, url[len(prefix):])
+        return None
+
+    def locate(self, type, monitor, tarTime):
+        '''- return {str}: 本地路径; 镜像缺失(或未配置该项目的镜像)时返回url'''
+        url= upstream_url(type, monitor, tarTime)
+        local= self._to_local(url)
+        if local and os.path.exists(local):
+            return local
+        return url if (self.http_fallback or local is None) else local
+
+    def exists(self, loc):
+        if not loc.startswith('http'):
+            return os.path.exists(loc)
+        return self.http_fallback and super().exists(loc)
+
+    def host(self, loc):
+        return 'localhost' if not loc.startswith('http') else super().host(loc)
+
+    def fetchCmd(self, loc, dest):
+        if not loc.startswith('http'):
+            return f"ln -sf {os.path.abspath(loc)} {dest}"
+        return super().fetchCmd(loc, dest)
+
+    def listFiles(self, type, monitor, satTime: datetime, endTime: datetime):
+        '''- 列出镜像中`satTime`~`endTime`(按日取整)内的`type`文件; 允许回退时, 缺失的时刻以url补齐。
+        - return {list}: 本地路径或url'''
+        sat= datetime(satTime.year, satTime.month, satTime.day)
+        end= datetime(endTime.year, endTime.month, endTime.day, 23, 59)
+        sample= upstream_url(type, monitor, sat)
+        local_dir= os.path.dirname(self._to_local(sample) or '')
+        fname= os.path.basename(sample).split('.')[0]     # `updates`, `bview` or `rib`
+
+        res= {}
+        for month in _month_list(sat, end):
+            cur_dir= local_dir.replace(sat.strftime('%Y.%m'), month)
+            for f in glob.glob(f'{cur_dir}/{fname}.*'):
+                mmnt= re.search(r'\d{8}.\d{4}', os.path.basename(f)).group()
+                if sat<= datetime.strptime(mmnt, '%Y%m%d.%H%M')<= end:
+                    res[mmnt]= f
+
+        if self.http_fallback:
+            interval= utils.intervalMin(type if type== 'updates' else 'ribs', monitor)
+            cur= sat
+            while cur<= end:
+                mmnt= cur.strftime('%Y%m%d.%H%M')
+                if mmnt not in res:
+                    res[mmnt]= upstream_url(type, monitor, mmnt)
+                cur+= timedelta(minutes= interval)
+        return [res[k] for k in sorted(res)]
+
+    def fetchRange(self, type, monitor, satTime: datetime, endTime: datetime, dest_lib):
+        '''- 把镜像文件软链接到`dest_lib/monitor/monitor_*`(直接`os.symlink`, 磁盘速度, 无网络请求); 回退的url用wget下载。'''
+        dest_dir= utils.makePath(f'{dest_lib}{monitor}/')
+        sched= None
+        for loc in self.listFiles(type, monitor, satTime, endTime):
+            dest= f"{dest_dir}{monitor}_{os.path.basename(loc)}"
+            if os.path.exists(dest):
+                continue
+            if not loc.startswith('http'):
+                if os.path.lexists(dest):     # 指向已不存在文件的旧链接
+                    os.remove(dest)
+                os.symlink(os.path.abspath(loc), dest)
+                continue
+            sched= sched or TaskScheduler()
+            sched.addTask(self.fetchCmd(loc, dest), 'download', host= self.host(loc))
+        if sched is not None:
+            sched.run(utils.logger)
+
+
+def getSource(mirror= None):
+    '''- args-> mirror {None | dict | HttpSource}: None时为官网; dict时作为`MirrorSource`的参数, 如
+        `{'ris_root': '/data/ris', 'rv_root': '/data/routeviews', 'http_fallback': False}`'''
+    if mirror is None:
+        return HttpSource()
+    if isinstance(mirror, HttpSource):
+        return mirror
+    return MirrorSource(**mirror)
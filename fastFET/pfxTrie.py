@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+# coding=utf-8
+'''
+- Description: IPv4/IPv6前缀的二叉前缀树(radix trie), 用于批量查询更具体(covered)/更不具体(covering)的前缀。
+    - 树按先序(preorder)展平为定长数组: 每个前缀编码为17字节的键`(高64位, 低64位, 前缀长度)`, 按字节序排序即为前缀树的先序遍历,
+      因而任一节点的子树(全部更具体前缀)是数组中的一段连续区间; 查询只需`np.searchsorted`, 无逐位遍历, 无Python循环。
+    - covered : 子树区间的两次二分查找
+    - covering: 对树中出现的每种前缀长度各做一次截断后的精确查找(IPv4最多33次, IPv6最多129次)
+- 建树与查询的输入均可为前缀列(list, np.ndarray, pl.Series, pd.Series), 如rib表的`dest_pref`列、`IdEncoder.table['key']`;
+  结果为下标数组, 或建树时传入的`ids`(如`pfx_id`)。
+'''
+import ipaddress
+import numpy as np
+import polars as pl
+
+_ALL1= (1<< 64)- 1
+    # _MASK[i]: 64位中保留高i位的掩码
+_MASK= np.array([ _ALL1^ ((1<< (64- i))- 1) for i in range(65)], dtype= np.uint64)
+
+
+def parsePrefixes(prefixes):
+    '''
+    - description: 向量化地解析前缀字符串(主机位被清零, 如`10.0.0.1/8`视为`10.0.0.0/8`)。IPv6仅对去重后的值逐个解析。
+    - return {tuple of np.ndarray}: `(fam, hi, lo, plen)`; fam为4、6, 无法解析时为0
+    '''
+    s= pl.Series('p', list(prefixes) if not isinstance(prefixes, pl.Series) else prefixes).cast(pl.Utf8)
+    n= len(s)
+    fam = np.zeros(n, dtype= np.uint8)
+    hi  = np.zeros(n, dtype= np.uint64)
+    lo  = np.zeros(n, dtype= np.uint64)
+    plen= np.zeros(n, dtype= np.int16)
+    if not n:
+        return fam, hi, lo, plen
+
+    # IPv4: `a.b.c.d/l` -> 5个整数
+    parts= (pl.DataFrame({'p': s})
+        .select( pl.col('p').str.replace('/', '.').str.split_exact('.', 4).alias('x'))
+        .unnest('x')
+        .select([ pl.col(f'field_{i}').cast(pl.Int64, strict= False).fill_null(-1) for i in range(5)])
+        .to_numpy())
+    octets, l4= parts[:, :4], parts[:, 4]
+    is_v4= (octets>= 0).all(axis= 1) & (octets<= 255).all(axis= 1) & (l4>= 0) & (l4<= 32)
+    v4= (octets[is_v4].astype(np.uint64)* np.array([1<< 24, 1<< 16, 1<< 8, 1], dtype= np.uint64)).sum(axis= 1)
+    fam[is_v4] = 4
+    hi[is_v4]  = v4<< np.uint64(32)
+    plen[is_v4]= l4[is_v4]
+
+    # IPv6
+    idx6= np.where( ~is_v4 & s.str.contains(':').fill_null(False).to_numpy())[0]
+    if len(idx6):
+        vals= s.take(idx6).to_list()
+        parsed= {}
+        for v in set(vals):
+            try:
+                net= ipaddress.IPv6Network(v, strict= False)
+                a= int(net.network_address)
+                parsed[v]= (a>> 64, a& _ALL1, net.prefixlen)
+            except ValueError:
+                parsed[v]= None
+        for i, v in zip(idx6, vals):
+            r= parsed[v]
+            if r:
+                fam[i], hi[i], lo[i], plen[i]= 6, r[0], r[1], r[2]
+
+    hi&= _MASK[ np.minimum(plen, 64)]
+    lo&= _MASK[ np.maximum(plen- 64, 0)]
+    return fam, hi, lo, plen
+
+def _keys(hi, lo, plen):
+    '''- 17字节大端键, 其字节序即`(hi, lo, plen)`的字典序'''
+    k= np.empty(len(hi), dtype= [('hi', '>u8'), ('lo', '>u8'), ('len', 'u1')])
+    k['hi'], k['lo'], k['len']= hi, lo, plen
+    return k.view('S17')
+
+def _expand_ranges(left, right):
+    '''- 把区间`[left_i, right_i)`展开。return {(np.ndarray, np.ndarray)}: `(区间序号, 区间内位置)`'''
+    cnt= right- left
+    grp= np.repeat(np.arange(len(cnt)), cnt)
+    pos= np.arange(cnt.sum())- np.repeat(np.cumsum(cnt)- cnt, cnt)+ np.repeat(left, cnt)
+    return grp, pos
+
+
+class PfxTrie():
+    '''- 先序展平的IPv4/IPv6前缀树'''
+
+    def __init__(self, prefixes, ids= None) -> None:
+        '''
+        - args-> prefixes {list | np.ndarray | pl.Series | pd.Series}: 前缀列, 可含重复值与null
+        - args-> ids {array-like}: 与prefixes等长, 查询时返回的编号(如`pfx_id`); 默认为prefixes中的下标。重复前缀取首次出现的编号。
+        '''
+        fam, hi, lo, plen= parsePrefixes(prefixes)
+        ids= np.arange(len(fam)) if ids is None else np.asarray(ids)
+        self.tries= {}
+        for f in (4, 6):
+            sel= np.where(fam== f)[0]
+            keys, first= np.unique(_keys(hi[sel], lo[sel], plen[sel]), return_index= True)
+            sel= sel[first]
+            self.tries[f]= {
+                'keys': keys,
+                'ids' : ids[sel],
+                'lens': np.unique(plen[sel]),
+            }
+
+    def __len__(self):
+        return sum([ len(t['keys']) for t in self.tries.values() ])
+
+    @classmethod
+    def fromEncoder(cls, enc):
+        '''- 由`utils.IdEncoder`(如`FET.pfx_enc`)建树, 查询结果为`pfx_id`'''
+        return cls(enc.table['key'], enc.table['id'].to_numpy())
+
+    def _queries(self, queries):
+        fam, hi, lo, plen= parsePrefixes(queries)
+        for f, t in self.tries.items():
+            sel= np.where(fam== f)[0]
+            if len(sel) and len(t['keys']):
+                yield t, sel, hi[sel], lo[sel], plen[sel]
+
+    def lookup(self, queries):
+        '''- 精确匹配。return {np.ndarray}: 每个查询对应的编号, 未命中为-1'''
+        res= np.full(len(queries), -1, dtype= np.int64)
+        for t, sel, hi, lo, plen in self._queries(queries):
+            k= _keys(hi, lo, plen)
+            pos= np.minimum(np.searchsorted(t['keys'], k), len(t['keys'])- 1)
+            hit= t['keys'][pos]== k
+            res[sel[hit]]= t['ids'][pos[hit]]
+        return res
+
+    def covered(self, queries, strict= True):
+        '''
+        - description: 被查询前缀覆盖的前缀(更具体前缀, 即子前缀)
+        - args-> strict {bool}: 为True时不含与查询相同的前缀
+        - return {(np.ndarray, np.ndarray)}: `(查询下标, 编号)`成对数组
+        '''
+        q_res, p_res= [], []
+        for t, sel, hi, lo, plen in self._queries(queries):
+            left = np.searchsorted(t['keys'], _keys(hi, lo, plen+ int(strict)), 'left')
+            # 子树的右界: 该前缀地址块内的最大地址, 长度取255
+            hi_end= hi| ~_MASK[ np.minimum(plen, 64)]
+            lo_end= lo| ~_MASK[ np.maximum(plen- 64, 0)]
+            right= np.searchsorted(t['keys'], _keys(hi_end, lo_end, np.full(len(sel), 255)), 'right')
+            grp, pos= _expand_ranges(left, np.maximum(left, right))
+            q_res.append(sel[grp])
+            p_res.append(t['ids'][pos])
+        return self._concat(q_res, p_res)
+
+    def covering(self, queries, strict= True):
+        '''
+        - description: 覆盖查询前缀的前缀(更不具体前缀, 即父前缀), 每个查询内按前缀长度升序
+        - args-> strict {bool}: 为True时不含与查询相同的前缀
+        - return {(np.ndarray, np.ndarray)}: `(查询下标, 编号)`成对数组
+        '''
+        q_res, p_res, l_res= [], [], []
+        for t, sel, hi, lo, plen in self._queries(queries):
+            for L in t['lens']:
+                m= np.where(plen> L if strict else plen>= L)[0]
+                if not len(m):
+                    continue
+                k= _keys(hi[m]& _MASK[min(L, 64)], lo[m]& _MASK[max(L- 64, 0)], np.full(len(m), L))
+                pos= np.minimum(np.searchsorted(t['keys'], k), len(t['keys'])- 1)
+                hit= t['keys'][pos]== k
+                q_res.append(sel[m[hit]])
+                p_res.append(t['ids'][pos[hit]])
+                l_res.append(np.full(hit.sum(), L))
+        q, p= self._concat(q_res, p_res)
+        if len(q):
+            order= np.lexsort((np.concatenate(l_res), q))
+            q, p= q[order], p[order]
+        return q, p
+
+    def longestMatch(self, queries):
+        '''- 最长前缀匹配(含自身)。return {np.ndarray}: 每个查询对应的编号, 无覆盖前缀时为-1'''
+        res= np.full(len(queries), -1, dtype= np.int64)
+        q, p= self.covering(queries, strict= False)
+        last= np.append(q[1:]!= q[:-1], True) if len(q) else q.astype(bool)     # covering按长度升序, 每个查询的最后一项即最长匹配
+        res[q[last]]= p[last]
+        return res
+
+    @staticmethod
+    def _concat(q_res, p_res):
+        if not len(q_res):
+            return np.array([], dtype= np.int64), np.array([], dtype= np.int64)
+        return np.concatenate(q_res), np.concatenate(p_res)
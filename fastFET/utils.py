@@ -1,6 +1,7 @@
-import sys,os,psutil
+import sys,os,psutil,shutil,glob,threading
 import pandas as pd
 import polars as pl
+import numpy as np
 import datetime as dt
 from datetime import datetime
 import multiprocessing
@@ -8,11 +9,11 @@ import json, re, math
 from collections import OrderedDict, defaultdict
 import time
 from functools import wraps
-import jsonpath
 import logging
 import logging.config
 
 from typing import Union
+from contextlib import contextmanager
 
 from fastFET.MultiProcess import ProcessingQueue
 
@@ -164,6 +165,9 @@ def computMem(var):
 ##############
     # 14个字段
 raw_fields= ['protocol','timestamp','msg_type','peer_IP','peer_AS','dest_pref','path','origin','next_hop','local_pref','MED','community','atomicAGG','aggregator']
+    # 各字段的固定类型, 读文件时不再逐次推断; 未列出的字段为Utf8
+raw_dtypes= {'timestamp': pl.Int64, 'peer_AS': pl.Int64, 'local_pref': pl.Int64, 'MED': pl.Int64}
+bin_dtype= pl.Int32     # time_bin的类型: slot=1s时可覆盖约68年, 只为有updates的时间片产生行(稀疏)
 
 
 def runJobs( file_dict, func, nbProcess= 4 ):
@@ -200,44 +204,255 @@ def runJobs( file_dict, func, nbProcess= 4 ):
             func( *args )
 
 
-def csv2df(paths: Union[list, str], headers: list= raw_fields, not_priming= True, space=6 ):   # space8()
-    '''合并paths为大文件'''
+class IdEncoder():
+    '''- 字符串到UInt32编号的字典(如prefix、AS path), 在一次运行(同一monitor的各chunk)内保持稳定。
+    - 编号从1开始, null仍编码为null。'''
+    def __init__(self) -> None:
+        self.table= pl.DataFrame(columns= [('key', pl.Utf8), ('id', pl.UInt32)])
+
+    def __len__(self):
+        return self.table.height
+
+    def encode(self, df: pl.DataFrame, col: str, alias: str, payload: list= []) -> pl.DataFrame:
+        '''- 把df中新出现的`col`值加入字典, 并追加编号列`alias`(行序不变)
+        - payload: 随key一并存入字典的派生列(如`path_list`), 只在key首次出现时记录'''
+        if payload and not set(payload)<= set(self.table.columns):
+            assert not self.table.height, 'payload columns must be fixed before the first encode'
+            self.table= pl.DataFrame(columns= [('key', pl.Utf8), ('id', pl.UInt32)]+ [ (c, df.schema[c]) for c in payload ])
+        new= (df.lazy()
+            .select( [pl.col(col).alias('key')]+ payload )
+            .filter( pl.col('key').is_not_null() )
+            .unique( subset= 'key' )
+            .join( self.table.lazy(), on= 'key', how= 'anti')
+            .collect())
+        if new.height:
+            new= (new.with_row_count('id', offset= self.table.height+ 1)
+                .select([ 'key', pl.col('id').cast(pl.UInt32) ]+ payload ))
+            self.table= pl.concat([ self.table, new.select(self.table.columns) ])
+        return df.join( self.table.select(['key', 'id']).rename({'key': col, 'id': alias}), on= col, how= 'left')
+
+    def decode(self, ldf: pl.LazyFrame, col: str, alias: str, field: str= 'key') -> pl.LazyFrame:
+        '''- 按编号列`col`追加字典中的`field`列(默认原字符串), 命名为`alias`(行序不变)'''
+        return ldf.join( self.table.lazy().select([ pl.col('id').alias(col), pl.col(field).alias(alias) ]), on= col, how= 'left')
+
+class PeerPfxState():
+    '''- 以`(peer_AS, pfx_id)`为键的增量状态表, 跨chunk保存每个键最后一次宣告与最后一次撤销的报文(至多2行)。
+    - 行以整数键`pp_key`与全局序号`seq`(跨chunk单调递增)标识; 更新是按整数键的hash anti-join加追加, 不再对全部历史做concat+groupby。
+    - 下游节点只需读取当前chunk出现过的键的历史(semi-join), 历史行按`seq`即时间先后排列。'''
+    def __init__(self, schema: list) -> None:
+        '''- schema: `[(列名, 类型)]`, 需含`index`、`peer_AS`、`pfx_id`、`msg_type`'''
+        self.df= pl.DataFrame(columns= schema+ [('pp_key', pl.Int64), ('seq', pl.UInt64)])
+        self.seq= 0
+
+    def __len__(self):
+        return self.df.height
+
+    @staticmethod
+    def key() -> pl.Expr:
+        return (pl.col('peer_AS').cast(pl.Int64)* (1<< 32)+ pl.col('pfx_id').cast(pl.Int64)).alias('pp_key')
+
+    def history(self, df_cur: pl.DataFrame) -> pl.DataFrame:
+        '''- 当前chunk出现过的键的历史行(按时间先后), 列同`df_cur`'''
+        return (self.df.lazy()
+            .join( df_cur.lazy().select( self.key() ).unique(), on= 'pp_key', how= 'semi')
+            .sort('seq')
+            .select( df_cur.columns )
+        ).collect()
+
+    def update(self, df_cur: pl.DataFrame):
+        '''- 以当前chunk中每个`(键, msg_type)`的最后一行覆盖状态; 只保留`df_cur`中的列。返回self'''
+        last= (df_cur.lazy()
+            .with_columns([ self.key(), (pl.col('index').cast(pl.UInt64)+ self.seq).alias('seq') ])
+            .unique( subset= ['pp_key', 'msg_type'], keep= 'last', maintain_order= True )
+        ).collect()
+        if 'tag_hist_cur' in last.columns:
+            last= last.with_column( pl.lit(False).alias('tag_hist_cur') )
+        state= (self.df.lazy()
+            .select( last.columns )
+            .join( last.lazy().select(['pp_key', 'msg_type']), on= ['pp_key', 'msg_type'], how= 'anti')
+        ).collect()
+        self.df= pl.concat([ state, last ], rechunk= False)
+        self.seq+= df_cur.height
+        return self
+
+class RareASState():
+    '''- 稀有AS的增量状态: 跨chunk累计每个AS在宣告路径中出现的次数, 以及"出现次数 -> AS个数"的直方图。
+    - 稀有AS即累计次数不大于全体AS次数的5%分位数(同polars 0.13的`quantile(q, 'nearest')`, 即升序第`floor(q*n)`个)的AS。
+    - 每个时间片只更新本片出现过的AS; 分位数由直方图的前缀和求得, 而分位数总落在很小的次数上, 只需扫描直方图的开头一段。'''
+    def __init__(self, q= 0.05) -> None:
+        self.q= q
+        self.keys= np.array([], dtype= np.int64)     # 已出现的AS号, 升序
+        self.cnt = np.array([], dtype= np.int64)     # 与keys对齐的累计次数
+        self.hist= np.zeros(64, dtype= np.int64)     # hist[c]: 累计次数为c(>0)的AS个数
+        self.n= 0                                    # 累计次数>0的AS个数
+
+    def __len__(self):
+        return self.n
+
+    def _extend(self, ases: np.ndarray):
+        '''- 把新AS加入keys(次数为0, 尚不计入直方图)'''
+        new= np.setdiff1d(ases, self.keys)
+        if len(new):
+            keys= np.concatenate([ self.keys, new ])
+            order= np.argsort(keys, kind= 'stable')
+            self.keys= keys[order]
+            self.cnt= np.concatenate([ self.cnt, np.zeros(len(new), dtype= np.int64) ])[order]
+
+    def _add(self, ases: np.ndarray, counts: np.ndarray):
+        '''- 累加一个时间片内各AS(互不重复)的次数'''
+        idx= np.searchsorted(self.keys, ases)
+        old= self.cnt[idx]
+        new= old+ counts
+        self.cnt[idx]= new
+        if new.max()>= len(self.hist):
+            self.hist= np.concatenate([ self.hist, np.zeros(max(new.max()+ 1, 2* len(self.hist))- len(self.hist), dtype= np.int64) ])
+        np.subtract.at(self.hist, old[old> 0], 1)
+        np.add.at(self.hist, new, 1)
+        self.n+= int((old== 0).sum())
+
+    def rareNum(self) -> int:
+        '''- 当前累计次数不大于分位数的AS个数'''
+        if not self.n:
+            return 0
+        k= int(self.n* self.q)      # 升序的第k个(0起)
+        L= 64
+        while True:
+            cum= np.cumsum(self.hist[:L])
+            if cum[-1]> k or L>= len(self.hist):
+                break
+            L*= 2
+        value= int(np.searchsorted(cum, k, 'right'))     # 分位数: 前缀和首次超过k的次数
+        return int(cum[value])
+
+    def update(self, time_bin: np.ndarray, ases: np.ndarray, counts: np.ndarray):
+        '''
+        - description: 按时间片顺序累加, 并给出每个时间片结束时的稀有AS个数
+        - args-> time_bin, ases, counts {np.ndarray}: `groupby(['time_bin','AS']).count()`的三列, 已按time_bin排序
+        - return {(np.ndarray, np.ndarray)}: `(时间片, 稀有AS个数)`
+        '''
+        self._extend(np.unique(ases))
+        slots, starts= np.unique(time_bin, return_index= True)
+        ends= np.append(starts[1:], len(time_bin))
+        res= np.zeros(len(slots), dtype= np.int64)
+        for i, (s, e) in enumerate(zip(starts, ends)):
+            self._add(ases[s:e], counts[s:e])
+            res[i]= self.rareNum()
+        return slots, res
+
+class PartitionedSink():
+    '''- 按hive风格分区追加写入的Parquet数据集, 如`{root}/event=xx/collector=rrc00/day=20211004/part-0-0.parquet`。
+    - 分区列(固定的`partition`, 及按行取值的`by`列)写在目录名中而不在文件内; 下游可以`pyarrow.dataset.dataset(root, partitioning='hive')`
+      读取, 按分区与列做谓词下推, 如`.to_table(filter= (ds.field('collector')== 'rrc00') & (ds.field('type_0')))`。
+    - 每次`write`写出新文件(文件名含递增序号), 不改写已有文件。'''
+    def __init__(self, root: str, by: list= [], **partition) -> None:
+        '''
+        - args-> root {str}: 数据集根目录
+        - args-> by {list}: 按行取值的分区列(须在写入的df中)
+        - args-> partition {str}: 固定的分区值, 如`event='xx', collector='rrc00'`; 对应目录下已有的文件在此清空(同一事件重跑时覆盖)
+        '''
+        self.root= root.rstrip('/')
+        self.partition= partition
+        self.by= list(by)
+        self.part= 0
+        sub= os.path.join(self.root, *[ f'{k}={v}' for k, v in partition.items() ])
+        if os.path.isdir(sub):
+            shutil.rmtree(sub)
+
+    def write(self, df: pl.DataFrame):
+        '''- 追加一批行, 空df不写文件'''
+        if not df.height:
+            return
+        import pyarrow.dataset as ds
+        keys= list(self.partition)+ self.by
+        table= df.with_columns([ pl.lit(str(v)).alias(k) for k, v in self.partition.items() ]).select(
+            [ c for c in df.columns if c not in keys ]+ keys ).to_arrow()
+        ds.write_dataset(table, self.root, format= 'parquet', partitioning= keys, partitioning_flavor= 'hive',
+            basename_template= f'part-{self.part}-{{i}}.parquet', existing_data_behavior= 'overwrite_or_ignore')
+        self.part+= 1
+
+def tsFormat(expr: pl.Expr, fmt= '%Y/%m/%d %H:%M') -> pl.Expr:
+    '''- 把UTC秒级时间戳格式化为字符串(原生表达式, 代替`.apply(lambda x: datetime.fromtimestamp(x, tz= utc).strftime(fmt))`)'''
+    return (expr.cast(pl.Int64)* 1000).cast(pl.Datetime('ms')).dt.strftime(fmt)
+
+@contextmanager
+def forbidUDFs(where= ''):
+    '''- 基准测试模式: 块内collect的查询计划执行了Python UDF(`Expr.map/apply`, `pl.map/apply`, `LazyFrame.map`, `(Lazy)GroupBy.apply`)时, 在块结束时报错。
+    - polars 0.13的计划文本里, 原生的`arr.get/first/last`与Python的`Expr.map`同样显示为`map()`, 计划也无法序列化(均为`AnonymousFunction`);
+      而计划执行时调用Python UDF前, 须经`polars.wrap_s/wrap_df`把Rust侧的Series/DataFrame包装为Python对象, 原生算子则不经过。
+      故在块内统计这两个入口的调用, 与表达式如何构造(别名、`functools.partial`等)无关。
+    - 只用于基准测试模式(`FET(udf_check= True)`)。块内替换的是全局`polars`模块上的入口, 不是线程安全的:
+      同一时间其他线程或库代码对polars的调用也会被统计。故该模式下`FET`不使用编辑距离进程池, 也不经`run()`的下载/解析调度(`TaskScheduler`)。'''
+    calls= []
+    saved= { nm: getattr(pl, nm) for nm in ('wrap_s', 'wrap_df') }
+    def hook(nm):
+        def wrap(obj):
+            calls.append(nm)
+            return saved[nm](obj)
+        return wrap
+    for nm in saved:
+        setattr(pl, nm, hook(nm))
+    try:
+        yield
+    finally:
+        for nm, func in saved.items():
+            setattr(pl, nm, func)
+    if len(calls):
+        raise RuntimeError(f'Python UDF called {len(calls)} times in `{where}` ({", ".join(sorted(set(calls)))})')
+
+def pathStr(col: str= 'path') -> pl.Expr:
+    '''- 清洗bgpdump的AS path字符串: AS_SET`{a,b}`与联盟段`(a b)`/`[a b]`不是有序的AS跳, 连同其前导空格一并去除; null保持为null。'''
+    return (pl.col(col).str.replace_all(r' *(\{[^}]*\}|\([^)]*\)|\[[^\]]*\])', '')
+        .str.strip())
+
+def pathList(col: str= 'path', clean= True) -> pl.Expr:
+    '''- 把AS path字符串一次性解析为`List[UInt32]`, 供各特征共用(长度、去重、origin、逐跳位置、拓扑边)。
+    - clean: `col`尚未经`pathStr`清洗时为True'''
+    expr= pathStr(col) if clean else pl.col(col)
+    return expr.str.split(' ').cast(pl.List(pl.UInt32))
+
+def _scan_txt(path, headers, cols= None):
+    '''- 惰性读取一个`bgpdump -m`文件, 列名为`headers`, 类型见`raw_dtypes`。
+    - cols: 只读取/解析的列(投影下推), 默认为全部`headers`
+    - polars按首行确定列数, 而updates文件首行可能是字段较少的`W`/`STATE`报文: 
+      此时把整行读为一列再按`|`切分(较慢), 否则直接按`|`解析。'''
+    with open(path) as f:
+        line= f.readline()
+    cols= cols or headers
+    if ',' in line:
+        return pl.scan_csv(path, has_header=True).select(cols)
+
+    if line.count('|')>= len(headers):
+        return (pl.scan_csv(path, sep='|', has_header=False, quote_char=None, infer_schema_length=0, ignore_errors=True,
+                    with_column_names= lambda cols: (headers+ [f'_col{i}' for i in range(len(cols))])[:len(cols)],
+                    dtypes= {h: raw_dtypes.get(h, pl.Utf8) for h in headers})
+                .select(cols))
+
+    split= pl.col('line').str.split_exact('|', len(headers)).alias('line')
+    fields= [ pl.col('line').struct.field(f'field_{i}').alias(h) for i, h in enumerate(headers) if h in cols]
+    return (pl.scan_csv(path, sep='\x07', has_header=False, quote_char=None, infer_schema_length=0,
+                with_column_names= lambda cols: ['line'])
+            .select(split)
+            .select(fields)
+            .with_columns([ pl.when(pl.col(h)== '').then(pl.lit(None)).otherwise(pl.col(h)).cast(raw_dtypes.get(h, pl.Utf8), strict= False).alias(h)
+                for h in cols]))
+
+def csv2df(paths: Union[list, str], headers: list= raw_fields, not_priming= True, space=6, lazy= False, cols= None ):   # space8()
+    '''读取并纵向合并paths(无临时文件)
+    - lazy: 为True时返回`LazyFrame`, 由调用方决定何时`collect`
+    - cols: 只保留的列(按文件投影, 未选中的列不做类型转换), 如`featTree.getRequiredCols`的结果; 默认为全部`headers`'''
     if isinstance(paths, str):
         paths= [paths] 
-    merged= ''
+    paths= [ p for p in paths if p!= None]
     str_map= {True: 'upds', False: 'ribs' }
     isUpds= bool(len(paths)-1)
     
-    if len(paths) != 1:     
-        paths= [ p for p in paths if p!= None]
-        
-        s= '|'.join( headers )+ '|'
-        out= os.path.dirname(paths[0])+ '/head.txt'
-        os.system('echo \''+ s+ '\' > '+ out)
-        paths_str= out+ ' '+ ' '.join(paths)
-        
-        merged= os.path.dirname(paths[0])+ '/merged.txt'
-        t1= time.time()
-        os.system('cat '+ paths_str+ ' > '+ merged)
-        logger.info(' '*8+ str_map[not_priming]+ '---> merge upd files cost: %3.3fs; size: %.3fMb' % (time.time()-t1, os.path.getsize(merged)/1024**2 ) )
-        
-    t2= time.time()
-    file_map= {True: merged, False: paths[0] }
-    
-    with open(paths[0] ) as f:
-        line= f.readline()
-    if ',' in line:
-        df= pl.read_csv(file_map[ isUpds ], has_header=True)
-    else:
-        df= pl.read_csv(file_map[ isUpds ], sep='|', has_header= isUpds , ignore_errors= True)
-        
-        if len(paths)==1:
-            df.columns= headers   
-        logger.info(' '*8+ str_map[ (isUpds & not_priming)] +'---> read  csv files cost: %3.3fs; mem: %5.2fMb; shape: %s' % (time.time()-t2, df.estimated_size()/1024**2, str(df.shape) ) )
+    ldf= pl.concat([ _scan_txt(p, headers, cols) for p in paths ])
+    if lazy:
+        return ldf
 
-        if len(paths) != 1:
-            os.system( 'rm -f '+ merged+ ' '+ out )
-    
+    t2= time.time()
+    df= ldf.collect()
+    logger.info(' '*8+ str_map[ (isUpds & not_priming)] +'---> read  csv files cost: %3.3fs; mem: %5.2fMb; shape: %s' % (time.time()-t2, df.estimated_size()/1024**2, str(df.shape) ) )
     return df
 
 def labelMaker(save_path: str, sat_end_list: list, all_to_normal= False):
@@ -266,41 +481,74 @@ def labelMaker(save_path: str, sat_end_list: list, all_to_normal= False):
         start= dt.datetime.strptime(sat_end[0].strip()[:-3], "%Y/%m/%d %H:%M")
         end = dt.datetime.strptime(sat_end[1].strip()[:-3], "%Y/%m/%d %H:%M")
 
-        sat_idx= df.filter(pl.col('date')== start)['time_bin'].to_list()[0]
-        end_idx= df.filter(pl.col('date')== end)['time_bin'].to_list()[0]
-        
-        for i in range( sat_idx, end_idx+1):
-            df[i, 'label']= event_type
+        # time_bin是稀疏的(无updates的时间片没有行), 故按日期区间而非行号打标签
+        df= df.with_column( pl.when( (pl.col('date')>= start) & (pl.col('date')<= end) )
+            .then( pl.lit(event_type)).otherwise( pl.col('label')).alias('label') )
 
     date= df['date']
     df['date']= [ s.strftime("%Y/%m/%d %H:%M") for s in date]
     
     df.sort('time_bin').to_csv( save_path )
 
-def splitChunk(paths:list, need_rib):
-    '''切分文件集合以读取'''
-    if len(paths)==1:
-        return [paths]
-    sys_cores= multiprocessing.cpu_count()
+# 单条update在预处理及特征计算阶段的峰值内存估计(字节), 用于把内存预算换算为行数
+ROW_BYTES= 600
+
+def binIndex(paths:list, first_ts, slot):
+    '''- 各文件在各`time_bin`内的行数, 只解析timestamp列。
+    - return {pl.DataFrame}: `[file(paths中的下标), time_bin, rows]`'''
+    ldfs= [ _scan_txt(p, raw_fields)
+                .select( ((pl.col('timestamp')- first_ts)// slot).cast(bin_dtype).alias('time_bin') )
+                .drop_nulls()
+                .groupby('time_bin')
+                .agg( pl.count().alias('rows') )
+                .with_column( pl.lit(i).cast(pl.UInt32).alias('file') )
+            for i, p in enumerate(paths) ]
+    return pl.concat( pl.collect_all(ldfs) ).select(['file', 'time_bin', 'rows'])
+
+def splitChunk(paths:list, first_ts, slot, mem_budget= None, burst_ratio= 50):
+    '''
+    - description: 按`time_bin`切分chunk: 由各时间片的行数(`binIndex`)与内存预算贪心地合并相邻时间片, 
+        每个时间片完整地落在一个chunk内; 行数超过中位数`burst_ratio`倍的突发时间片(如泄露事件的某一分钟)单独成chunk。
+    - args-> paths {list}: 按时序排列的updates文件
+    - args-> first_ts {int}: 起始时间戳, 与`preProcess`一致
+    - args-> slot {int}: 时间片大小(s)
+    - args-> mem_budget {float}: 每个chunk的内存预算(Gb), 默认为物理内存的1/4
+    - args-> burst_ratio {int}: 判定突发时间片的倍数
+    - return {list}: `[(files, (bin_lo, bin_hi)), ...]`, 区间左闭右开, 首尾为None(不设界)
+    '''
     sys_memry= psutil.virtual_memory().total/1024**3
-    sizeG, chunksize= 0, 0
+    mem_budget= mem_budget or sys_memry/4
+    rows_max= max(1, int(mem_budget*1024**3// ROW_BYTES))
+
+    idx= binIndex(paths, first_ts, slot)
+    per_bin= idx.groupby('time_bin').agg( pl.col('rows').sum() ).sort('time_bin')
+    bins, rows= per_bin['time_bin'].to_list(), per_bin['rows'].to_list()
+    if not len(bins):
+        return [(paths, (None, None))]
+    thd_burst= burst_ratio* sorted(rows)[len(rows)//2]
+
+    groups, cur, cur_rows, cur_burst= [], [], 0, False
+    for b, r in zip(bins, rows):
+        is_burst= r> thd_burst
+        if cur and (cur_rows+ r> rows_max or is_burst or cur_burst):
+            groups.append(cur)
+            cur, cur_rows= [], 0
+        cur.append(b)
+        cur_rows+= r
+        cur_burst= is_burst
+
+    groups.append(cur)
     res= []
+    for i, g in enumerate(groups):
+        lo= g[0] if i else None
+        hi= groups[i+1][0] if i+1< len(groups) else None
+        files= (idx.filter( (pl.col('time_bin')>= g[0])& (pl.col('time_bin')<= g[-1]) )['file']
+                .unique().sort().to_list())
+        res.append(( [ paths[f] for f in files ], (lo, hi) ))
     
-    for f in paths:
-        sizeG+= os.path.getsize(f)
-    sizeG= sizeG/1024**3
-
-    #if not need_rib:
-    chunksize= 2 if sys_memry>=8 else sys_memry/4
-    chunk= math.ceil( sizeG/chunksize )
-    chunk_files= math.ceil( len(paths)/chunk )
-    for i in range(chunk-1):
-        res.append( paths[i*chunk_files: (i+1)*chunk_files])
-    res.append( paths[(chunk-1)* chunk_files:] )
-    
-    logger.info(f'    split updates files: system info: cpus({sys_cores}); memory({sys_memry:.3f} Gb)')
-    logger.info(f'                         files total size: {sizeG:.3f} Gb; max limit per chunk {chunksize:.3f} Gb') 
-
+    logger.info(f'    split updates files: memory({sys_memry:.3f} Gb); budget per chunk {mem_budget:.3f} Gb (~{rows_max} rows)')
+    logger.info(f'                         total rows: {sum(rows)} in {len(bins)} bins; max bin: {max(rows)} rows; '
+                f'bursts(>{thd_burst} rows): {sum([ r> thd_burst for r in rows ])}; chunks: {len(res)}') 
     return res
 
 def exprDict( featNm_pfx:str):
@@ -312,32 +560,59 @@ def exprDict( featNm_pfx:str):
     }
     return dic
 
+_tree_index= {}
+def treeIndex(dictTree:dict):
+    '''- 特征树的叶子索引(每棵树只遍历一次, 以`id`缓存), 替代逐特征的`jsonpath`全树扫描
+    - return: dict[key: 特征名; val: (路径元组, 叶子的值)]'''
+    key= id(dictTree)
+    if key not in _tree_index:
+        res= {}
+        def recur( path, dic ):
+            for k, v in dic.items():
+                if isinstance(v, dict):
+                    recur( path+ (k,), v )
+                elif k not in res:
+                    res[k]= ( path, v )
+        recur( (), dictTree )
+        _tree_index[key]= (dictTree, res)     # 持有dictTree的引用, 保证id不被复用
+    return _tree_index[key][1]
+
 def featsGrouping(dictTree:dict, feats:list):
     '''对目标特征集合中的特征分组
     - arg: dictTree:完整的字典树
     - arg: feats:目标特征集合
     - return: dict[key: 路径元组; val: 一个路径下的目标特征子集list ] '''
-    feats_paths= {} 
-    for feat in feats:
-        curpath= jsonpath.normalize(jsonpath.jsonpath(dictTree, '$..'+feat, result_type='PATH')[0])
-        curNodes=tuple( curpath.split(';')[1:])
-        feats_paths[ curNodes[-1]]= curNodes[:-1]
+    index= treeIndex(dictTree)
     paths_feats= {} 
-    
-    for feat, path in feats_paths.items():
+    for feat in feats:
+        path= index[feat][0]
         if path not in paths_feats.keys():
             paths_feats[ path ]= [feat]
-        else:
+        elif feat not in paths_feats[ path ]:
             paths_feats[ path ].append( feat )
     return paths_feats
 
+def alignHstack(dfs: list, on= 'time_bin'):
+    '''- 把若干以`on`为唯一键的结果按`on`对齐后一次性横向拼接, 只保留全部结果共有的键(与逐个inner join等价, 但无join链)。
+    键集合与顺序一致的结果直接拼接列, 否则先按键筛选。
+    - return {pl.DataFrame}: 按`on`升序'''
+    keys= dfs[0][on]
+    for df in dfs[1:]:
+        keys= keys.filter( keys.is_in( df[on].cast(keys.dtype) ) )
+    keys= keys.sort()
+    cols= [ keys ]
+    for df in dfs:
+        df= df.with_column( pl.col(on).cast(keys.dtype) )
+        if df.height!= keys.len() or not df[on].sort().series_equal(keys):
+            df= df.filter( pl.col(on).is_in(keys) )
+        df= df.sort(on)
+        cols+= [ df[c] for c in df.columns if c!= on ]
+    return pl.DataFrame(cols)
+
 def feat2expr( featTree, feats ):
     ''''''
-    feats_exprs= {} 
-    for feat in feats:
-        curexpr= jsonpath.jsonpath(featTree, '$..'+feat, result_type='VALUE')[0]
-        feats_exprs[feat]= curexpr
-    return feats_exprs
+    index= treeIndex(featTree)
+    return { feat: index[feat][1] for feat in feats }
 
 ##############
 # graph feats#
@@ -347,38 +622,128 @@ def df2edge( df: pl.DataFrame ):
     '''从原始df的path列获取边集合
     - return: list(tuple(ASNum, ASNum)) '''
     res= ( df.lazy()
-        .filter(
-            (pl.col("msg_type") != 'STATE') &   
-            (~pl.col('path').str.contains('\{'))
-            )
-        #.groupby(['peer_AS', 'dest_pref']).tail(1)   
-        .select( [
-            pl.col('path').str.split(" ").alias('path_list')
+        .filter( (pl.col("msg_type") != 'STATE') & pl.col('path').is_not_null() )
+        .select( pathList('path').alias('path_list') )
+        .select([
+            pl.col('path_list'),
+            pl.col('path_list').arr.shift(-1).alias('path_list_shift')
             ])
-        .with_row_count('index')       
-        .explode('path_list')
-        .groupby('index').agg([
-            pl.col( 'path_list'),
-            pl.col( 'path_list').shift(-1).alias('path_list_shift')     
-        ])
-        .filter( ( pl.col( 'path_list_shift' ) != None) &
-                 ( pl.col( 'path_list')== pl.col( 'path_list_shift') ) ) 
-        .select( pl.exclude( 'index' ))
+        .explode(['path_list', 'path_list_shift'])
+        .filter( ( pl.col( 'path_list_shift' ).is_not_null()) &
+                 ( pl.col( 'path_list')!= pl.col( 'path_list_shift') ) )     # 去除path prepending造成的自环
+        .unique()
     ).collect().rows()
     return res 
 
 
+#############
+# profiling #
+#############
+
+class Profiler():
+    '''
+    - description: 可选的剖析(`FET(profile= True)`)。每个span记录墙钟时间、CPU时间(进程内全部线程)、RSS增量,
+        及调用方填入的行数/大小等; 每个进程(含图特征的子进程)把span追加写入`{root}{pid}.jsonl`。
+        `merge()`合并为Chrome trace(`chrome://tracing`或Perfetto可直接打开)并给出按span汇总的表。未开启时`span`几乎无开销。
+    '''
+    def __init__(self) -> None:
+        self.root= None
+
+    @property
+    def on(self) -> bool:
+        return self.root is not None
+
+    def enable(self, root: str):
+        '''- 开启, 清空`root`下已有的记录'''
+        self.root= root if root.endswith('/') else root+ '/'
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+
+    def disable(self):
+        self.root= None
+
+    @contextmanager
+    def span(self, name: str, cat= 'stage', **args):
+        '''
+        - description: 记录一段代码。用法: `with profiler.span('peerPfx_dynamic', 'node', rows_in= n) as sp: ...; sp['rows_out']= m`
+        - args-> cat {str}: 类别, 如`stage`(流水线阶段, 见`timer`)、`node`(特征树节点)、`agg`(特征组的聚合)、`graph`(图特征)
+        - args-> args: 附加字段, 写入trace事件的`args`; 可在with块内继续填入
+        '''
+        if self.root is None:
+            yield args
+            return
+        proc= psutil.Process(os.getpid())
+        rss0= proc.memory_info().rss
+        ts, t0, c0= time.time(), time.perf_counter(), time.process_time()
+        try:
+            yield args
+        finally:
+            rss1= proc.memory_info().rss
+            args.update( cpu_s= round(time.process_time()- c0, 6), rss_mb= round(rss1/ 1024**2, 1),
+                         rss_delta_mb= round((rss1- rss0)/ 1024**2, 1) )
+            rec= { 'name': name, 'cat': cat, 'ph': 'X', 'ts': int(ts* 1e6), 'dur': int((time.perf_counter()- t0)* 1e6),
+                   'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': args }
+            with open(f'{self.root}{os.getpid()}.jsonl', 'a') as f:
+                f.write(json.dumps(rec, default= str)+ '\n')
+
+    def frameArgs(self, df: pl.DataFrame, key= 'rows_out') -> dict:
+        '''- span中记录的结果表规模: 行数及估计大小(Mb)'''
+        return { key: df.height, 'size_mb': round(df.estimated_size()/ 1024**2, 2) }
+
+    def merge(self) -> pl.DataFrame:
+        '''
+        - description: 合并各进程的记录, 写出`{root}trace.json`(Chrome trace)与`{root}summary.csv`
+        - return {pl.DataFrame}: 按(cat, name)汇总: 次数、墙钟/CPU时间之和(s)、RSS增量的最大值、行数之和、估计大小的最大值, 按墙钟时间降序
+        '''
+        recs= []
+        for p in sorted(glob.glob(self.root+ '*.jsonl')):
+            with open(p) as f:
+                recs+= [ json.loads(line) for line in f if line.strip() ]
+        with open(self.root+ 'trace.json', 'w') as f:
+            json.dump({ 'traceEvents': recs, 'displayTimeUnit': 'ms' }, f)
+        if not len(recs):
+            return pl.DataFrame()
+        get= lambda r, k: r['args'].get(k)
+        df= pl.DataFrame({
+            'cat':   [ r['cat'] for r in recs ],
+            'name':  [ r['name'] for r in recs ],
+            'wall_s':[ r['dur']/ 1e6 for r in recs ],
+            'cpu_s': [ float(get(r, 'cpu_s') or 0) for r in recs ],
+            'rss_delta_mb': [ float(get(r, 'rss_delta_mb') or 0) for r in recs ],
+            'rows_in':  pl.Series([ get(r, 'rows_in') for r in recs ], dtype= pl.Int64),
+            'rows_out': pl.Series([ get(r, 'rows_out') for r in recs ], dtype= pl.Int64),
+            'size_mb':  pl.Series([ get(r, 'size_mb') for r in recs ], dtype= pl.Float64),
+        })
+        res= (df.groupby(['cat', 'name'])
+            .agg([
+                pl.count().alias('calls'),
+                pl.col('wall_s').sum(),
+                pl.col('cpu_s').sum(),
+                pl.col('rss_delta_mb').max(),
+                pl.col('rows_in').sum(),
+                pl.col('rows_out').sum(),
+                pl.col('size_mb').max(),
+            ])
+            .sort('wall_s', reverse= True))
+        res.to_csv(self.root+ 'summary.csv')
+        return res
+
+profiler= Profiler()
+
+
 ##############
 # Decorator  #
 ##############
 
 def timer(func):
-    '''- in wrap, args[-1] is space, args[-2]  '''
+    '''- in wrap, args[-1] is space, args[-2]. 开启剖析时每次调用记为一个`stage` span(见`Profiler`)'''
     @wraps(func)    
     def wrap(*args, **kwargs):
         begin_time = time.perf_counter()
         begin_memo = curMem()
-        result = func(*args, **kwargs)
+        with profiler.span(func.__name__ if func.__name__ != 'run_cmpxFeat_inMulproc' else args[-2], 'stage'):
+            result = func(*args, **kwargs)
         end_time = time.perf_counter()
         end_memo = curMem()
 
@@ -0,0 +1,59 @@
+'''
+- 测试共用的夹具: 合成的`bgpdump -m`格式updates文件, 及在其上运行`FET.monitorHandler`(无图特征)。
+'''
+import os, glob, random
+import polars as pl
+import pytest
+
+from fastFET import FET
+
+FEATS= ['volume', 'path', 'dynamic', 'editdistance', 'ratio']
+
+
+def writeUpdates(out_dir: str, n= 30000, files= 3, peers= 20, pfxs= 2000, seed= 0) -> list:
+    '''- 同`featSketch.synthUpdates`的文件格式, 但前缀与路径取值很少: 同一(peer, 前缀)反复宣告/撤销, 产生重复、抖动、路径与属性变化。
+    return {list}: 文件名, 按时间升序'''
+    rnd= random.Random(seed)
+    os.makedirs(out_dir, exist_ok= True)
+    ases= [3356, 1299, 174, 2914, 6939, 15169, 13335, 8075]
+    t0= 1633348800      # 2021-10-04 12:00 UTC
+    res= []
+    for k in range(files):
+        ts0= t0+ k* 300
+        lines= []
+        for _ in range(n// files):
+            ts= rnd.randint(ts0, ts0+ 299)
+            i= rnd.randrange(1, peers+ 1)
+            ip, asn= f'192.0.2.{i}', 65000+ i
+            j= rnd.randrange(pfxs)
+            pfx= f'10.{j>> 8}.{j& 255}.0/24'
+            if rnd.random()< 0.2:
+                lines.append( (ts, f'BGP4MP|{ts}|W|{ip}|{asn}|{pfx}') )
+                continue
+            path= [asn]+ rnd.sample(ases, rnd.randint(1, 3))+ [64500+ j% 7]
+            origin= rnd.choice(['IGP', 'IGP', 'EGP', 'INCOMPLETE'])
+            lines.append( (ts, f'BGP4MP|{ts}|A|{ip}|{asn}|{pfx}|{" ".join(map(str, path))}|{origin}|{ip}|0|{rnd.choice([0, 10])}||NAG||') )
+        lines.sort()
+        name= os.path.join(out_dir, f'rrc00_updates.20211004.{12+ k* 5// 60:02d}{k* 5% 60:02d}.txt')
+        with open(name, 'w') as f:
+            f.write('\n'.join(l for _, l in lines)+ '\n')
+        res.append(name)
+    return res
+
+
+@pytest.fixture(scope= 'session')
+def upds(tmp_path_factory):
+    '''- 3个5分钟的updates文件, 共3万条报文、20个peer、2000个前缀'''
+    return writeUpdates(str(tmp_path_factory.mktemp('upds')))
+
+@pytest.fixture(scope= 'session')
+def run_fet():
+    '''- return {function}: `run(paths, raw_dir, feats= FEATS, sketch= None, **FET参数)` -> `(FET.FET, 按time_bin排序的特征csv)`;
+    `monitorHandler`以追加方式写出csv, 故每个raw_dir只运行一次'''
+    def run(paths, raw_dir, feats= FEATS, sketch= None, **kw):
+        fet= FET.FET(raw_dir= raw_dir, **kw)
+        fet.setCustomFeats(list(feats), sketch= sketch)
+        fet.need_rib= False
+        fet.monitorHandler(paths, None, None, 'evt', 'rrc00', dont_label= True)
+        return fet, pl.read_csv(glob.glob(raw_dir+ 'features/*.csv')[0]).sort('time_bin')
+    return run
@@ -0,0 +1,65 @@
+'''
+- 外部命令调度器(`MultiProcess.TaskScheduler`): 优先级顺序、CPU预算与每host并发上限、`after`依赖。用shell命令向日志文件追加标记代替wget/bgpdump。
+'''
+from fastFET.MultiProcess import TaskScheduler
+
+
+def _mark(log, name, hold= 0.3):
+    '''- 开始时记`+name`, 持续hold秒后记`-name`'''
+    return f'echo +{name} >> {log}; sleep {hold}; echo -{name} >> {log}'
+
+def _maxConcurrent(lines, prefix= ''):
+    '''- 由`+x`/`-x`标记序列得到名字以prefix开头的任务的最大同时运行数'''
+    cur, res= 0, 0
+    for l in lines:
+        if l[1:].startswith(prefix):
+            cur+= 1 if l[0]== '+' else -1
+            res= max(res, cur)
+    return res
+
+
+def test_priority_order(tmp_path):
+    log= tmp_path/ 'log'
+    sched= TaskScheduler(cpu_budget= 1, report_interval= 60)
+    for prio in [3, 1, 2, 0]:
+        sched.addTask(f'echo {prio} >> {log}', priority= prio)
+    rcs= sched.run()
+    assert rcs== {0: 0, 1: 0, 2: 0, 3: 0}
+    assert log.read_text().split()== ['0', '1', '2', '3']
+
+def test_cpu_budget(tmp_path):
+    log= tmp_path/ 'log'
+    sched= TaskScheduler(cpu_budget= 2, report_interval= 60)
+    for i in range(5):
+        sched.addTask(_mark(log, i))
+    assert set(sched.run().values())== {0}
+    lines= log.read_text().split()
+    assert len(lines)== 10
+    assert _maxConcurrent(lines)== 2
+
+def test_host_limit(tmp_path):
+    '''- 下载任务按host限流, 不占CPU预算'''
+    log= tmp_path/ 'log'
+    sched= TaskScheduler(host_limit= {'a': 1}, cpu_budget= 1, report_interval= 60)
+    for i in range(3):
+        sched.addTask(_mark(log, f'a{i}'), kind= 'download', host= 'a')
+        sched.addTask(_mark(log, f'b{i}'), kind= 'download', host= 'b')
+    sched.run()
+    lines= log.read_text().split()
+    assert _maxConcurrent(lines, 'a')== 1
+    assert _maxConcurrent(lines, 'b')== 3
+    assert _maxConcurrent(lines)== 4
+
+def test_after(tmp_path):
+    '''- 依赖成功结束后才启动; 依赖失败时被跳过(rc为None), 并向下传递'''
+    log= tmp_path/ 'log'
+    sched= TaskScheduler(cpu_budget= 4, report_interval= 60)
+    ok= sched.addTask(_mark(log, 'dep'), kind= 'download', host= 'h')
+    child= sched.addTask(f'echo +child >> {log}', after= ok)
+    bad= sched.addTask('exit 3', kind= 'download', host= 'h')
+    skipped= sched.addTask(f'echo +skipped >> {log}', after= bad)
+    grandchild= sched.addTask(f'echo +grandchild >> {log}', after= skipped)
+    rcs= sched.run()
+    assert rcs== {ok: 0, child: 0, bad: 3, skipped: None, grandchild: None}
+    assert sched.tasks[skipped]['state']== sched.tasks[grandchild]['state']== 'skipped'
+    assert log.read_text().split()== ['+dep', '-dep', '+child']
@@ -0,0 +1,57 @@
+'''
+- 采集点活跃度索引(`bgpToolKit.FileSizeIndex`): 以本地镜像为数据源(`os.stat`, 不联网), 检查文件大小、按月落盘与增量更新。
+'''
+import os
+from datetime import datetime
+
+import pytest
+
+from fastFET.bgpToolKit import FileSizeIndex
+
+
+def _write(path, mb):
+    '''- 写一个大小为mb MB的(稀疏)文件'''
+    os.makedirs(os.path.dirname(path), exist_ok= True)
+    with open(path, 'wb') as f:
+        f.truncate(int(mb* 10**6))
+
+@pytest.fixture
+def index(tmp_path):
+    '''- rrc00在2021-09-30末与2021-10-01初的updates文件(含一个不在5分钟整点上的文件); rrc01不在镜像中'''
+    ris= tmp_path/ 'ris'
+    for t, mb in [('20210930.2350', 1), ('20210930.2355', 2), ('20210930.2357', 9), ('20211001.0000', 3), ('20211001.0005', 4)]:
+        _write(ris/ 'rrc00'/ f'{t[:4]}.{t[4:6]}'/ f'updates.{t}.gz', mb)
+    return FileSizeIndex(root= f'{tmp_path}/index/', mirror= {'ris_root': str(ris)}, workers= 2), ris
+
+
+def test_query_sizes(index):
+    idx, _= index
+    df= idx.query(['rrc00'], '20210930.2350', '20211001.0000')
+    assert df.columns== ['collector', 'ts', 'size']
+    assert df['collector'].to_list()== ['rrc00']* 3
+    assert df['ts'].to_list()== [datetime(2021, 9, 30, 23, 50), datetime(2021, 9, 30, 23, 55), datetime(2021, 10, 1)]
+    assert df['size'].to_list()== [1., 2., 3.]
+    assert sorted(os.listdir(f'{idx.root}rrc00'))== ['2021.09.parquet', '2021.10.parquet']
+
+def test_past_month_not_refetched(index):
+    idx, ris= index
+    assert idx.update(['rrc00'], '20210930.0000', '20211001.0000')== []
+    _write(ris/ 'rrc00'/ '2021.10'/ 'updates.20211001.0000.gz', 5)
+    assert not idx._is_stale('rrc00', '2021.10')
+    assert idx.query(['rrc00'], '20211001.0000')['size'].to_list()== [3.]
+        # 当前月份总是重新抓取
+    month= datetime.now().strftime('%Y.%m')
+    os.makedirs(f'{idx.root}rrc00', exist_ok= True)
+    open(idx._path('rrc00', month), 'w').close()
+    assert idx._is_stale('rrc00', month)
+
+def test_missing_collector_retried(index):
+    idx, ris= index
+    assert idx.update(['rrc00', 'rrc01'], '20210930.2350')== [('rrc01', '2021.09')]
+    assert not os.path.exists(idx._path('rrc01', '2021.09'))
+    assert idx.query(['rrc01'], '20210930.2350', update= False).height== 0
+        # 镜像补齐后, 下次更新只重新抓取失败的月份
+    _write(ris/ 'rrc01'/ '2021.09'/ 'updates.20210930.2350.gz', 6)
+    assert idx.update(['rrc00', 'rrc01'], '20210930.2350')== []
+    df= idx.query(['rrc00', 'rrc01'], '20210930.2350', update= False)
+    assert df.select(['collector', 'size']).rows()== [('rrc00', 1.), ('rrc01', 6.)]
@@ -0,0 +1,51 @@
+'''
+- 按peer输出(`FET(by_peer= True)`): 各peer的特征在每个time_bin上汇总后与全局特征一致。
+'''
+import glob
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+    # 报文或以peer为键的一部分的分组计数: 全局值为各peer之和
+ADDITIVE= ['v_total', 'v_A', 'v_W', 'v_IGP', 'v_EGP', 'v_ICMP', 'v_peer', 'v_pp_t_cnt', 'v_pp_A_cnt', 'v_pp_W_cnt', 'v_oriAS_peer_cnt', 'v_oriAS_pp_cnt',
+    'is_WA', 'is_AW', 'is_WAW', 'is_longer_path', 'is_shorter_path', 'is_longer_unq_path', 'is_shorter_unq_path', 'is_new', 'is_dup_ann', 'is_AWnA',
+    'is_imp_wd', 'is_WnA', 'is_AWn', 'is_AnW', 'is_WAn', 'is_dup_wd', 'is_dup', 'is_flap', 'is_NADA', 'is_imp_wd_spath', 'is_imp_wd_dpath']+ \
+    [ f'type_{i}' for i in range(4) ]+ [ f'ED_{i}' for i in range(11) ]
+    # 最大值: 全局值为各peer的最大值
+MAXIMUM= ['v_pp_t_max', 'v_pp_A_max', 'v_pp_W_max', 'v_oriAS_peer_max', 'v_oriAS_pp_max', 'path_len_max', 'path_unq_len_max', 'ED_max']
+    # 不含peer的键的去重计数: 介于各peer的最大值与和之间
+DISTINCT= ['v_pfx_t_cnt', 'v_pfx_A_cnt', 'v_pfx_W_cnt', 'v_oriAS_t_cnt', 'v_oriAS_pfx_cnt', 'As_total_cnt']
+
+
+@pytest.fixture(scope= 'module')
+def runs(tmp_path_factory, upds, run_fet):
+    '''- return {tuple}: (全局特征, 每个time_bin上各peer特征的和与最大值)'''
+    raw_dir= f'{tmp_path_factory.mktemp("peer")}/'
+    _, glob_df= run_fet(upds, raw_dir, by_peer= True)
+    peer_df= pl.read_parquet(glob.glob(raw_dir+ 'features/*__peer.parquet')[0])
+    assert peer_df['peer_AS'].n_unique()== 20
+    feats= ADDITIVE+ MAXIMUM+ DISTINCT
+    agg= peer_df.groupby('time_bin').agg(
+        [ pl.col(c).cast(pl.Float64).sum().alias(c+ '__sum') for c in feats ]+
+        [ pl.col(c).cast(pl.Float64).max().alias(c+ '__max') for c in feats ] ).sort('time_bin')
+    glob_df= glob_df.with_column(pl.col('time_bin').cast(agg['time_bin'].dtype))
+    assert glob_df['time_bin'].to_list()== agg['time_bin'].to_list()
+    return glob_df.select([ pl.col(c).cast(pl.Float64) for c in feats ]), agg
+
+def _pick(df, feats, suffix):
+    return df.select([ pl.col(c+ suffix).alias(c) for c in feats ])
+
+
+def test_additive_feats_sum(runs):
+    glob_df, agg= runs
+    assert_frame_equal(glob_df.select(ADDITIVE), _pick(agg, ADDITIVE, '__sum'))
+
+def test_max_feats(runs):
+    glob_df, agg= runs
+    assert_frame_equal(glob_df.select(MAXIMUM), _pick(agg, MAXIMUM, '__max'))
+
+def test_distinct_feats_bounded(runs):
+    glob_df, agg= runs
+    for c in DISTINCT:
+        assert (_pick(agg, [c], '__max')[c]<= glob_df[c]).all(), c
+        assert (glob_df[c]<= _pick(agg, [c], '__sum')[c]).all(), c
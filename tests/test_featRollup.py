@@ -0,0 +1,17 @@
+'''
+- 上卷(`featRollup`): 以60s运行并保存部分聚合(`FET(partials= True)`)后上卷到更粗的slot, 与以该slot直接运行的结果一致(全部传统特征)。
+'''
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+
+@pytest.mark.parametrize('slot', [300, 900])
+def test_rollup_equals_direct_run(upds, run_fet, tmp_path, slot):
+    fet, fine= run_fet(upds, f'{tmp_path}/fine/', slot= 60, partials= True)
+    _, direct= run_fet(upds, f'{tmp_path}/direct/', slot= slot)
+    rolled= pl.read_csv(fet.rollup(slot)[0]).sort('time_bin')
+
+    assert fine.height> direct.height> 0
+    assert rolled.columns== direct.columns
+    assert_frame_equal(rolled, direct, check_dtype= False)
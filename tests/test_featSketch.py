@@ -0,0 +1,47 @@
+'''
+- sketch模式(`featSketch`): 在`synthUpdates`的合成数据上, 估计值与精确模式的`v_*`等特征之差在文档所述的误差界内。
+'''
+import numpy as np
+import pytest
+
+from fastFET import featSketch
+
+CATES= ['volume', 'path']
+
+
+@pytest.fixture(scope= 'module')
+def runs(tmp_path_factory, run_fet):
+    '''- 同一输入上的精确模式与sketch模式(volume, path)。slot=300: 每个时间片3万条报文, 使ε·N ≥ 1条'''
+    tmp= tmp_path_factory.mktemp('sketch')
+    paths= featSketch.synthUpdates(str(tmp/ 'upds'), n= 120000, files= 4, peers= 40)
+    _, exact= run_fet(paths, f'{tmp}/exact/', feats= CATES, slot= 300)
+    _, est= run_fet(paths, f'{tmp}/sketch/', feats= CATES, sketch= CATES, slot= 300)
+    return exact, est
+
+def _feats(suffix):
+    return [ f for cate in CATES for f in featSketch.cateFeats[cate] if f.endswith(suffix) ]
+
+
+def test_same_bins(runs):
+    exact, est= runs
+    assert exact.height== 4
+    assert exact['time_bin'].to_list()== est['time_bin'].to_list()
+
+@pytest.mark.parametrize('feat', ['v_peer']+ _feats('_cnt')+ _feats('_avg'))
+def test_hll_within_rse(runs, feat):
+    '''- HyperLogLog(及N/去重计数的`*_avg`): 相对误差不超过4倍相对标准误差'''
+    exact, est= runs
+    rse= featSketch.Sketcher().bound()['hll_rse']
+    e, s= exact[feat].to_numpy().astype(float), est[feat].to_numpy().astype(float)
+    assert np.all( np.abs(s- e)<= 4* rse* e )
+
+@pytest.mark.parametrize('feat', _feats('_max'))
+def test_countmin_within_eps(runs, feat):
+    '''- Count-Min: f ≤ f̂ ≤ f+ ε·N, N为时间片内参与计数的报文数(= 精确的`*_avg`·`*_cnt`)'''
+    exact, est= runs
+    eps= featSketch.Sketcher().bound()['cm_eps']
+    base= feat[:-len('_max')]
+    N= (exact[base+ '_avg']* exact[base+ '_cnt']).to_numpy()
+    e, s= exact[feat].to_numpy(), est[feat].to_numpy()
+    assert np.all(e<= s)
+    assert np.all(s<= e+ eps* N)
@@ -0,0 +1,85 @@
+'''
+- 特征结果库(`featStore`, `FET(store= True)`): 版本与salt、缺失特征的判定与旧版本替换, 及结果库命中时不重新计算。
+'''
+import os, glob, shutil
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from fastFET import FET, featSketch
+from fastFET.featStore import ResultStore, featVersion
+
+
+def _df(*feats):
+    return pl.DataFrame({ 'time_bin': [2, 0, 1], 'date': ['20211004']* 3, **{ f: [i* 10+ 2, i* 10, i* 10+ 1] for i, f in enumerate(feats) } })
+
+
+def test_featVersion():
+    v= featVersion('v_A')
+    assert len(v)== 12 and v== featVersion('v_A', '')
+    assert featVersion('v_A', 'x')!= v
+    assert len({ featVersion(f) for f in ['v_A', 'v_W', 'path_len_max', 'ratio_ann', 'ED_max'] })== 5
+
+def test_resultStore(tmp_path):
+    rs= ResultStore(f'{tmp_path}/', 'evt', 'rrc00', 60)
+    assert rs.dir== f'{tmp_path}/event=evt/collector=rrc00/slot=60/'
+    assert rs.stored()== {} and rs.meta()== {}
+    assert rs.missing({'v_A': '1', 'v_W': '1'})== ['v_A', 'v_W']
+
+    rs.write(_df('v_A', 'v_W', 'v_total'), {'v_A': '1', 'v_W': '1'}, meta= {'date': '20211004'})
+    assert rs.stored()== {'v_A': '1', 'v_W': '1'}           # 只保存vers中的特征
+    assert rs.meta()== {'date': '20211004'}
+    assert rs.missing({'v_W': '1', 'v_A': '2', 'v_total': '1'})== ['v_A', 'v_total']
+    assert_frame_equal(rs.load({'v_W': '1', 'v_A': '1'}), _df('v_A', 'v_W').select(['time_bin', 'date', 'v_W', 'v_A']).sort('time_bin'))
+
+        # 新版本替换旧版本的文件
+    rs.write(_df('v_total', 'v_A').with_column(pl.col('v_A')* 2), {'v_A': '2', 'v_total': '1'})
+    assert rs.stored()== {'v_A': '2', 'v_W': '1', 'v_total': '1'}
+    assert sorted(os.listdir(rs.dir))== ['_date.parquet', 'meta.json', 'v_A__2.parquet', 'v_W__1.parquet', 'v_total__1.parquet']
+    assert rs.load({'v_A': '2'})['v_A'].to_list()== [20, 22, 24]
+    assert rs.meta()== {'date': '20211004'}
+
+def test_featVersions(upds, tmp_path):
+    '''- salt: 输入文件的大小与mtime使全部特征失效; sketch参数只影响该类别中被估计的特征'''
+    paths= [ shutil.copy(p, tmp_path) for p in upds ]
+    fet= FET.FET(raw_dir= f'{tmp_path}/raw/', store= True)
+    fet.setCustomFeats(['volume', 'path'])
+    vers= fet.featVersions(paths)
+    assert list(vers)== fet.featNms and vers== fet.featVersions(paths[::-1])
+    st= os.stat(paths[1])
+    os.utime(paths[1], ns= (st.st_atime_ns, st.st_mtime_ns+ 10**9))
+    touched= fet.featVersions(paths)
+    assert all( touched[f]!= vers[f] for f in vers )
+
+    fet.setCustomFeats(['volume', 'path'], sketch= {'volume': {'p': 14}})
+    sk= fet.featVersions(paths)
+    changed= { f for f in vers if sk[f]!= touched[f] }
+    assert changed== set(featSketch.cateFeats['volume'])
+
+def test_store_reuse(upds, tmp_path, run_fet):
+    '''- 再次运行时特征均从结果库读出; 输入文件变化后全部重新计算, 结果与不用结果库时一致'''
+    paths= [ shutil.copy(p, tmp_path) for p in upds ]
+    raw_dir= f'{tmp_path}/raw/'
+    feats= ['volume', 'dynamic', 'ratio']
+    _, ref= run_fet(paths, f'{tmp_path}/plain/', feats= feats)
+    fet, first= run_fet(paths, raw_dir, feats= feats, store= True)
+    assert_frame_equal(first, ref)
+    rs= ResultStore(raw_dir+ 'results/', 'evt', 'rrc00', fet.slot)
+    vers= fet.featVersions(paths)
+    assert rs.missing(vers)== []
+
+    def fail(*a, **k):
+        raise AssertionError('features should be read from the result store')
+    fet2= FET.FET(raw_dir= raw_dir, store= True)
+    fet2.setCustomFeats(feats)
+    fet2.need_rib= False
+    fet2._chunksHandler= fail
+    fet2.monitorHandler(paths, None, None, 'evt', 'rrc00', dont_label= True)
+    assert_frame_equal(pl.read_csv(glob.glob(raw_dir+ 'features/*.csv')[0]).sort('time_bin'), ref)
+
+    with open(paths[0], 'a') as f:
+        f.write('\n')
+    _, again= run_fet(paths, raw_dir, feats= feats, store= True)
+    assert_frame_equal(again, ref)
+    assert set(rs.stored().items())== set(fet.featVersions(paths).items())
+    assert len(glob.glob(rs.dir+ '*__*.parquet'))== len(vers)
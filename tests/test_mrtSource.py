@@ -0,0 +1,80 @@
+'''
+- 本地镜像数据源(`mrtSource.MirrorSource`): url与镜像路径的对应、缺失文件的HTTP回退、按时间段列出与软链接。均不访问网络。
+'''
+import os
+from datetime import datetime
+
+import pytest
+
+from fastFET import mrtSource
+from fastFET.mrtSource import MirrorSource, RIS_URL, RV_URL
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok= True)
+    open(path, 'w').close()
+    return str(path)
+
+@pytest.fixture
+def mirror(tmp_path):
+    '''- rrc00在2021-09-30与2021-10-04(跨月)各有两个updates文件; 无RouteViews镜像'''
+    ris= tmp_path/ 'ris'
+    files= [ _touch(ris/ 'rrc00'/ m/ f'updates.{t}.gz') for m, t in
+        [('2021.09', '20210930.2355'), ('2021.10', '20211001.0000'), ('2021.10', '20211004.1200'), ('2021.10', '20211004.1205')] ]
+    return str(ris), files
+
+
+def test_locate(mirror):
+    ris, files= mirror
+    src= MirrorSource(ris_root= ris)
+    assert src.locate('updates', 'rrc00', '20211004.1200')== files[2]
+    assert src.locate('updates', 'rrc00', datetime(2021, 10, 4, 12, 5))== files[3]
+    assert src.locate('rib', 'rrc00', '20211004.0000')== os.path.join(ris, 'rrc00/2021.10/bview.20211004.0000.gz')
+        # 镜像缺失: 不回退时仍为本地路径(视为不存在), 回退时为官网url
+    missing= src.locate('updates', 'rrc00', '20211004.1210')
+    assert missing== os.path.join(ris, 'rrc00/2021.10/updates.20211004.1210.gz')
+    assert not src.exists(missing)
+    url= MirrorSource(ris_root= ris, http_fallback= True).locate('updates', 'rrc00', '20211004.1210')
+    assert url== f'{RIS_URL}rrc00/2021.10/updates.20211004.1210.gz'
+        # 未配置该项目的镜像
+    assert src.locate('updates', 'route-views.sg', '20211004.1200')== f'{RV_URL}route-views.sg/bgpdata/2021.10/UPDATES/updates.20211004.1200.bz2'
+
+def test_exists_and_host(mirror):
+    ris, files= mirror
+    src= MirrorSource(ris_root= ris)
+    assert src.exists(files[0])
+    assert not src.exists(f'{RIS_URL}rrc00/2021.10/updates.20211004.1210.gz')      # 不回退时url视为不存在, 不发请求
+    assert src.host(files[0])== 'localhost'
+    assert src.host(f'{RIS_URL}rrc00/')== 'data.ris.ripe.net'
+    assert src.fetchCmd(files[0], '/tmp/x')== f'ln -sf {files[0]} /tmp/x'
+
+def test_getSource(mirror):
+    ris, _= mirror
+    assert type(mrtSource.getSource())== mrtSource.HttpSource
+    src= mrtSource.getSource({'ris_root': ris, 'http_fallback': True})
+    assert isinstance(src, MirrorSource) and src.http_fallback
+    assert mrtSource.getSource(src) is src
+
+def test_listFiles(mirror):
+    ris, files= mirror
+    src= MirrorSource(ris_root= ris)
+    assert src.listFiles('updates', 'rrc00', datetime(2021, 9, 30, 8), datetime(2021, 10, 1, 3))== files[:2]
+    assert src.listFiles('updates', 'rrc00', datetime(2021, 10, 4, 12), datetime(2021, 10, 4, 12))== files[2:]
+        # 回退: 整日的5分钟间隔以url补齐
+    res= MirrorSource(ris_root= ris, http_fallback= True).listFiles('updates', 'rrc00', datetime(2021, 10, 4), datetime(2021, 10, 4))
+    assert len(res)== 288
+    assert res[0]== f'{RIS_URL}rrc00/2021.10/updates.20211004.0000.gz'
+    assert res[144: 146]== files[2:]
+    assert sum(not r.startswith('http') for r in res)== 2
+
+def test_fetchRange(mirror, tmp_path):
+    ris, files= mirror
+    dest_lib= f'{tmp_path}/raw/'
+    dest= f'{dest_lib}rrc00/rrc00_updates.20211004.1200.gz'
+    os.makedirs(os.path.dirname(dest))
+    os.symlink(f'{tmp_path}/gone.gz', dest)         # 指向已不存在文件的旧链接
+    MirrorSource(ris_root= ris).fetchRange('updates', 'rrc00', datetime(2021, 10, 4), datetime(2021, 10, 4), dest_lib)
+    assert sorted(os.listdir(f'{dest_lib}rrc00'))== ['rrc00_updates.20211004.1200.gz', 'rrc00_updates.20211004.1205.gz']
+    for f in files[2:]:
+        link= f'{dest_lib}rrc00/rrc00_{os.path.basename(f)}'
+        assert os.path.islink(link) and os.readlink(link)== f
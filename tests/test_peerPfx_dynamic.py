@@ -0,0 +1,152 @@
+'''
+- 动态类特征(`featTradition.peerPfx_dynamic`)与基线实现(按(peer_AS, pfx_id)聚合为列表后explode)的等价性。
+- 输入为多个chunk, 经`featTradition.peerPfx`拼接历史行(`utils.PeerPfxState`), 比较各chunk按time_bin聚合后的全部特征。
+'''
+import types
+import numpy as np
+import polars as pl
+import pytest
+
+from fastFET import utils, featTradition
+from fastFET.featTree import featTree
+
+DYNAMIC= featTree['peerPfx']['peerPfx_dynamic']
+SCHEMA= [('index',pl.UInt32), ('timestamp', pl.Int32), ('time_bin',utils.bin_dtype), ('msg_type',pl.Int8), ('peer_AS',pl.Int32),
+        ('pfx_id',pl.UInt32), ('path_id',pl.UInt32), ('hash_attr',pl.UInt64), ('path_len',pl.Int64), ('path_unq_len',pl.Int64),
+        ('origin_AS',pl.UInt32), ('tag_hist_cur', pl.Boolean)]
+
+
+def legacy_peerPfx_dynamic(ldf_peerPfx: pl.LazyFrame, obj):
+    '''- 基线实现(参照), 原样保留; 只把列名`dest_pref`改为`pfx_id`、`path_raw`改为`path_id`'''
+    feats= obj.feats_dict[ ('peerPfx', 'peerPfx_dynamic') ] 
+    candidate= {
+        ("is_new",):  
+            (pl.col('tag_hist_cur').all().alias('has_new'), ),   
+        ("is_dup_ann","is_imp_wd","is_WnA","is_AWn","is_AnW","is_WAn","is_dup_wd","is_dup","is_imp_wd_spath","is_imp_wd_dpath"):    
+            (pl.col('msg_type'), 'msg_type'),
+        ("is_WA","is_AW","is_dup_ann","is_AWnA","is_imp_wd","is_dup_wd","is_dup","is_flap","is_NADA","is_imp_wd_spath","is_imp_wd_dpath"):    
+            (pl.col('msg_type').diff().alias('type_diff'), 'type_diff'),
+        ("is_WAW","is_AWnA","is_WnA","is_AWn","is_AnW","is_WAn","is_flap","is_NADA"):    
+            (pl.col('msg_type').diff().diff().alias('type_diff2'), 'type_diff2'),
+        ("is_imp_wd_spath","is_imp_wd_dpath"):    
+            (pl.col('path_id').hash(k0= 42).diff().alias('hash_path_diff'), 'hash_path_diff'),
+            
+        ("is_longer_path","is_shorter_path"):    
+            (pl.when(pl.col('path_len')== 0).then(None).otherwise(pl.col('path_len')).fill_null('forward').diff().alias('path_len_diff'), 'path_len_diff'),
+        ("is_longer_unq_path","is_shorter_unq_path"):    
+            (pl.when(pl.col('path_unq_len')== 0).then(None).otherwise(pl.col('path_unq_len')).fill_null('forward').diff().alias('path_unq_len_diff'), 'path_unq_len_diff'),
+        #("is_MOAS",):    (pl.col('origin_AS').alias('is_MOAS'), 'is_MOAS'),     
+
+        ("is_imp_wd","is_dup","is_flap","is_NADA","is_imp_wd_spath","is_imp_wd_dpath"):    
+            (pl.when(pl.col('msg_type')== 0).then(None).otherwise(pl.col('hash_attr')).fill_null('forward').diff().alias('hash_attr_diff'), 'hash_attr_diff'),
+        }
+    agg_apend, explode_apend = [], []
+    for k, v in candidate.items():
+        if (set(k) & set(feats)):
+            agg_apend.append(v[0])
+            try:     explode_apend.append(v[1])
+            except:  pass     
+    agg_list= [pl.col('index'),
+            pl.col('time_bin'),
+            pl.col('tag_hist_cur').alias('belong_cur'),  
+            ]+ agg_apend
+    explode_list= ['index','time_bin', 'belong_cur']+ explode_apend
+     
+    '''modify_list= []
+    if 'path_len_diff' in explode_list: modify_list.append( pl.col('path_len_diff').cast(pl.Int8) )
+    if 'path_unq_len_diff' in explode_list: modify_list.append( pl.col('path_unq_len_diff').cast(pl.Int8) )'''
+         
+    #if 'is_MOAS' in explode_list: modify_list.append( pl.col('is_MOAS').diff().cast(pl.Boolean).cast(pl.Int8) )
+    
+    ldf_13= (ldf_peerPfx.groupby(['peer_AS','pfx_id']) 
+        .agg(agg_list)
+        .explode(explode_list)   
+        .filter( pl.col('belong_cur')== True )   
+        #.with_columns(modify_list)  
+    )
+
+    candidate2= {
+        ('is_new',):
+            [(pl.col('has_new')- (pl.col('has_new').shift_and_fill(1, 0)) ).alias('is_new'), 'is_new'], 
+        ('is_dup_ann', 'is_dup', 'is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath'):
+           [ ( (pl.col('msg_type')== 1) & (pl.col('type_diff')== 0)).alias('is_dup_ann'), 'is_dup_ann'],
+        ('is_AWnA', 'is_flap', 'is_NADA'):
+            [((pl.col('type_diff')== 1) & (pl.col('type_diff2')>=1)).alias('is_AWnA'), 'is_AWnA'],
+    }
+    agg2_apend, explode2_apend= [], []
+
+    for k,v in candidate2.items():
+        if (set(k) & set(feats)): 
+            agg2_apend.append(v[0])
+            explode2_apend.append(v[1])
+    ldf_3= (ldf_13.groupby(['peer_AS','pfx_id'])
+            .agg([pl.col('index')]+ agg2_apend)
+            .explode(['index']+ explode2_apend)
+            )
+    
+    modify_list3= []
+    if 'is_new' in feats: 
+        modify_list3.append( pl.col('is_new').cast(pl.Boolean) )
+    if len(set(['is_imp_wd', 'is_imp_wd_spath', 'is_imp_wd_dpath']) & set(feats)): 
+        modify_list3.append( ((pl.col('is_dup_ann')== 1) & (pl.col('hash_attr_diff')!= 0)).alias('is_imp_wd') )
+    ldf_res17= ( ldf_13.join( 
+                    ldf_3.select(['index']+ explode2_apend),     
+                    on='index')
+                .with_columns( modify_list3 )
+                )
+    
+    return ldf_res17.groupby('time_bin')
+
+
+
+def chunks(n_chunk= 3, rows= 400, seed= 0):
+    '''- 若干chunk的预处理结果(列同`SCHEMA`去掉`tag_hist_cur`): 少量(peer, pfx)键反复宣告/撤销, 属性与路径取值很少, 以产生重复、抖动与跨chunk的历史行'''
+    rng= np.random.default_rng(seed)
+    res, ts= [], 0
+    for _ in range(n_chunk):
+        msg= (rng.random(rows)< 0.7).astype(np.int8)
+        path_len= np.where(msg== 1, rng.integers(1, 5, rows), 0)
+        ts_col= ts+ np.sort(rng.integers(0, 600, rows))
+        ts+= 600
+        df= pl.DataFrame({
+            'index':        np.arange(rows, dtype= np.uint32),
+            'timestamp':    ts_col.astype(np.int32),
+            'time_bin':     ts_col// 60,
+            'msg_type':     msg,
+            'peer_AS':      rng.integers(65001, 65004, rows).astype(np.int32),
+            'pfx_id':       rng.integers(0, 8, rows).astype(np.uint32),
+            'path_id':      rng.integers(1, 4, rows).astype(np.uint32),
+            'hash_attr':    rng.integers(0, 3, rows).astype(np.uint64),
+            'path_len':     path_len,
+            'path_unq_len': np.maximum(path_len- rng.integers(0, 2, rows), 0),
+            'origin_AS':    rng.integers(1, 4, rows).astype(np.uint32),
+        }).with_columns([
+            pl.col('time_bin').cast(utils.bin_dtype),
+            pl.when(pl.col('msg_type')== 1).then(pl.col('path_id')).otherwise(None).alias('path_id'),
+        ])
+        res.append(df)
+    return res
+
+def run(dynamic, feats):
+    '''- 逐chunk执行`peerPfx`与`dynamic`, return {pl.DataFrame}: 各chunk按time_bin聚合的结果, 纵向拼接'''
+    obj= types.SimpleNamespace( feats_dict= {('peerPfx', 'peerPfx_dynamic'): feats}, pp_state= utils.PeerPfxState(SCHEMA),
+                                midnode_res= {}, grain= None, by_peer= False )
+    res= []
+    for df in chunks():
+        ldf_peerPfx= featTradition.peerPfx(df.lazy(), obj)
+        res.append( dynamic(ldf_peerPfx, obj).agg([ DYNAMIC[f] for f in feats ]).sort('time_bin').collect() )
+    return pl.concat(res).with_columns([ pl.col(f).cast(pl.Int64) for f in feats ])
+
+
+@pytest.mark.parametrize('feats', [
+    list(DYNAMIC),
+    ['is_imp_wd_spath', 'is_imp_wd_dpath'],
+    ['is_flap', 'is_NADA', 'is_new'],
+    ['is_longer_path', 'is_shorter_unq_path', 'is_WAW'],
+])
+def test_peerPfx_dynamic_equals_legacy(feats):
+    new= run(featTradition.peerPfx_dynamic, feats)
+    old= run(legacy_peerPfx_dynamic, feats)
+    assert new.columns== old.columns
+    assert new.frame_equal(old)
+    assert new.select([ pl.col(f).sum() for f in feats ]).row(0)!= tuple([0]* len(feats))     # 夹具确实产生了这些事件
@@ -0,0 +1,84 @@
+'''
+- 前缀树(`pfxTrie.PfxTrie`): 在混合IPv4/IPv6的随机前缀上, 各查询与`ipaddress`逐对比较的结果一致。
+'''
+import ipaddress
+import random
+
+import numpy as np
+import pytest
+
+from fastFET.pfxTrie import PfxTrie, parsePrefixes
+
+
+def _randPrefixes(rnd, n):
+    '''- 集中在少数地址块内的随机前缀, 使嵌套关系足够多; IPv6长度跨越64位边界'''
+    res= []
+    for _ in range(n):
+        if rnd.random()< 0.6:
+            net= ipaddress.IPv4Network((rnd.choice([0x0a000000, 0xc0a80000]) | rnd.getrandbits(20), rnd.randint(8, 32)), strict= False)
+        else:
+            net= ipaddress.IPv6Network(((0x20010db8<< 96) | rnd.getrandbits(80), rnd.choice([32, 48, 60, 63, 64, 65, 72, 96, 127, 128])), strict= False)
+        res.append(str(net))
+    return res
+
+def _nets(prefixes):
+    return [ ipaddress.ip_network(p) for p in prefixes ]
+
+def _pairs(q, p):
+    return sorted(zip(q.tolist(), p.tolist()))
+
+@pytest.fixture(scope= 'module')
+def data():
+    rnd= random.Random(32)
+    pfxs= _randPrefixes(rnd, 400)
+    pfxs+= pfxs[:20]                                    # 重复前缀取首次出现的下标
+    queries= pfxs[:100]+ _randPrefixes(rnd, 100)+ ['0.0.0.0/0', '::/0']
+    return pfxs, queries, PfxTrie(pfxs)
+
+
+def test_parse():
+    fam, hi, lo, plen= parsePrefixes(['10.1.2.3/8', '2001:db8::1/127', 'bad', None, '1.2.3.4/33'])
+    assert fam.tolist()== [4, 6, 0, 0, 0]
+    assert plen[:2].tolist()== [8, 127]
+    assert hi[0]== 10<< 56 and lo[0]== 0                   # 主机位清零
+    assert hi[1]== 0x20010db8<< 32 and lo[1]== 0
+
+def test_lookup(data):
+    pfxs, queries, trie= data
+    assert len(trie)== len(set(pfxs))
+    first= { p: i for i, p in reversed(list(enumerate(pfxs))) }
+    assert trie.lookup(queries).tolist()== [ first.get(q, -1) for q in queries ]
+
+@pytest.mark.parametrize('strict', [True, False])
+def test_covering_and_covered(data, strict):
+    pfxs, queries, trie= data
+    nets, qnets= _nets(pfxs), _nets(queries)
+    uniq= sorted({ p: i for i, p in reversed(list(enumerate(pfxs))) }.values())
+    covering, covered= [], []
+    for qi, q in enumerate(qnets):
+        for i in uniq:
+            if nets[i].version!= q.version or (strict and nets[i]== q):
+                continue
+            if q.subnet_of(nets[i]):
+                covering.append((qi, i))
+            if nets[i].subnet_of(q):
+                covered.append((qi, i))
+    assert covering and covered
+    assert _pairs(*trie.covering(queries, strict))== sorted(covering)
+    assert _pairs(*trie.covered(queries, strict))== sorted(covered)
+        # covering: 每个查询内按前缀长度升序, 最后一项即最长匹配
+    q, p= trie.covering(queries, strict)
+    lens= np.array([ nets[i].prefixlen for i in p ])
+    assert np.all( (q[1:]> q[:-1]) | ((q[1:]== q[:-1]) & (lens[1:]> lens[:-1])) )
+
+def test_longestMatch(data):
+    pfxs, queries, trie= data
+    nets, qnets= _nets(pfxs), _nets(queries)
+    for q, res in zip(qnets, trie.longestMatch(queries).tolist()):
+        cands= [ n for n in nets if n.version== q.version and q.subnet_of(n) ]
+        assert (res== -1) if not cands else (nets[res]== max(cands, key= lambda n: n.prefixlen))
+
+def test_ids():
+    trie= PfxTrie(['10.0.0.0/8', '10.1.0.0/16', None], ids= [7, 8, 9])
+    assert trie.lookup(['10.1.0.0/16', '11.0.0.0/8']).tolist()== [8, -1]
+    assert _pairs(*trie.covered(['10.0.0.0/8']))== [(0, 8)]
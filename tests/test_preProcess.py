@@ -0,0 +1,67 @@
+'''
+- 预处理(`FET.preProcess`): 逐文件缓存(`FET._cachedPreProcess`)的命中与失效, 及缓存与否结果一致。
+'''
+import os
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from fastFET import utils, featTree
+from fastFET.FET import preProcess, _cachedPreProcess
+
+FIRST_TS= 1633348800
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return f'{tmp_path}/cache/'
+
+def _need(feats):
+    return featTree.getRequiredCols(feats)
+
+def _norm(df):
+    '''- `path_unq`由`arr.unique()`得到, 元素顺序不确定, 按集合比较'''
+    return df.with_column(pl.col('path_unq').arr.sort()) if 'path_unq' in df.columns else df
+
+
+def test_hit_and_miss(upds, cache_dir):
+    cols, need= _need(['v_A', 'path_len_max', 'is_dup_ann'])
+    utils.makePath(cache_dir)
+    ldf, hit= _cachedPreProcess(utils.raw_fields, upds[0], cache_dir, need, cols)
+    assert not hit and len(os.listdir(cache_dir))== 1
+    ldf2, hit= _cachedPreProcess(utils.raw_fields, upds[0], cache_dir, need, cols)
+    assert hit
+    assert_frame_equal(_norm(ldf.collect()), _norm(ldf2.collect()))
+        # 读取列或派生列不同: 各自缓存
+    _, hit= _cachedPreProcess(utils.raw_fields, upds[0], cache_dir, need| {'origin'}, cols+ ['origin'])
+    assert not hit
+    _, hit= _cachedPreProcess(utils.raw_fields, upds[1], cache_dir, need, cols)
+    assert not hit and len(os.listdir(cache_dir))== 3
+
+def test_touched_file_misses(upds, cache_dir, tmp_path):
+    path= f'{tmp_path}/{os.path.basename(upds[0])}'
+    with open(upds[0]) as f, open(path, 'w') as g:
+        g.write(f.read())
+    utils.makePath(cache_dir)
+    h0= _cachedPreProcess(utils.raw_fields, path, cache_dir, None)[0].collect().height
+    st= os.stat(path)
+    os.utime(path, ns= (st.st_atime_ns, st.st_mtime_ns+ 10**9))
+    _, hit= _cachedPreProcess(utils.raw_fields, path, cache_dir, None)
+    assert not hit
+        # 内容变化(大小不同)后, 结果来自新内容
+    with open(path, 'a') as g:
+        g.write(f'BGP4MP|{FIRST_TS}|W|192.0.2.1|65001|10.0.0.0/24\n')
+    ldf, hit= _cachedPreProcess(utils.raw_fields, path, cache_dir, None)
+    assert not hit
+    assert ldf.collect().height== h0+ 1
+
+@pytest.mark.parametrize('feats', [None, ['v_A', 'path_len_max', 'is_dup_ann', 'ED_avg']])
+@pytest.mark.parametrize('bins', [None, (3, 9)])
+def test_cached_equals_uncached(upds, cache_dir, feats, bins):
+    cols, need= _need(feats) if feats else (None, None)
+    ref= preProcess(utils.raw_fields, upds, 60, FIRST_TS, need, bins= bins, cols= cols)
+    for _ in range(2):      # 首次写入缓存, 再次命中
+        res= preProcess(utils.raw_fields, upds, 60, FIRST_TS, need, cache_dir= cache_dir, bins= bins, cols= cols)
+        assert_frame_equal(_norm(res), _norm(ref))
+    assert len(os.listdir(cache_dir))== len(upds)
@@ -0,0 +1,120 @@
+'''
+- `utils`中的工具: 字符串编号字典`IdEncoder`, AS path解析`pathStr`/`pathList`, 按time_bin切分chunk的`splitChunk`。
+'''
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from fastFET import utils
+from fastFET.utils import IdEncoder
+
+
+def test_idencoder_roundtrip():
+    enc= IdEncoder()
+    df= pl.DataFrame({'n': [0, 1, 2, 3, 4], 'pfx': ['10.0.0.0/24', '10.0.1.0/24', None, '10.0.0.0/24', '2001:db8::/32']})
+    res= enc.encode(df, 'pfx', 'pfx_id')
+    assert res.columns== ['n', 'pfx', 'pfx_id']
+    assert res['n'].to_list()== [0, 1, 2, 3, 4]         # 行序不变
+    assert res['pfx_id'].dtype== pl.UInt32
+    ids= res['pfx_id'].to_list()
+    assert ids[2] is None and ids[0]== ids[3]
+    assert sorted(set(ids)- {None})== [1, 2, 3] and len(enc)== 3
+    back= enc.decode(res.select(['n', 'pfx_id']).lazy(), 'pfx_id', 'pfx').collect()
+    assert_frame_equal(back.select(['n', 'pfx']), df)
+
+def test_idencoder_stable_across_chunks():
+    '''- 同一字典编码多个chunk: 已有的key沿用原编号, 新key接续编号'''
+    enc= IdEncoder()
+    a= enc.encode(pl.DataFrame({'k': ['x', 'y']}), 'k', 'id')
+    b= enc.encode(pl.DataFrame({'k': ['z', 'y', 'x', 'z']}), 'k', 'id')
+    old= dict(a.rows())
+    assert [ old.get(k, v) for k, v in b.rows() ]== b['id'].to_list()
+    assert b['id'][0]== 3 and b['id'][3]== 3 and len(enc)== 3
+    assert enc.encode(pl.DataFrame({'k': ['y']}), 'k', 'id')['id'].to_list()== [old['y']]
+
+def test_idencoder_payload():
+    '''- payload只在key首次出现时记录, 可按编号取回'''
+    enc= IdEncoder()
+    df= pl.DataFrame({'path': ['1 2 3', '4 5', '1 2 3'], 'path_list': [[1, 2, 3], [4, 5], [1, 2, 3]]})
+    res= enc.encode(df, 'path', 'path_id', payload= ['path_list'])
+    enc.encode(pl.DataFrame({'path': ['4 5', '6'], 'path_list': [[0], [6]]}), 'path', 'path_id', payload= ['path_list'])
+    back= enc.decode(res.select('path_id').lazy(), 'path_id', 'path_list', field= 'path_list').collect()
+    assert back['path_list'].to_list()== [[1, 2, 3], [4, 5], [1, 2, 3]]
+    assert dict(enc.table.select(['key', 'path_list']).rows())== {'1 2 3': [1, 2, 3], '4 5': [4, 5], '6': [6]}
+
+
+PATHS= [
+    ('3356 1299 64500',                 [3356, 1299, 64500]),
+    ('3356 3356 3356 174 64500',        [3356, 3356, 3356, 174, 64500]),    # prepending保留
+    ('3356 174 {64500,64501}',          [3356, 174]),                       # AS_SET
+    ('3356 {64500} 174 64502',          [3356, 174, 64502]),
+    ('65001 (65002 65003) 174 64500',   [65001, 174, 64500]),               # AS_CONFED_SEQUENCE
+    ('65001 [65002 65003] 174',         [65001, 174]),                      # AS_CONFED_SET
+    ('(65002) 4200000000 {1} [2]',      [4200000000]),                      # 32位AS号
+    (None,                              None),
+]
+
+def test_pathList():
+    df= pl.DataFrame({'path': [ p for p, _ in PATHS ]})
+    res= df.select([ utils.pathStr('path').alias('s'), utils.pathList('path').alias('l') ])
+    assert res['l'].dtype== pl.List(pl.UInt32)
+    assert res['l'].to_list()== [ l for _, l in PATHS ]
+    assert res['s'].to_list()== [ ' '.join(map(str, l)) if l else None for _, l in PATHS ]
+        # 已经`pathStr`清洗的列(如预处理中)
+    assert df.with_column(utils.pathStr('path')).select(utils.pathList('path', clean= False))['path'].to_list()== [ l for _, l in PATHS ]
+
+def test_pathList_in_preProcess(tmp_path):
+    '''- 预处理后的`path_len`与`origin_AS`不计AS_SET与联盟段'''
+    from fastFET.FET import preProcess
+    path= tmp_path/ 'upds.txt'
+    path.write_text(''.join( f'BGP4MP|1633348800|A|192.0.2.1|65001|10.0.{i}.0/24|{p}|IGP|192.0.2.1|0|0||NAG||\n'
+        for i, (p, _) in enumerate(PATHS[:-1]) ))
+    df= preProcess(utils.raw_fields, [str(path)], 60, 1633348800)
+    assert df['path_list'].to_list()== [ l for _, l in PATHS[:-1] ]
+    assert df['path_len'].to_list()== [ len(l) for _, l in PATHS[:-1] ]
+    assert df['origin_AS'].to_list()== [ l[-1] for _, l in PATHS[:-1] ]
+
+
+FIRST_TS= 1633348800
+
+def _rowsPerBin(df):
+    return dict(df.groupby('time_bin').agg(pl.count()).rows())
+
+def _checkChunks(chunks, paths, slot):
+    '''- 区间首尾不设界且首尾相接; 各chunk(只保留本区间)的行恰好划分全部行, 每个time_bin只落在一个chunk内'''
+    from fastFET.FET import preProcess
+    bins= [ b for _, b in chunks ]
+    assert bins[0][0] is None and bins[-1][1] is None
+    assert all( bins[i][1]== bins[i+1][0] for i in range(len(bins)- 1) )
+    full= _rowsPerBin(preProcess(utils.raw_fields, paths, slot, FIRST_TS))
+    seen= {}
+    for files, b in chunks:
+        assert files== sorted(files)
+        for tb, n in _rowsPerBin(preProcess(utils.raw_fields, files, slot, FIRST_TS, bins= b)).items():
+            assert tb not in seen
+            seen[tb]= n
+    assert seen== full
+    return full
+
+@pytest.mark.parametrize('slot', [60, 120])      # 120s时有跨文件的time_bin
+def test_splitChunk(upds, slot):
+    budget= 5000* utils.ROW_BYTES/ 1024**3
+    chunks= utils.splitChunk(upds, FIRST_TS, slot, mem_budget= budget)
+    full= _checkChunks(chunks, upds, slot)
+    assert len(chunks)> 1
+    for files, (lo, hi) in chunks:
+        rows= [ n for tb, n in full.items() if (lo is None or tb>= lo) and (hi is None or tb< hi) ]
+        assert sum(rows)<= 5000 or len(rows)== 1        # 超出预算的只有单个time_bin
+    if slot== 120:
+        assert any( len(files)> 1 for files, _ in chunks )
+
+def test_splitChunk_burst(upds, tmp_path):
+    '''- 突发时间片单独成chunk, 即使内存预算足够'''
+    burst= tmp_path/ 'rrc00_updates.20211004.1215.txt'
+    ts= FIRST_TS+ 930
+    burst.write_text(''.join( f'BGP4MP|{ts}|A|192.0.2.1|65001|10.9.{i>> 8}.{i& 255}/32|65001 64500|IGP|192.0.2.1|0|0||NAG||\n' for i in range(10000) ))
+    paths= upds+ [str(burst)]
+    chunks= utils.splitChunk(paths, FIRST_TS, 60, mem_budget= 1, burst_ratio= 4)
+    _checkChunks(chunks, paths, 60)
+    assert [ b for _, b in chunks ]== [(None, 15), (15, None)]
+    assert chunks[1][0]== [str(burst)]